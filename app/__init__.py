@@ -1,5 +1,6 @@
 import os
 import logging
+import click
 from logging.handlers import RotatingFileHandler
 from flask import Flask
 from flask_wtf.csrf import CSRFProtect
@@ -11,9 +12,23 @@ from app.models.db import db, migrate
 # Initialize extensions
 csrf = CSRFProtect()
 login_manager = LoginManager()
+DEFAULT_RATE_LIMITS = ["200 per day", "50 per hour"]
+
+def rate_limit_key():
+    """Rate limit API key clients by key and everyone else by address."""
+    from app.utils.api_keys import current_api_key
+    api_key = current_api_key()
+    return f'api-key:{api_key.api_key_id}' if api_key else get_remote_address()
+
+def default_rate_limits():
+    """The default limits: the key's tier for API key clients, else the per-address limits."""
+    from app.utils.api_keys import current_api_key, api_key_auth
+    api_key = current_api_key()
+    return api_key_auth.tier_limits(api_key.api_key_tier) if api_key else '; '.join(DEFAULT_RATE_LIMITS)
+
 limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"]
+    key_func=rate_limit_key,
+    default_limits=[default_rate_limits]
 )
 
 def create_app(config=None):
@@ -55,6 +70,12 @@ def create_app(config=None):
     except OSError:
         pass
     
+    # Share rate limit counters between worker processes in a SQLite database
+    # (registers the sqlite:// scheme); testing keeps them in memory
+    from app.utils import limiter_storage
+    if not app.testing:
+        app.config.setdefault('RATELIMIT_STORAGE_URI', 'sqlite:///' + os.path.join(app.instance_path, 'ratelimit.db'))
+    
     # Initialize extensions with the app
     csrf.init_app(app)
     login_manager.init_app(app)
@@ -66,12 +87,45 @@ def create_app(config=None):
     db.init_app(app)
     migrate.init_app(app, db)
     
-    # Set up user loader for Flask-Login
-    from app.models.user import User
+    # Start buffering security log rows for the background writer
+    from app.utils.security_log_writer import security_log_writer
+    security_log_writer.init_app(app)
+    
+    # Hash and verify passwords on a pool of worker processes
+    from app.utils.passwords import password_hasher
+    password_hasher.init_app(app)
+    
+    # Count failed logins in a database shared by the workers instead of writing each one to the users table
+    from app.utils.login_failures import login_failures
+    login_failures.init_app(app)
+    
+    # Configure the cache for dashboard and report data
+    from app.utils.cache import response_cache
+    response_cache.init_app(app)
+    
+    # Configure the live update stream
+    from app.utils.events import store_events
+    store_events.init_app(app)
+    
+    # Fail requests that run more queries than they should (on by default in testing)
+    from app.utils.query_budget import query_budget_guard
+    query_budget_guard.init_app(app)
+    
+    # Set up user loader for Flask-Login, serving the signed-in user from the identity cache
+    from app.utils.identity import identity_cache
+    identity_cache.init_app(app)
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return identity_cache.load(int(user_id))
+    
+    # Sign machine clients in per request with their API key, bypassing the session and CSRF check
+    from app.utils.api_keys import api_key_auth, current_api_key
+    api_key_auth.init_app(app)
+    
+    @login_manager.request_loader
+    def load_user_from_request(request):
+        return current_api_key()
     
     # Configure logging
     configure_logging(app)
@@ -173,6 +227,188 @@ def register_commands(app):
         from app.models.init_db import init_database
         init_database()
     
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Add missing tables, columns and indexes to an existing database."""
+        from app.models.init_db import upgrade_database
+        upgrade_database()
+    
+    @app.cli.command('rebuild-stock-summary')
+    def rebuild_stock_summary_command():
+        """Recompute the per-store stock summary tables from the inventory and ledger."""
+        from app.utils.stock_summary import rebuild_stock_summary
+        rebuild_stock_summary()
+        print("Rebuilt the stock summary tables.")
+    
+    @app.cli.command('reconcile')
+    @click.option('--store-id', 'store_ids', type=int, multiple=True, help='Only check this store (repeatable).')
+    @click.option('--workers', type=int, help='Worker processes (default: one per CPU).')
+    @click.option('--fix', is_flag=True, help='Write STOCK_ADJUSTMENT transactions for the drifts found.')
+    @click.option('--user', 'username', help='User recorded on the adjustments (required with --fix).')
+    def reconcile_command(store_ids, workers, fix, username):
+        """Check item quantities against the sum of their ledger changes."""
+        from app.models.user import User
+        from app.utils.reconcile import reconcile, write_adjustments
+        if fix:
+            user = User.query.filter_by(username=username).first() if username else None
+            if user is None:
+                raise click.BadParameter('give an existing username with --fix', param_hint='--user')
+        
+        drifts = reconcile(store_ids or None, workers)
+        for drift in drifts:
+            print(f"Store {drift.store_id} {drift.part_number}: quantity {drift.quantity}, "
+                  f"ledger {drift.ledger_total}, drift {drift.difference:+d}")
+        print(f"{len(drifts)} items drifted by {sum(abs(drift.difference) for drift in drifts)} units in total.")
+        
+        if fix and drifts:
+            write_adjustments(drifts, user.id)
+            db.session.commit()
+            print(f"Wrote {len(drifts)} stock adjustments.")
+    
+    @app.cli.command('rebuild-stock-alerts')
+    def rebuild_stock_alerts_command():
+        """Re-raise the open low stock alerts from the current quantities and thresholds."""
+        from app.models.db import db
+        from app.utils.alerts import rebuild_stock_alerts
+        raised = rebuild_stock_alerts()
+        db.session.commit()
+        print(f"Raised {raised} stock alerts.")
+    
+    @app.cli.command('stock-as-of')
+    @click.argument('at')
+    @click.option('--store-id', type=int, help='Only include items of this store.')
+    @click.option('--output', type=click.File('w'), default='-', help='CSV file to write (default: stdout).')
+    def stock_as_of_command(at, store_id, output):
+        """Reconstruct item quantities at AT (ISO date or UTC datetime) as CSV."""
+        import csv
+        from app.utils.stock_history import stock_as_of, parse_as_of
+        try:
+            as_of = parse_as_of(at)
+        except ValueError:
+            raise click.BadParameter('expected an ISO date or datetime', param_hint='AT')
+        
+        snapshot = stock_as_of(as_of, store_id)
+        writer = csv.writer(output)
+        writer.writerow(['store_id', 'part_number', 'name', 'item_type', 'quantity'])
+        for item in snapshot['items']:
+            writer.writerow([item['store_id'], item['part_number'], item['name'],
+                             item['item_type'].value, item['quantity']])
+        
+        for snapshot_store_id, totals in sorted(snapshot['stores'].items()):
+            click.echo(f"Store {snapshot_store_id}: {totals['item_count']} items, "
+                       f"{totals['total_units']} units as of {as_of.isoformat()}", err=True)
+    
+    @app.cli.command('snapshot-stock')
+    def snapshot_stock_command():
+        """Snapshot item quantities at the last midnight (UTC). Run daily, e.g. from cron."""
+        from app.models.db import db
+        from app.utils.stock_history import write_snapshots, snapshot_times, last_midnight
+        taken_at = last_midnight()
+        if snapshot_times([taken_at]):
+            print(f"The stock snapshot for {taken_at.isoformat()} already exists.")
+        elif write_snapshots([taken_at]):
+            db.session.commit()
+            print(f"Wrote the stock snapshot for {taken_at.isoformat()}.")
+        else:
+            db.session.commit()
+            print(f"Recorded the stock snapshot for {taken_at.isoformat()}; nothing was in stock.")
+    
+    @app.cli.command('backfill-snapshots')
+    @click.option('--days', type=int, default=90, show_default=True, help='Number of past days to snapshot.')
+    @click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help='First day to snapshot; overrides --days.')
+    def backfill_snapshots_command(days, since):
+        """Write the missing daily stock snapshots for past days."""
+        from datetime import timedelta
+        from app.utils.stock_history import backfill_snapshots, last_midnight
+        first_day = since.date() if since else (last_midnight() - timedelta(days=days)).date()
+        written = backfill_snapshots(first_day)
+        print(f"Wrote {written} stock snapshots since {first_day.isoformat()}.")
+    
+    @app.cli.command('refresh-forecasts')
+    @click.option('--method', type=click.Choice(['ema', 'sma']), help='Forecast method (default: FORECAST_METHOD or ema).')
+    def refresh_forecasts_command(method):
+        """Recompute demand forecasts and reorder points for every item. Run daily, e.g. from cron."""
+        from app.models.db import db
+        from app.utils.forecast import refresh_forecasts
+        count = refresh_forecasts(method)
+        db.session.commit()
+        print(f"Refreshed the forecasts of {count} items.")
+    
+    @app.cli.command('calibrate-password-hash')
+    @click.option('--target-ms', type=int, default=100, show_default=True, help='Time one hash should take.')
+    @click.option('--memory-kib', type=int, default=65536, show_default=True, help='Memory per hash, in KiB.')
+    @click.option('--parallelism', type=int, default=4, show_default=True, help='Threads per hash.')
+    def calibrate_password_hash_command(target_ms, memory_kib, parallelism):
+        """Suggest argon2 parameters for password hashes that take about --target-ms here."""
+        from app.utils.passwords import calibrate
+        (time_cost, memory_cost, parallelism), seconds = calibrate(target_ms / 1000, memory_kib, parallelism)
+        print(f"One hash takes {seconds * 1000:.0f} ms with these settings:")
+        print(f"ARGON2_TIME_COST = {time_cost}")
+        print(f"ARGON2_MEMORY_COST = {memory_cost}")
+        print(f"ARGON2_PARALLELISM = {parallelism}")
+    
+    @app.cli.command('benchmark-limiter')
+    @click.option('--checks', type=int, default=10000, show_default=True, help='Rate limit checks to time.')
+    @click.option('--storage', 'storage_uris', multiple=True,
+                  help='Storage URI to time (repeatable; default: memory:// and RATELIMIT_STORAGE_URI).')
+    def benchmark_limiter_command(checks, storage_uris):
+        """Time the per-request rate limit check of the default limits on each storage."""
+        from app.utils.limiter_storage import benchmark
+        if not storage_uris:
+            storage_uris = ['memory://']
+            if app.config.get('RATELIMIT_STORAGE_URI'):
+                storage_uris.append(app.config['RATELIMIT_STORAGE_URI'])
+        
+        limits = '; '.join(DEFAULT_RATE_LIMITS)
+        print(f"{checks} checks of {limits}:")
+        for storage_uri in storage_uris:
+            seconds = benchmark(storage_uri, limits, checks)
+            print(f"{storage_uri}: {seconds * 1000000:.1f} us per check")
+    
+    @app.cli.command('create-api-key')
+    @click.argument('username')
+    @click.argument('name')
+    @click.option('--tier', help='Rate limit tier (default: API_KEY_DEFAULT_TIER).')
+    @click.option('--store-id', type=int, help='Only allow the key to work in this store.')
+    def create_api_key_command(username, name, tier, store_id):
+        """Create an API key NAME that acts as USERNAME, and print it."""
+        from app.models.user import User
+        from app.utils.api_keys import create_api_key
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter('no such user', param_hint='USERNAME')
+        try:
+            api_key, key = create_api_key(user, name, tier, store_id)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        db.session.commit()
+        print(f"Created API key {api_key.prefix} ({api_key.tier} tier). It won't be shown again:")
+        print(key)
+    
+    @app.cli.command('list-api-keys')
+    def list_api_keys_command():
+        """List the API keys and whether they are revoked."""
+        from app.models.api_key import ApiKey
+        for api_key in ApiKey.query.order_by(ApiKey.id).all():
+            status = f"revoked {api_key.revoked_at:%Y-%m-%d}" if api_key.revoked_at else 'active'
+            store = f"store {api_key.store_id}" if api_key.store_id else 'user stores'
+            print(f"{api_key.prefix}  {api_key.name}  user {api_key.user.username}  {api_key.tier}  {store}  {status}")
+    
+    @app.cli.command('revoke-api-key')
+    @click.argument('prefix')
+    def revoke_api_key_command(prefix):
+        """Revoke the API key with PREFIX."""
+        from datetime import datetime
+        from app.models.api_key import ApiKey
+        from app.utils.api_keys import invalidate_api_key_on_commit
+        api_key = ApiKey.query.filter_by(prefix=prefix, revoked_at=None).first()
+        if api_key is None:
+            raise click.BadParameter('no active key with this prefix', param_hint='PREFIX')
+        api_key.revoked_at = datetime.utcnow()
+        invalidate_api_key_on_commit(api_key.id)
+        db.session.commit()
+        print(f"Revoked API key {prefix}.")
+    
     @app.cli.command('seed-db')
     def seed_db_command():
         """Seed the database with initial data."""
@@ -1,14 +1,29 @@
 from flask import render_template, redirect, url_for, flash, request, session, jsonify
-from flask_login import login_required, current_user
+from flask_login import login_required
 from app.blueprints.admin import admin_bp
-from app.models.db import db, UserRole
+from app.models.db import db, ItemType, TransactionType
 from app.models.store import Store
 from app.models.user import User
 from app.models.security_log import SecurityLog
 from app.models.inventory import Inventory
 from app.models.transaction import Transaction
+from app.models.stock_summary import StoreStockSummary, StoreStockMovement
+from app.models.item_forecast import ItemForecast
+from app.models.api_key import ApiKey
 from app.utils.auth import admin_required, partner_admin_required, log_security_event
+from app.utils.stock_summary import get_stock_summary, get_stock_movement, count_transactions
+from app.utils.pagination import seek_page, get_page_size, encode_time_cursor, decode_time_cursor
+from app.utils.cache import response_cache
+from app.utils.query_budget import query_budget
+from app.utils.export import export_response, EXPORT_FORMATS, EXPORT_CHUNK_SIZE
+from app.utils.stock_history import stock_as_of, parse_as_of
+from app.utils.forecast import needs_reorder
+from app.utils.identity import invalidate_identity_on_commit, ALL_USERS
+from app.utils.api_keys import invalidate_api_key_on_commit
+from app.utils.permissions import get_access, scope_criteria, scoped_store_id
+import sqlalchemy as sa
 from sqlalchemy import func, desc
+from sqlalchemy.orm import joinedload, contains_eager
 from datetime import datetime, timedelta
 
 @admin_bp.route('/')
@@ -119,8 +134,16 @@ def delete_store(store_id):
     # Store name for logging
     store_name = store.name
     
-    # Delete store
+    # Delete store along with its (empty) stock summary rows
+    StoreStockSummary.query.filter_by(store_id=store_id).delete()
+    StoreStockMovement.query.filter_by(store_id=store_id).delete()
+    # API keys limited to the store go with it
+    for api_key in ApiKey.query.filter_by(store_id=store_id).all():
+        invalidate_api_key_on_commit(api_key.id)
+        db.session.delete(api_key)
     db.session.delete(store)
+    # Every cached identity could hold the deleted store's id
+    invalidate_identity_on_commit(ALL_USERS)
     db.session.commit()
     
     log_security_event(
@@ -134,6 +157,7 @@ def delete_store(store_id):
 @admin_bp.route('/security-logs')
 @login_required
 @admin_required
+@query_budget(10)
 def security_logs():
     """View security logs route."""
     # Get filter parameters
@@ -142,8 +166,8 @@ def security_logs():
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
-    # Base query
-    query = SecurityLog.query
+    # Base query; the template shows each log's user
+    query = SecurityLog.query.options(joinedload(SecurityLog.user))
     
     # Apply filters
     if event_type:
@@ -193,44 +217,93 @@ def security_logs():
         min=min   # Add built-in min function to the template context
     )
 
+@admin_bp.route('/api/security-log-writer')
+@login_required
+@admin_required
+def security_log_writer_stats():
+    """API endpoint for the background security log writer's queue depth and counters."""
+    from app.utils.security_log_writer import security_log_writer
+    return jsonify(security_log_writer.stats())
+
+@admin_bp.route('/api/password-hasher')
+@login_required
+@admin_required
+def password_hasher_stats():
+    """API endpoint for the password hashing pool's queue waits, run times and counters."""
+    from app.utils.passwords import password_hasher
+    return jsonify(password_hasher.stats())
+
+@admin_bp.route('/api/api-keys')
+@login_required
+@admin_required
+def api_key_stats():
+    """API endpoint for the verified API key cache's hit/miss counters and the rate limit tiers."""
+    from app.utils.api_keys import api_key_auth
+    return jsonify(api_key_auth.stats())
+
+@admin_bp.route('/api/cache-stats')
+@login_required
+@admin_required
+def cache_stats():
+    """API endpoint for the dashboard and report cache's hit/miss counters."""
+    return jsonify(response_cache.stats())
+
 @admin_bp.route('/reports/inventory')
 @login_required
 @partner_admin_required
+@query_budget(10)
 def inventory_report():
     """Inventory report route."""
     # Get parameters
-    store_id = request.args.get('store_id', type=int)
+    store_id = scoped_store_id(request.args.get('store_id', type=int) or None)
     item_type = request.args.get('item_type')
     
-    # Base query
-    query = Inventory.query
-    
-    # Apply filters
-    if store_id:
-        query = query.filter_by(store_id=store_id)
-    if item_type:
-        query = query.filter_by(item_type=item_type)
-    
-    # Filter by accessories for non-global admins
-    if current_user.role == UserRole.PARTNER_ADMIN:
-        query = query.filter_by(item_type='accessories')
+    def build_report():
+        # Base query; each row shows the item's store and forecast
+        query = Inventory.query.options(
+            joinedload(Inventory.store),
+            joinedload(Inventory.forecast)
+        ).filter(*inventory_report_filters())
+        
+        # Get inventory items, as plain data so they can be cached
+        inventory_items = [{
+            'id': item.id,
+            'store': {'name': item.store.name},
+            'part_number': item.part_number,
+            'name': item.name,
+            'item_type': item.item_type,
+            'quantity': item.quantity,
+            'daily_demand': item.forecast.daily_demand if item.forecast else None,
+            'days_of_cover': item.forecast.days_of_cover(item.quantity) if item.forecast else None,
+            'reorder_point': item.forecast.reorder_point if item.forecast else None,
+            'needs_reorder': needs_reorder(item),
+            'updated_at': item.updated_at
+        } for item in query.order_by(Inventory.part_number)]
+        
+        # Summary statistics come from the maintained per-store summary rows
+        summary_item_type = get_access().effective_item_type(
+            ItemType(item_type) if item_type in [t.value for t in ItemType] else None
+        )
+        summary = get_stock_summary(store_id, summary_item_type)
+        summary.update(get_stock_movement(store_id, summary_item_type))
+        
+        return inventory_items, summary
     
-    # Get inventory items
-    inventory_items = query.order_by(Inventory.part_number).all()
+    inventory_items, summary = response_cache.get_or_compute(store_id, build_report)
     
     # Get stores for filter
     stores = Store.query.all()
     
     # Item types available for filter (only for admin_global)
     item_types = []
-    if current_user.role == UserRole.ADMIN_GLOBAL:
-        from app.models.db import ItemType
+    if get_access().item_type is None:
         item_types = [(t.value, t.value.capitalize()) for t in ItemType]
     
     return render_template(
         'admin/inventory_report.html',
         title='Inventory Report',
         inventory_items=inventory_items,
+        summary=summary,
         stores=stores,
         selected_store_id=store_id,
         selected_item_type=item_type,
@@ -240,67 +313,253 @@ def inventory_report():
 @admin_bp.route('/reports/transactions')
 @login_required
 @partner_admin_required
+@query_budget(10)
 def transaction_report():
     """Transaction report route."""
-    # Get parameters
-    store_id = request.args.get('store_id', type=int)
-    transaction_type = request.args.get('transaction_type')
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
+    filters = transaction_report_filters()
+    store_id = filters['store_id']
+    transaction_type = filters['transaction_type']
     
-    # Base query - join with Inventory to get item details
+    # Base query - join with Inventory to get item details, and load
+    # the store and user each row shows along with the page
     query = db.session.query(Transaction).join(
         Inventory, Transaction.item_id == Inventory.id
-    )
+    ).options(
+        contains_eager(Transaction.item),
+        joinedload(Transaction.store),
+        joinedload(Transaction.user)
+    ).filter(*filters['criteria'])
     
-    # Apply filters
-    if store_id:
-        query = query.filter(Transaction.store_id == store_id)
-    if transaction_type:
-        query = query.filter(Transaction.transaction_type == transaction_type)
-    if date_from:
-        try:
-            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-            query = query.filter(Transaction.timestamp >= date_from_obj)
-        except ValueError:
-            flash('Invalid date format for From Date.', 'warning')
-    if date_to:
-        try:
-            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d')
-            # Include the entire day
-            date_to_obj = date_to_obj + timedelta(days=1)
-            query = query.filter(Transaction.timestamp < date_to_obj)
-        except ValueError:
-            flash('Invalid date format for To Date.', 'warning')
+    # Seek to the requested page, newest first, by (timestamp, id)
+    per_page = get_page_size()
+    transactions, prev_key, next_key = seek_page(
+        query,
+        [Transaction.timestamp, Transaction.id],
+        after=decode_time_cursor(request.args.get('after')),
+        before=decode_time_cursor(request.args.get('before')),
+        per_page=per_page
+    )
     
-    # Filter to accessories for non-global admins
-    if current_user.role == UserRole.PARTNER_ADMIN:
-        query = query.filter(Inventory.item_type == 'accessories')
+    # Page links keep the filters and replace the cursor
+    filter_args = {k: v for k, v in request.args.to_dict().items() if k not in ('after', 'before')}
+    prev_url = url_for('admin.transaction_report', **filter_args, before=encode_time_cursor(prev_key)) if prev_key else None
+    next_url = url_for('admin.transaction_report', **filter_args, after=encode_time_cursor(next_key)) if next_key else None
     
-    # Order by timestamp descending
-    transactions = query.order_by(Transaction.timestamp.desc()).paginate(
-        page=request.args.get('page', 1, type=int), 
-        per_page=50,
-        error_out=False
-    )
+    # The movement table counts transactions per store, item type and day, which covers
+    # every filter but the transaction type; that one falls back to a cached count
+    if transaction_type is None:
+        total = count_transactions(store_id, filters['item_type'], filters['day_from'], filters['day_to'])
+    else:
+        total = response_cache.get_or_compute(
+            store_id, lambda: query.order_by(None).count(), exclude_args=('after', 'before')
+        )
     
     # Get stores for filter
     stores = Store.query.all()
     
     # Transaction types for filter
-    from app.models.db import TransactionType
     transaction_types = [(t.value, t.value.replace('_', ' ').capitalize()) for t in TransactionType]
     
     return render_template(
         'admin/transaction_report.html',
         title='Transaction Report',
         transactions=transactions,
+        total=total,
+        prev_url=prev_url,
+        next_url=next_url,
+        export_args=filter_args,
         stores=stores,
         transaction_types=transaction_types,
         selected_store_id=store_id,
         selected_transaction_type=transaction_type,
-        date_from=date_from,
-        date_to=date_to,
-        max=max,  # Add built-in max function to the template context
-        min=min   # Add built-in min function to the template context
-    )
\ No newline at end of file
+        date_from=request.args.get('date_from'),
+        date_to=request.args.get('date_to')
+    )
+
+@admin_bp.route('/reports/transactions/export')
+@login_required
+@partner_admin_required
+def export_transactions():
+    """
+    Stream the transaction report as CSV or JSON Lines.
+    
+    Takes the report's filters plus format (csv or jsonl) and gzip=1.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unsupported export format'}), 400
+    
+    filters = transaction_report_filters()
+    
+    # Select plain columns rather than ORM objects so rows can be discarded once written
+    statement = sa.select(
+        Transaction.timestamp,
+        Transaction.ticket_number,
+        Store.name,
+        Inventory.part_number,
+        Inventory.name,
+        Inventory.item_type,
+        Transaction.transaction_type,
+        Transaction.quantity_change,
+        User.username,
+        Transaction.notes
+    ).join(
+        Inventory, Transaction.item_id == Inventory.id
+    ).outerjoin(
+        Store, Transaction.store_id == Store.id
+    ).outerjoin(
+        User, Transaction.user_id == User.id
+    ).where(*filters['criteria']).order_by(
+        Transaction.timestamp.desc(), Transaction.id.desc()
+    ).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    
+    log_security_event('report_exported', f"Exported transaction report as {fmt}")
+    
+    return export_response(
+        ['timestamp', 'ticket_number', 'store', 'part_number', 'item_name', 'item_type',
+         'transaction_type', 'quantity_change', 'user', 'notes'],
+        db.session.execute(statement),
+        fmt,
+        f"transactions-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}",
+        compress=request.args.get('gzip', type=int) == 1
+    )
+
+@admin_bp.route('/reports/inventory/export')
+@login_required
+@partner_admin_required
+def export_inventory():
+    """
+    Stream the inventory report as CSV or JSON Lines.
+    
+    Takes the report's filters plus format (csv or jsonl) and gzip=1.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unsupported export format'}), 400
+    
+    statement = sa.select(
+        Inventory.part_number,
+        Inventory.name,
+        Inventory.item_type,
+        Inventory.quantity,
+        ItemForecast.daily_demand,
+        ItemForecast.reorder_point,
+        Store.name,
+        Inventory.updated_at
+    ).join(
+        Store, Inventory.store_id == Store.id
+    ).outerjoin(
+        ItemForecast, ItemForecast.item_id == Inventory.id
+    ).where(*inventory_report_filters()).order_by(
+        Inventory.part_number
+    ).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    
+    log_security_event('report_exported', f"Exported inventory report as {fmt}")
+    
+    return export_response(
+        ['part_number', 'name', 'item_type', 'quantity', 'daily_demand', 'reorder_point', 'store', 'updated_at'],
+        db.session.execute(statement),
+        fmt,
+        f"inventory-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}",
+        compress=request.args.get('gzip', type=int) == 1
+    )
+
+@admin_bp.route('/api/stock-as-of')
+@login_required
+@partner_admin_required
+def stock_as_of_api():
+    """
+    Reconstruct item quantities at a past time from the transaction ledger.
+    
+    Query arguments: at (ISO date or UTC datetime; a date means the end of that day),
+    store_id, item_type, and format (json, csv or jsonl).
+    """
+    try:
+        as_of = parse_as_of(request.args.get('at', ''))
+    except ValueError:
+        return jsonify({'error': 'Give "at" as an ISO date or datetime'}), 400
+    
+    store_id = scoped_store_id(request.args.get('store_id', type=int) or None)
+    
+    # Filter by accessories for non-global admins
+    item_type = request.args.get('item_type')
+    item_type = get_access().effective_item_type(
+        ItemType(item_type) if item_type in [t.value for t in ItemType] else None
+    )
+    
+    snapshot = stock_as_of(as_of, store_id, item_type)
+    
+    fmt = request.args.get('format', 'json')
+    if fmt in EXPORT_FORMATS:
+        columns = ['store_id', 'part_number', 'name', 'item_type', 'quantity']
+        return export_response(
+            columns,
+            ([item[column] for column in columns] for item in snapshot['items']),
+            fmt,
+            f"stock-as-of-{as_of.strftime('%Y%m%d-%H%M%S')}"
+        )
+    
+    return jsonify({
+        'as_of': as_of.isoformat(),
+        'items': [{**item, 'item_type': item['item_type'].value} for item in snapshot['items']],
+        'stores': snapshot['stores']
+    })
+
+def inventory_report_filters():
+    """Build the inventory report's filter conditions from the request arguments."""
+    store_id = scoped_store_id(request.args.get('store_id', type=int) or None)
+    
+    # Filter by accessories for non-global admins
+    item_type = request.args.get('item_type')
+    item_type = ItemType(item_type) if item_type in [t.value for t in ItemType] else None
+    
+    return scope_criteria(Inventory, store_id, item_type)
+
+def transaction_report_filters():
+    """
+    Build the transaction report's filter conditions from the request arguments.
+    The conditions assume the query joins Inventory on Transaction.item_id.
+    
+    Returns:
+        dict: criteria, plus the parsed store_id, transaction_type, item_type, day_from and day_to
+    """
+    criteria = []
+    store_id = scoped_store_id(request.args.get('store_id', type=int) or None)
+    transaction_type = request.args.get('transaction_type')
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    
+    day_from = day_to = None
+    if transaction_type in [t.value for t in TransactionType]:
+        criteria.append(Transaction.transaction_type == TransactionType(transaction_type))
+    else:
+        transaction_type = None
+    if date_from:
+        try:
+            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+            criteria.append(Transaction.timestamp >= date_from_obj)
+            day_from = date_from_obj.date()
+        except ValueError:
+            flash('Invalid date format for From Date.', 'warning')
+    if date_to:
+        try:
+            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d')
+            day_to = date_to_obj.date()
+            # Include the entire day
+            date_to_obj = date_to_obj + timedelta(days=1)
+            criteria.append(Transaction.timestamp < date_to_obj)
+        except ValueError:
+            flash('Invalid date format for To Date.', 'warning')
+    
+    # Filter to the transaction's store, and to accessories for non-global admins
+    item_type = get_access().item_type
+    criteria.extend(scope_criteria(Inventory, store_id, store_column=Transaction.store_id))
+    
+    return {
+        'criteria': criteria,
+        'store_id': store_id,
+        'transaction_type': transaction_type,
+        'item_type': item_type,
+        'day_from': day_from,
+        'day_to': day_to
+    }
\ No newline at end of file
@@ -2,7 +2,7 @@ from flask import render_template, redirect, url_for, flash, request, session, c
 from flask_login import login_user, logout_user, login_required, current_user
 # Using Python standard library instead of Werkzeug for URL parsing
 from urllib.parse import urlparse
-from datetime import datetime, timedelta
+from datetime import datetime
 from app.blueprints.auth import auth_bp
 from app.forms.auth import (
     LoginForm, RegistrationForm, PasswordChangeForm, 
@@ -16,6 +16,10 @@ from app.utils.auth import (
     admin_required, log_security_event, 
     check_password_expiration, validate_password_complexity
 )
+from app.utils.identity import invalidate_identity_on_commit
+from app.utils.api_keys import invalidate_api_key_on_commit, invalidate_user_api_keys_on_commit
+from app.utils.passwords import password_hasher, PasswordHasherBusy
+from app.utils.login_failures import login_failures
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 @limiter.limit("10 per minute")
@@ -26,10 +30,16 @@ def login():
         
     form = LoginForm()
     if form.validate_on_submit():
+        # Refuse addresses with many recent failures before spending a password check on them
+        if login_failures.ip_blocked(request.remote_addr):
+            flash('Too many failed sign-ins from your address. Please try again later.', 'danger')
+            return render_template('auth/login.html', title='Sign In', form=form), 429
+        
         user = User.query.filter_by(username=form.username.data).first()
         
         # Check if user exists
         if not user:
+            record_login_failure(None)
             log_security_event('login_failure', 
                               f'Failed login attempt for non-existent user: {form.username.data}')
             flash('Invalid username or password', 'danger')
@@ -43,41 +53,52 @@ def login():
             flash('This account is locked. Please contact an administrator.', 'danger')
             return render_template('auth/login.html', title='Sign In', form=form)
             
-        # Check failed login attempts
+        # Failed attempts are counted in the shared login_failures database, not the users table
         max_attempts = current_app.config.get('MAX_LOGIN_ATTEMPTS', 5)
-        lockout_minutes = current_app.config.get('ACCOUNT_LOCKOUT_MINUTES', 15)
         
-        # Reset failed attempts if last attempt was more than lockout_minutes ago
-        if user.last_login_attempt_time:
-            lockout_time = user.last_login_attempt_time + timedelta(minutes=lockout_minutes)
-            if user.failed_login_attempts >= max_attempts and datetime.utcnow() > lockout_time:
-                user.failed_login_attempts = 0
+        # Check password; when the hashing pool is saturated, ask the user to retry rather than queue forever
+        try:
+            password_ok = user.check_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('Too many sign-ins at the moment. Please try again in a few seconds.', 'warning')
+            return render_template('auth/login.html', title='Sign In', form=form), 503
         
-        # Check password
-        if not user.check_password(form.password.data):
-            user.failed_login_attempts += 1
-            user.last_login_attempt_time = datetime.utcnow()
+        if not password_ok:
+            failed_attempts = record_login_failure(user.id)
             
-            # Lock account if max attempts reached
-            if user.failed_login_attempts >= max_attempts:
+            # Lock account if max attempts reached; only the lock is written to the users table
+            if failed_attempts >= max_attempts:
+                user.failed_login_attempts = failed_attempts
+                user.last_login_attempt_time = datetime.utcnow()
                 user.is_locked = True
+                invalidate_user_api_keys_on_commit(user.id)
+                login_failures.reset_user(user.id)
                 log_security_event('account_locked', 
                                   f'Account locked after {max_attempts} failed login attempts: {user.username}',
                                   user_id=user.id)
+                db.session.commit()
                 flash(f'Account locked due to {max_attempts} failed login attempts.', 'danger')
             else:
-                remaining = max_attempts - user.failed_login_attempts
+                remaining = max_attempts - failed_attempts
                 log_security_event('login_failure', 
                                   f'Failed login attempt for user: {user.username}. {remaining} attempts remaining.',
                                   user_id=user.id)
                 flash(f'Invalid username or password. {remaining} attempts remaining.', 'danger')
                 
-            db.session.commit()
             return render_template('auth/login.html', title='Sign In', form=form)
             
         # Reset failed login attempts on successful login
-        user.failed_login_attempts = 0
-        user.last_login_attempt_time = datetime.utcnow()
+        login_failures.reset_user(user.id)
+        if user.failed_login_attempts:
+            user.failed_login_attempts = 0
+            user.last_login_attempt_time = datetime.utcnow()
+        
+        # Upgrade hashes in the old format or with outdated parameters while we have the password
+        if password_hasher.needs_rehash(user.password_hash):
+            try:
+                user.password_hash = password_hasher.hash(form.password.data)
+            except PasswordHasherBusy:
+                pass  # Upgraded on a later login
         db.session.commit()
         
         # Check if password is expired
@@ -108,6 +129,20 @@ def login():
         
     return render_template('auth/login.html', title='Sign In', form=form)
 
+def record_login_failure(user_id):
+    """
+    Count a failed login for the user (None for an unknown username) and the client's address,
+    logging when the address reaches the per-address limit.
+    
+    Returns:
+        int: The user's failed logins since the last reset
+    """
+    user_failures, ip_failures = login_failures.record_failure(user_id, request.remote_addr)
+    if ip_failures == login_failures.max_per_ip:
+        log_security_event('login_address_blocked', 
+                          f'Sign-ins refused after {ip_failures} failed attempts from {request.remote_addr}')
+    return user_failures
+
 @auth_bp.route('/logout')
 @login_required
 def logout():
@@ -129,7 +164,11 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, role=UserRole.USER)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('The server is busy. Please try again in a few seconds.', 'warning')
+            return render_template('auth/register.html', title='Register', form=form), 503
         db.session.add(user)
         db.session.commit()
         
@@ -153,18 +192,29 @@ def password_change():
     form = PasswordChangeForm()
     
     if form.validate_on_submit():
-        if current_user.check_password(form.current_password.data):
-            # Check password history to prevent reuse
-            password_history = PasswordHistory.query.filter_by(user_id=current_user.id).order_by(
-                PasswordHistory.timestamp.desc()).limit(5).all()
+        try:
+            password_ok = current_user.check_password(form.current_password.data)
             
-            for history in password_history:
-                if history.is_same_password(form.new_password.data):
-                    flash('Cannot reuse any of your last 5 passwords.', 'danger')
-                    return render_template('auth/password_change.html', title='Change Password', form=form)
+            # Check password history to prevent reuse, all entries at once
+            reused = password_ok and password_hasher.verify_any(form.new_password.data, [
+                history.password_hash for history in PasswordHistory.query.filter_by(user_id=current_user.id).order_by(
+                    PasswordHistory.timestamp.desc()).limit(5)
+            ])
+        except PasswordHasherBusy:
+            flash('The server is busy. Please try again in a few seconds.', 'warning')
+            return render_template('auth/password_change.html', title='Change Password', form=form), 503
+        
+        if password_ok:
+            if reused:
+                flash('Cannot reuse any of your last 5 passwords.', 'danger')
+                return render_template('auth/password_change.html', title='Change Password', form=form)
                     
             # Set new password
-            current_user.set_password(form.new_password.data)
+            try:
+                current_user.set_password(form.new_password.data)
+            except PasswordHasherBusy:
+                flash('The server is busy. Please try again in a few seconds.', 'warning')
+                return render_template('auth/password_change.html', title='Change Password', form=form), 503
             db.session.commit()
             
             log_security_event('password_changed', 
@@ -203,7 +253,11 @@ def create_user():
             username=form.username.data,
             role=UserRole(form.role.data)
         )
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('The server is busy. Please try again in a few seconds.', 'warning')
+            return render_template('auth/create_user.html', title='Create User', form=form), 503
         db.session.add(user)
         db.session.commit()
         
@@ -236,6 +290,11 @@ def edit_user(user_id):
         user.role = UserRole(form.role.data)
         user.is_locked = form.is_locked.data
         
+        # Unlocking starts the failed login count over
+        if old_status == "Locked" and not user.is_locked:
+            user.failed_login_attempts = 0
+            login_failures.reset_user(user.id)
+        
         changes = []
         if old_role != form.role.data:
             changes.append(f"Role changed from {old_role} to {form.role.data}")
@@ -247,9 +306,17 @@ def edit_user(user_id):
         # If admin selects reset password, we'll set a temporary password
         if form.reset_password.data:
             temp_password = "ChangeMe123!"  # This meets complexity requirements
-            user.set_password(temp_password)
+            try:
+                user.set_password(temp_password)
+            except PasswordHasherBusy:
+                # Leave the user as it was rather than save the other changes without the reset
+                db.session.rollback()
+                flash('The server is busy. Please try again in a few seconds.', 'warning')
+                return render_template('auth/edit_user.html', title='Edit User', form=form, user=user), 503
             changes.append("Password has been reset")
             
+        invalidate_identity_on_commit(user.id)
+        invalidate_user_api_keys_on_commit(user.id)
         db.session.commit()
         
         log_security_event('user_edited_by_admin', 
@@ -282,7 +349,11 @@ def delete_user(user_id):
         return redirect(url_for('auth.users'))
     
     username = user.username
+    for api_key in user.api_keys:
+        invalidate_api_key_on_commit(api_key.id)
+        db.session.delete(api_key)
     db.session.delete(user)
+    invalidate_identity_on_commit(user.id)
     db.session.commit()
     
     log_security_event('user_deleted_by_admin', 
@@ -313,6 +384,7 @@ def manage_user_stores(user_id):
             if store.id in selected_store_ids:
                 user.stores.append(store)
                 
+        invalidate_identity_on_commit(user.id)
         db.session.commit()
         
         # Log changes
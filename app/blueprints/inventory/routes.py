@@ -1,4 +1,4 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, session, current_app
+from flask import render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from sqlalchemy import and_
 from app.blueprints.inventory import inventory_bp
@@ -6,16 +6,30 @@ from app.forms.inventory import (
     InventoryItemForm, EditInventoryItemForm, StockAdjustmentForm,
     OutgoingAccessoryForm, TransferItemForm
 )
-from app.models.db import db, ItemType, TransactionType, UserRole
+from app.models.db import db, ItemType, TransactionType
 from app.models.inventory import Inventory
 from app.models.store import Store
 from app.models.transaction import Transaction
+from app.models.stock_snapshot import StockSnapshot
+from app.models.stock_alert import StockAlert
 from app import limiter
 from app.utils.auth import (
     admin_required, partner_admin_required, login_required_with_store,
-    log_security_event, get_user_active_store_context
+    log_security_event, get_user_active_store_context, get_active_store_id
 )
-from app.utils.transactions import create_transaction, register_outgoing_accessory
+from app.utils.transactions import (
+    create_transaction, register_outgoing_accessory,
+    InsufficientStockError, StockConflictError
+)
+from app.utils.unit_of_work import unit_of_work
+from app.utils.stock_summary import remove_item_movement, get_stock_summary, low_stock_threshold_column
+from app.utils.pagination import keyset_page, get_page_size
+from app.utils.search import search_items, search_condition
+from app.utils.conditional import store_validator, item_validator, conditional_response
+from app.utils.query_budget import query_budget
+from app.utils.alerts import sync_stock_alert, get_alert_counts
+from app.utils.permissions import get_access, scope_query, Permission
+from sqlalchemy.orm import joinedload
 
 
 @inventory_bp.route('/')
@@ -34,15 +48,7 @@ def index():
     active_store = Store.query.get_or_404(active_store_id)
     
     # Filter inventory based on user's role and active store
-    query = Inventory.query.filter_by(store_id=active_store_id)
-    
-    # Apply role-based filtering
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        # Regular users and partner admins can only see accessories
-        query = query.filter_by(item_type=ItemType.ACCESSORIES)
-    
-    # Execute the query and fetch items
-    inventory_items = query.all()
+    inventory_items = scope_query(Inventory.query, Inventory, active_store_id).all()
     
     return render_template(
         'inventory/index.html', 
@@ -67,37 +73,166 @@ def items():
     # Get the active store
     active_store = Store.query.get_or_404(active_store_id)
     
-    # Filter inventory based on user's role and active store
-    query = Inventory.query.filter_by(store_id=active_store_id)
-    
-    # Debug - check how many items exist in this store before filtering
-    total_in_store = query.count()
-    
-    # Apply role-based filtering
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        # Regular users and partner admins can only see accessories
-        query = query.filter_by(item_type=ItemType.ACCESSORIES)
-    
-    # Debug - check how many items match after type filtering
-    filtered_count = query.count()
-    
-    # Log for debugging
-    current_app.logger.info(f"Store {active_store.name} (ID: {active_store_id}) - Total items: {total_in_store}, After filtering: {filtered_count}")
+    # Fetch one page of the filtered items
+    query, item_type, stock_filter, search = filtered_inventory_query(active_store_id)
+    inventory_items, next_cursor = keyset_page(
+        query, Inventory.part_number, request.args.get('after'), get_page_size()
+    )
+    scoped_item_type = get_access().item_type
     
-    # Execute the query and fetch items
-    inventory_items = query.order_by(Inventory.part_number).all()
+    next_url = None
+    if next_cursor is not None:
+        next_url = url_for('inventory.items', **{**request.args.to_dict(), 'after': next_cursor})
+    first_url = None
+    if request.args.get('after'):
+        first_url = url_for('inventory.items', **{k: v for k, v in request.args.to_dict().items() if k != 'after'})
     
-    # Add count to template for debugging
     return render_template(
         'inventory/items.html', 
         title='Inventory Items',
         inventory=inventory_items,  # Changed from 'items' to 'inventory' to match template
         active_store=active_store,
-        item_type_filter='accessories' if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN else None,
-        debug_info={'total_items': total_in_store, 'filtered_items': filtered_count}
+        item_type_filter=scoped_item_type.value if scoped_item_type else None,
+        total_items=filtered_inventory_total(active_store_id, item_type, stock_filter, search),
+        next_url=next_url,
+        first_url=first_url
     )
 
 
+@inventory_bp.route('/api/items')
+@login_required
+def api_items():
+    """API endpoint returning the same pages as the item list, as JSON."""
+    active_store_id, is_valid = get_user_active_store_context()
+    if not active_store_id:
+        return jsonify({'error': 'No active store selected'}), 400
+    
+    query, item_type, stock_filter, search = filtered_inventory_query(active_store_id)
+    inventory_items, next_cursor = keyset_page(
+        query, Inventory.part_number, request.args.get('after'), get_page_size()
+    )
+    
+    return jsonify({
+        'items': [{
+            'id': item.id,
+            'part_number': item.part_number,
+            'name': item.name,
+            'item_type': item.item_type.value,
+            'quantity': item.quantity,
+            'updated_at': item.updated_at.isoformat() if item.updated_at else None
+        } for item in inventory_items],
+        'next_cursor': next_cursor,
+        'total': filtered_inventory_total(active_store_id, item_type, stock_filter, search)
+    })
+
+
+def filtered_inventory_query(store_id):
+    """
+    Build the item list query for a store from the request's filter arguments.
+    
+    Supported arguments are type (item type), filter (in_stock, low_stock,
+    out_of_stock or alerts) and q (words in the part number, name or description).
+    
+    Returns:
+        tuple: (query, item_type, stock_filter, search)
+    """
+    # Regular users and partner admins can only see accessories, whatever type they ask for
+    item_type = None
+    if request.args.get('type') in [t.value for t in ItemType]:
+        item_type = ItemType(request.args.get('type'))
+    item_type = get_access().effective_item_type(item_type)
+    query = scope_query(Inventory.query, Inventory, store_id, item_type)
+    
+    # Stock bands match the ones counted in the stock summary
+    stock_filter = request.args.get('filter')
+    if stock_filter == 'out_of_stock':
+        query = query.filter(db.func.coalesce(Inventory.quantity, 0) <= 0)
+    elif stock_filter == 'low_stock':
+        query = query.filter(Inventory.quantity.between(1, low_stock_threshold_column()))
+    elif stock_filter == 'in_stock':
+        query = query.filter(Inventory.quantity > low_stock_threshold_column())
+    elif stock_filter == 'alerts':
+        # Items with an open low or out of stock alert, by their own thresholds
+        query = query.filter(Inventory.id.in_(
+            db.select(StockAlert.item_id).where(StockAlert.resolved_at.is_(None))
+        ))
+    else:
+        stock_filter = None
+    
+    # Text search goes through the full-text index
+    search = request.args.get('q', '').strip() or None
+    if search:
+        query = query.filter(search_condition(search))
+    
+    return query, item_type, stock_filter, search
+
+
+@inventory_bp.route('/api/search')
+@login_required
+def search():
+    """
+    API endpoint for item search, best matches first.
+    
+    Query arguments: q (words to prefix-match), store_id (defaults to the active
+    store), in_stock (only items with a positive quantity) and limit (max 50).
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'items': []})
+    
+    store_id = request.args.get('store_id', type=int)
+    if store_id is None:
+        store_id, is_valid = get_user_active_store_context()
+        if not store_id:
+            return jsonify({'error': 'No active store selected'}), 400
+    
+    # Check if user has permission for the store
+    access = get_access()
+    if not access.has_store(store_id):
+        return jsonify({'error': 'Not authorized for this store'}), 403
+    
+    # Regular users and partner admins can only see accessories
+    limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+    items = search_items(
+        text,
+        store_id=store_id,
+        item_type=access.item_type,
+        in_stock_only=request.args.get('in_stock', type=int) == 1,
+        limit=limit
+    )
+    
+    return jsonify({
+        'items': [{
+            'id': item.id,
+            'part_number': item.part_number,
+            'name': item.name,
+            'item_type': item.item_type.value,
+            'quantity': item.quantity,
+            'store_id': item.store_id
+        } for item in items]
+    })
+
+
+def filtered_inventory_total(store_id, item_type, stock_filter, search):
+    """
+    Return the number of items matching the filters, read from the stock summary
+    instead of counting rows. Returns None for text searches, which the summary can't answer.
+    """
+    if search:
+        return None
+    
+    summary = get_stock_summary(store_id, item_type)
+    if stock_filter == 'out_of_stock':
+        return summary['out_of_stock']
+    if stock_filter == 'low_stock':
+        return summary['low_stock']
+    if stock_filter == 'in_stock':
+        return summary['healthy_stock']
+    if stock_filter == 'alerts':
+        return get_alert_counts(store_id, item_type)['total']
+    return summary['total']
+
+
 @inventory_bp.route('/items/add', methods=['GET', 'POST'])
 @login_required
 @partner_admin_required
@@ -109,44 +244,49 @@ def add_item():
     form.store_id.choices = [(store.id, store.name) for store in Store.query.all()]
     
     # If partner_admin, only allow selecting 'accessories' type
-    if current_user.role == UserRole.PARTNER_ADMIN:
-        form.item_type.choices = [(ItemType.ACCESSORIES.value, 'Accessories')]
+    access = get_access()
+    if access.item_type is not None:
+        form.item_type.choices = [(access.item_type.value, access.item_type.value.capitalize())]
     
     if form.validate_on_submit():
         # Check that partner_admin users can't create clothing items
-        if current_user.role == UserRole.PARTNER_ADMIN and form.item_type.data != ItemType.ACCESSORIES.value:
+        if not access.can_see_type(ItemType(form.item_type.data)):
             flash('You are only authorized to add accessory items.', 'danger')
             return render_template('inventory/add_item.html', title='Add Item', form=form)
         
-        # Create new inventory item
-        item = Inventory(
-            part_number=form.part_number.data,
-            name=form.name.data,
-            description=form.description.data,
-            item_type=ItemType(form.item_type.data),
-            quantity=form.quantity.data,
-            store_id=form.store_id.data
-        )
-        
-        db.session.add(item)
-        
-        # If initial quantity is greater than 0, create an initial transaction
-        if form.quantity.data > 0:
-            create_transaction(
-                item_id=item.id,
-                user_id=current_user.id,
-                store_id=item.store_id,
-                transaction_type=TransactionType.ADD,
-                quantity_change=item.quantity,
-                notes="Initial inventory entry"
+        with unit_of_work():
+            # Create new inventory item; the initial stock is booked by the transaction below
+            item = Inventory(
+                part_number=form.part_number.data,
+                name=form.name.data,
+                description=form.description.data,
+                item_type=ItemType(form.item_type.data),
+                quantity=0,
+                low_stock_threshold=form.low_stock_threshold.data,
+                store_id=form.store_id.data
+            )
+            
+            db.session.add(item)
+            db.session.flush()  # Get the new ID
+            
+            # If initial quantity is greater than 0, create an initial transaction
+            if form.quantity.data > 0:
+                create_transaction(
+                    item_id=item.id,
+                    user_id=current_user.id,
+                    store_id=item.store_id,
+                    transaction_type=TransactionType.ADD,
+                    quantity_change=form.quantity.data,
+                    notes="Initial inventory entry"
+                )
+            else:
+                # No stock change to raise the out of stock alert
+                sync_stock_alert(item)
+            
+            log_security_event(
+                'item_created', 
+                f"User created inventory item: {item.part_number} - {item.name} - Type: {item.item_type.value} - Qty: {item.quantity}"
             )
-        
-        db.session.commit()
-        
-        log_security_event(
-            'item_created', 
-            f"User created inventory item: {item.part_number} - {item.name} - Type: {item.item_type.value} - Qty: {item.quantity}"
-        )
         
         flash(f'Inventory item {item.part_number} has been added successfully.', 'success')
         return redirect(url_for('inventory.items'))
@@ -156,30 +296,36 @@ def add_item():
 
 @inventory_bp.route('/items/<int:item_id>', methods=['GET'])
 @login_required
+@query_budget(10)
 def view_item(item_id):
     """View details of a specific inventory item."""
     item = Inventory.query.get_or_404(item_id)
     
     # Check if the user has access to this item based on their role
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        if item.item_type != ItemType.ACCESSORIES:
-            flash('You do not have permission to view non-accessory items.', 'danger')
-            return redirect(url_for('inventory.items'))
+    access = get_access()
+    if not access.can_see_type(item.item_type):
+        flash('You do not have permission to view non-accessory items.', 'danger')
+        return redirect(url_for('inventory.items'))
     
     # For regular users, check if they're assigned to the item's store
-    if current_user.role == UserRole.USER:
-        user_store_ids = [store.id for store in current_user.stores]
-        if item.store_id not in user_store_ids:
-            flash('You do not have permission to view items from this store.', 'danger')
-            return redirect(url_for('inventory.items'))
-    
-    # Get transaction history
-    transactions = Transaction.query.filter_by(item_id=item.id).order_by(Transaction.timestamp.desc()).all()
+    if not access.has_store(item.store_id, Permission.VIEW_ALL_STORES):
+        flash('You do not have permission to view items from this store.', 'danger')
+        return redirect(url_for('inventory.items'))
     
-    return render_template('inventory/item_details.html', 
-                         title=f'Item: {item.part_number}',
-                         item=item,
-                         transactions=transactions)
+    def render_item():
+        # Get transaction history, with the user shown on each row
+        transactions = Transaction.query.options(joinedload(Transaction.user)).filter_by(
+            item_id=item.id
+        ).order_by(Transaction.timestamp.desc()).all()
+        
+        return render_template('inventory/item_details.html', 
+                             title=f'Item: {item.part_number}',
+                             item=item,
+                             transactions=transactions)
+    
+    # Skip the history query and rendering if the client's copy is current
+    validator, last_modified = item_validator(item)
+    return conditional_response(validator, last_modified, render_item, per_user=True)
 
 
 @inventory_bp.route('/items/<int:item_id>/edit', methods=['GET', 'POST'])
@@ -190,25 +336,35 @@ def edit_item(item_id):
     item = Inventory.query.get_or_404(item_id)
     
     # Check permissions based on item type and user role
-    if current_user.role == UserRole.PARTNER_ADMIN and item.item_type != ItemType.ACCESSORIES:
+    access = get_access()
+    if not access.can_see_type(item.item_type):
         flash('You do not have permission to edit non-accessory items.', 'danger')
         return redirect(url_for('inventory.items'))
     
+    # Store-bound API keys only manage items of their store
+    if not access.has_store(item.store_id, Permission.VIEW_ALL_STORES):
+        flash('You do not have permission to edit items from this store.', 'danger')
+        return redirect(url_for('inventory.items'))
+    
     form = EditInventoryItemForm(original_part_number=item.part_number)
     
     # Populate store choices
     form.store_id.choices = [(store.id, store.name) for store in Store.query.all()]
     
     # If partner_admin, only allow 'accessories' type
-    if current_user.role == UserRole.PARTNER_ADMIN:
-        form.item_type.choices = [(ItemType.ACCESSORIES.value, 'Accessories')]
+    if access.item_type is not None:
+        form.item_type.choices = [(access.item_type.value, access.item_type.value.capitalize())]
     
     if form.validate_on_submit():
         # Check that partner_admin users can't edit item type to non-accessories
-        if current_user.role == UserRole.PARTNER_ADMIN and form.item_type.data != ItemType.ACCESSORIES.value:
+        if not access.can_see_type(ItemType(form.item_type.data)):
             flash('You are only authorized to manage accessory items.', 'danger')
             return render_template('inventory/edit_item.html', title='Edit Item', form=form, item=item)
         
+        if not access.has_store(form.store_id.data, Permission.VIEW_ALL_STORES):
+            flash('You are not authorized to move items to this store.', 'danger')
+            return render_template('inventory/edit_item.html', title='Edit Item', form=form, item=item)
+        
         # Track changes for logging
         changes = []
         if item.part_number != form.part_number.data:
@@ -217,55 +373,60 @@ def edit_item(item_id):
             changes.append(f"Name: {item.name} -> {form.name.data}")
         if item.item_type.value != form.item_type.data:
             changes.append(f"Type: {item.item_type.value} -> {form.item_type.data}")
+        if item.low_stock_threshold != form.low_stock_threshold.data:
+            changes.append(f"Low stock threshold: {item.low_stock_threshold} -> {form.low_stock_threshold.data}")
         if item.store_id != form.store_id.data:
             old_store = Store.query.get(item.store_id).name
             new_store = Store.query.get(form.store_id.data).name
             changes.append(f"Store: {old_store} -> {new_store}")
         
-        # Update item
-        item.part_number = form.part_number.data
-        item.name = form.name.data
-        item.description = form.description.data
-        item.item_type = ItemType(form.item_type.data)
-        
-        # If store is changing, need to handle as a transfer
-        if item.store_id != form.store_id.data:
-            old_store_id = item.store_id
-            new_store_id = form.store_id.data
-            quantity = item.quantity
+        with unit_of_work():
+            # Update item
+            item.part_number = form.part_number.data
+            item.name = form.name.data
+            item.description = form.description.data
+            item.item_type = ItemType(form.item_type.data)
+            item.low_stock_threshold = form.low_stock_threshold.data
             
-            # Only create transfer transactions if there's actual inventory
-            if quantity > 0:
-                # Create a transfer out transaction for the old store
-                create_transaction(
-                    item_id=item.id,
-                    user_id=current_user.id,
-                    store_id=old_store_id,
-                    transaction_type=TransactionType.TRANSFER_OUT,
-                    quantity_change=-quantity,
-                    notes=f"Transfer to {Store.query.get(new_store_id).name} (item edit)"
-                )
+            # A new threshold or type can move the item in or out of an alert
+            sync_stock_alert(item)
+            
+            # If store is changing, need to handle as a transfer
+            if item.store_id != form.store_id.data:
+                old_store_id = item.store_id
+                new_store_id = form.store_id.data
+                quantity = item.quantity
                 
-                # Create a transfer in transaction for the new store
-                create_transaction(
-                    item_id=item.id,
-                    user_id=current_user.id,
-                    store_id=new_store_id,
-                    transaction_type=TransactionType.TRANSFER_IN,
-                    quantity_change=quantity,
-                    notes=f"Transfer from {Store.query.get(old_store_id).name} (item edit)"
-                )
+                # Only create transfer transactions if there's actual inventory
+                if quantity > 0:
+                    # Create a transfer out transaction for the old store
+                    create_transaction(
+                        item_id=item.id,
+                        user_id=current_user.id,
+                        store_id=old_store_id,
+                        transaction_type=TransactionType.TRANSFER_OUT,
+                        quantity_change=-quantity,
+                        notes=f"Transfer to {Store.query.get(new_store_id).name} (item edit)"
+                    )
+                    
+                    # Create a transfer in transaction for the new store
+                    create_transaction(
+                        item_id=item.id,
+                        user_id=current_user.id,
+                        store_id=new_store_id,
+                        transaction_type=TransactionType.TRANSFER_IN,
+                        quantity_change=quantity,
+                        notes=f"Transfer from {Store.query.get(old_store_id).name} (item edit)"
+                    )
+                
+                # Update the store ID
+                item.store_id = new_store_id
             
-            # Update the store ID
-            item.store_id = new_store_id
-        
-        db.session.commit()
-        
-        if changes:
-            log_security_event(
-                'item_updated', 
-                f"User updated inventory item: {item.part_number} - Changes: {', '.join(changes)}"
-            )
+            if changes:
+                log_security_event(
+                    'item_updated', 
+                    f"User updated inventory item: {item.part_number} - Changes: {', '.join(changes)}"
+                )
         
         flash(f'Inventory item {item.part_number} has been updated.', 'success')
         return redirect(url_for('inventory.view_item', item_id=item.id))
@@ -278,6 +439,7 @@ def edit_item(item_id):
         form.item_type.data = item.item_type.value
         form.store_id.data = item.store_id
         form.quantity.data = item.quantity
+        form.low_stock_threshold.data = item.low_stock_threshold
     
     return render_template('inventory/edit_item.html', title='Edit Item', form=form, item=item)
 
@@ -290,10 +452,16 @@ def adjust_stock(item_id):
     item = Inventory.query.get_or_404(item_id)
     
     # Check permissions based on item type and user role
-    if current_user.role == UserRole.PARTNER_ADMIN and item.item_type != ItemType.ACCESSORIES:
+    access = get_access()
+    if not access.can_see_type(item.item_type):
         flash('You do not have permission to adjust non-accessory items.', 'danger')
         return redirect(url_for('inventory.items'))
     
+    # Store-bound API keys only adjust items of their store
+    if not access.has_store(item.store_id, Permission.VIEW_ALL_STORES):
+        flash('You do not have permission to adjust items from this store.', 'danger')
+        return redirect(url_for('inventory.items'))
+    
     form = StockAdjustmentForm()
     
     if request.method == 'POST':
@@ -306,6 +474,7 @@ def adjust_stock(item_id):
                 adjustment_type = request.form.get('adjustment_type')
                 quantity = int(request.form.get('quantity', 0))
                 notes = request.form.get('notes', '')
+                expected_version = None
                 
                 if adjustment_type == 'add':
                     # Add to stock - positive adjustment
@@ -314,36 +483,36 @@ def adjust_stock(item_id):
                     # Remove from stock - negative adjustment
                     adjustment = -quantity
                 elif adjustment_type == 'set':
-                    # Set exact quantity - calculate adjustment needed
+                    # Set exact quantity - calculate adjustment needed, and only apply it
+                    # if nobody changed the stock since we read it
                     adjustment = quantity - item.quantity
+                    expected_version = item.version
                 else:
                     flash('Invalid adjustment type.', 'danger')
                     return redirect(url_for('inventory.items'))
                 
                 # Prevent negative inventory (unless admin)
-                if item.quantity + adjustment < 0 and current_user.role != UserRole.ADMIN_GLOBAL:
+                if item.quantity + adjustment < 0 and not access.can(Permission.NEGATIVE_STOCK):
                     flash('This adjustment would result in negative inventory. Only global admins can set negative inventory.', 'warning')
                     return redirect(url_for('inventory.items'))
                 
-                # Create transaction record (this will update the item quantity too)
-                create_transaction(
-                    item_id=item.id,
-                    user_id=current_user.id,
-                    store_id=item.store_id,
-                    transaction_type=TransactionType.STOCK_ADJUSTMENT,
-                    quantity_change=adjustment,
-                    notes=notes
-                )
-                
-                db.session.commit()
-                
-                # Get refreshed item for accurate quantity in the log and message
-                item = Inventory.query.get(item_id)
-                
-                log_security_event(
-                    'stock_adjusted', 
-                    f"User adjusted stock: {item.part_number} - Adjustment: {adjustment} - New Quantity: {item.quantity}"
-                )
+                with unit_of_work():
+                    # Create transaction record (this will update the item quantity too)
+                    create_transaction(
+                        item_id=item.id,
+                        user_id=current_user.id,
+                        store_id=item.store_id,
+                        transaction_type=TransactionType.STOCK_ADJUSTMENT,
+                        quantity_change=adjustment,
+                        notes=notes,
+                        allow_negative=access.can(Permission.NEGATIVE_STOCK),
+                        expected_version=expected_version
+                    )
+                    
+                    log_security_event(
+                        'stock_adjusted', 
+                        f"User adjusted stock: {item.part_number} - Adjustment: {adjustment} - New Quantity: {item.quantity}"
+                    )
                 
                 flash(f'Stock level for {item.part_number} adjusted by {adjustment}. New quantity: {item.quantity}', 'success')
                 return redirect(url_for('inventory.items'))
@@ -351,6 +520,14 @@ def adjust_stock(item_id):
             except ValueError:
                 flash('Invalid quantity value.', 'danger')
                 return redirect(url_for('inventory.items'))
+            
+            except InsufficientStockError:
+                flash('This adjustment would result in negative inventory. Only global admins can set negative inventory.', 'warning')
+                return redirect(url_for('inventory.items'))
+            
+            except StockConflictError:
+                flash('The stock level changed while you were adjusting it. Please review and try again.', 'warning')
+                return redirect(url_for('inventory.items'))
         
         # Process regular form submission from adjust_stock.html
         elif form.validate_on_submit():
@@ -363,25 +540,29 @@ def adjust_stock(item_id):
                                     title=f'Adjust Stock: {item.part_number}',
                                     form=form, item=item, adjustment=adjustment)
             
-            # Create transaction record (this will update the item quantity too)
-            create_transaction(
-                item_id=item.id,
-                user_id=current_user.id,
-                store_id=item.store_id,
-                transaction_type=TransactionType.STOCK_ADJUSTMENT,
-                quantity_change=adjustment,
-                notes=form.reason.data
-            )
-            
-            db.session.commit()
-            
-            # Get refreshed item for accurate quantity in the log and message
-            item = Inventory.query.get(item_id)
-            
-            log_security_event(
-                'stock_adjusted', 
-                f"User adjusted stock: {item.part_number} - Adjustment: {adjustment} - New Quantity: {item.quantity} - Reason: {form.reason.data}"
-            )
+            try:
+                with unit_of_work():
+                    # Create transaction record (this will update the item quantity too)
+                    create_transaction(
+                        item_id=item.id,
+                        user_id=current_user.id,
+                        store_id=item.store_id,
+                        transaction_type=TransactionType.STOCK_ADJUSTMENT,
+                        quantity_change=adjustment,
+                        notes=form.reason.data,
+                        allow_negative=bool(request.form.get('force_negative'))
+                    )
+                    
+                    log_security_event(
+                        'stock_adjusted', 
+                        f"User adjusted stock: {item.part_number} - Adjustment: {adjustment} - New Quantity: {item.quantity} - Reason: {form.reason.data}"
+                    )
+            except InsufficientStockError:
+                # Stock was taken by another request after the check above
+                flash('This adjustment would result in negative inventory. Check "Allow Negative Inventory" to override.', 'warning')
+                return render_template('inventory/adjust_stock.html', 
+                                    title=f'Adjust Stock: {item.part_number}',
+                                    form=form, item=item, adjustment=adjustment)
             
             flash(f'Stock level for {item.part_number} adjusted by {adjustment}. New quantity: {item.quantity}', 'success')
             return redirect(url_for('inventory.view_item', item_id=item.id))
@@ -413,17 +594,20 @@ def delete_item(item_id):
     part_number = item.part_number
     name = item.name
     
-    # Delete transactions associated with the item
-    Transaction.query.filter_by(item_id=item.id).delete()
-    
-    # Delete the item
-    db.session.delete(item)
-    db.session.commit()
-    
-    log_security_event(
-        'item_deleted', 
-        f"User deleted inventory item: {part_number} - {name}"
-    )
+    with unit_of_work():
+        # Delete transactions associated with the item, and their counts in the movement summary
+        remove_item_movement(db.session.connection(), item.id)
+        Transaction.query.filter_by(item_id=item.id).delete()
+        StockSnapshot.query.filter_by(item_id=item.id).delete()
+        StockAlert.query.filter_by(item_id=item.id).delete()
+        
+        # Delete the item
+        db.session.delete(item)
+        
+        log_security_event(
+            'item_deleted', 
+            f"User deleted inventory item: {part_number} - {name}"
+        )
     
     flash(f'Inventory item {part_number} has been deleted.', 'success')
     return redirect(url_for('inventory.items'))
@@ -571,7 +755,7 @@ def transfer_item():
     form.destination_store_id.choices = [(s.id, s.name) for s in stores]
     
     # Default source store to active store if one is selected
-    active_store_id = session.get('active_store_id')
+    active_store_id = get_active_store_id()
     if active_store_id:
         form.source_store_id.data = active_store_id
     
@@ -581,9 +765,16 @@ def transfer_item():
         item = Inventory.query.get_or_404(form.item_id.data)
         
         # Check permissions based on item type and user role
-        if current_user.role == UserRole.PARTNER_ADMIN and item.item_type != ItemType.ACCESSORIES:
+        access = get_access()
+        if not access.can_see_type(item.item_type):
             flash('You do not have permission to transfer non-accessory items.', 'danger')
             return redirect(url_for('inventory.items'))
+        
+        # Store-bound API keys only transfer within their store
+        if not (access.has_store(form.source_store_id.data, Permission.VIEW_ALL_STORES)
+                and access.has_store(form.destination_store_id.data, Permission.VIEW_ALL_STORES)):
+            flash('You do not have permission to transfer items between these stores.', 'danger')
+            return redirect(url_for('inventory.items'))
             
         # Check if source matches item's current store
         if item.store_id != form.source_store_id.data:
@@ -607,61 +798,64 @@ def transfer_item():
             store_id=destination_store_id
         ).first()
         
-        # Begin transaction
+        # Transfer out, transfer in and the audit row are committed together
         try:
-            # Create transfer out transaction
-            create_transaction(
-                item_id=item.id,
-                user_id=current_user.id,
-                store_id=source_store_id,
-                transaction_type=TransactionType.TRANSFER_OUT,
-                quantity_change=-quantity,
-                notes=f"Transfer to {Store.query.get(destination_store_id).name}: {notes}"
-            )
-            
-            if dest_item:
-                # If item exists in destination, use that for the transfer in transaction
+            with unit_of_work():
+                # Create transfer out transaction
                 create_transaction(
-                    item_id=dest_item.id,
+                    item_id=item.id,
                     user_id=current_user.id,
-                    store_id=destination_store_id,
-                    transaction_type=TransactionType.TRANSFER_IN,
-                    quantity_change=quantity,
-                    notes=f"Transfer from {Store.query.get(source_store_id).name}: {notes}"
-                )
-            else:
-                # Create new item in destination store with the transferred quantity
-                new_item = Inventory(
-                    part_number=item.part_number,
-                    name=item.name,
-                    description=item.description,
-                    item_type=item.item_type,
-                    quantity=quantity,
-                    store_id=destination_store_id
+                    store_id=source_store_id,
+                    transaction_type=TransactionType.TRANSFER_OUT,
+                    quantity_change=-quantity,
+                    notes=f"Transfer to {Store.query.get(destination_store_id).name}: {notes}",
+                    allow_negative=False
                 )
-                db.session.add(new_item)
-                db.session.flush()  # Get the new ID
                 
-                # Create transfer in transaction for new item
-                create_transaction(
-                    item_id=new_item.id,
-                    user_id=current_user.id,
-                    store_id=destination_store_id,
-                    transaction_type=TransactionType.TRANSFER_IN,
-                    quantity_change=quantity,
-                    notes=f"Transfer from {Store.query.get(source_store_id).name}: {notes}"
+                if dest_item:
+                    # If item exists in destination, use that for the transfer in transaction
+                    create_transaction(
+                        item_id=dest_item.id,
+                        user_id=current_user.id,
+                        store_id=destination_store_id,
+                        transaction_type=TransactionType.TRANSFER_IN,
+                        quantity_change=quantity,
+                        notes=f"Transfer from {Store.query.get(source_store_id).name}: {notes}"
+                    )
+                else:
+                    # Create new item in destination store; the transfer in transaction books the quantity
+                    new_item = Inventory(
+                        part_number=item.part_number,
+                        name=item.name,
+                        description=item.description,
+                        item_type=item.item_type,
+                        quantity=0,
+                        store_id=destination_store_id
+                    )
+                    db.session.add(new_item)
+                    db.session.flush()  # Get the new ID
+                    
+                    # Create transfer in transaction for new item
+                    create_transaction(
+                        item_id=new_item.id,
+                        user_id=current_user.id,
+                        store_id=destination_store_id,
+                        transaction_type=TransactionType.TRANSFER_IN,
+                        quantity_change=quantity,
+                        notes=f"Transfer from {Store.query.get(source_store_id).name}: {notes}"
+                    )
+                
+                log_security_event(
+                    'item_transferred', 
+                    f"User transferred item: {item.part_number} - Qty: {quantity} - From: {Store.query.get(source_store_id).name} - To: {Store.query.get(destination_store_id).name}"
                 )
             
-            db.session.commit()
-            
-            log_security_event(
-                'item_transferred', 
-                f"User transferred item: {item.part_number} - Qty: {quantity} - From: {Store.query.get(source_store_id).name} - To: {Store.query.get(destination_store_id).name}"
-            )
-            
             flash(f'Successfully transferred {quantity} units of {item.part_number} to {Store.query.get(destination_store_id).name}', 'success')
             return redirect(url_for('inventory.items'))
             
+        except InsufficientStockError:
+            flash(f'Not enough quantity available. Current quantity: {item.quantity}', 'danger')
+            
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Transfer error: {str(e)}")
@@ -675,20 +869,18 @@ def transfer_item():
 def get_items_by_store(store_id):
     """API endpoint to get items by store (for AJAX)."""
     # Check if user has permission for the store
-    if current_user.role == UserRole.USER:
-        user_store_ids = [store.id for store in current_user.stores]
-        if store_id not in user_store_ids:
-            return jsonify({'error': 'Not authorized for this store'}), 403
-    
-    query = Inventory.query.filter_by(store_id=store_id).filter(Inventory.quantity > 0)
-    
-    # Filter by item type based on role
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        query = query.filter_by(item_type=ItemType.ACCESSORIES)
-    
-    items = query.all()
-    item_list = [{'id': item.id, 'part_number': item.part_number, 
-                 'name': item.name, 'quantity': item.quantity} 
-                for item in items]
+    if not get_access().has_store(store_id, Permission.VIEW_ALL_STORES):
+        return jsonify({'error': 'Not authorized for this store'}), 403
+    
+    def build_items():
+        # Filter by item type based on role
+        items = scope_query(Inventory.query, Inventory, store_id).filter(Inventory.quantity > 0).all()
+        item_list = [{'id': item.id, 'part_number': item.part_number, 
+                     'name': item.name, 'quantity': item.quantity} 
+                    for item in items]
+        
+        return jsonify(item_list)
     
-    return jsonify(item_list)
\ No newline at end of file
+    # Skip the item query if the client's copy is current
+    validator, last_modified = store_validator(store_id)
+    return conditional_response(validator, last_modified, build_items)
\ No newline at end of file
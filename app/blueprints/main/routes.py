@@ -1,13 +1,23 @@
-from flask import render_template, redirect, url_for, flash, request, session, jsonify
+import json
+from flask import render_template, redirect, url_for, flash, request, session, jsonify, Response
 from flask_login import login_required, current_user
 from app.blueprints.main import main_bp
-from app.models.db import db, ItemType, UserRole, TransactionType
+from app.models.db import db
 from app.models.store import Store
 from app.models.inventory import Inventory
 from app.models.transaction import Transaction
 from app.models.user import User
 from app.utils.auth import log_security_event
+from app.utils.stats import get_inventory_stats, get_transaction_stats
+from app.utils.stock_summary import get_stock_movement
+from app.utils.forecast import get_reorder_items
+from app.utils.alerts import get_alert_counts
+from app.utils.cache import response_cache
+from app.utils.conditional import store_validator, conditional_response
+from app.utils.events import store_events, RESYNC
+from app.utils.permissions import get_access, scope_query, Permission
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 
 @main_bp.route('/')
@@ -26,28 +36,29 @@ def dashboard():
     
     # If user is an admin (any type), they should be able to see the admin dashboard 
     # only when they don't have an active store selected
-    if current_user.role in [UserRole.ADMIN_GLOBAL, UserRole.PARTNER_ADMIN] and not active_store_id:
+    access = get_access()
+    if access.can(Permission.MANAGE_ITEMS) and not active_store_id:
         # For admins without a specific store context, show a global overview
         stores_count = Store.query.count()
         users_count = User.query.count()
         inventory_count = Inventory.query.count()
         
         # Get all available stores based on user role
-        if current_user.role == UserRole.ADMIN_GLOBAL:
+        if access.can(Permission.SELECT_ALL_STORES):
             # Global admins can access all stores
             stores = Store.query.all()
         else:
             # Partner admins can only access their assigned stores
-            stores = current_user.stores
+            stores = Store.query.filter(Store.id.in_(access.store_ids)).all()
         
         # Define admin endpoints based on role
         admin_endpoints = []
-        if current_user.role == UserRole.ADMIN_GLOBAL:
+        if access.can(Permission.ADMINISTER):
             admin_endpoints = [
                 {'name': 'Manage Stores', 'url': url_for('admin.stores')},
                 {'name': 'View Security Logs', 'url': url_for('admin.security_logs')}
             ]
-        elif current_user.role == UserRole.PARTNER_ADMIN:
+        else:
             admin_endpoints = [
                 {'name': 'View Security Logs', 'url': url_for('admin.security_logs')}
             ]
@@ -74,9 +85,9 @@ def dashboard():
     
     # If no store is selected and the user has stores assigned, redirect to store selection
     if not active_store_id:
-        if current_user.stores:
+        if access.store_ids:
             return redirect(url_for('main.select_store'))
-        elif current_user.role == UserRole.USER:  # Regular users without store assignments
+        else:  # Regular users without store assignments
             flash('You do not have any store assignments. Please contact an administrator.', 'warning')
             return render_template('main/no_stores.html', title='No Stores Assigned')
     
@@ -84,62 +95,63 @@ def dashboard():
     active_store = Store.query.get_or_404(active_store_id)
     
     # Get all available stores based on user role
-    if current_user.role == UserRole.ADMIN_GLOBAL:
+    if access.can(Permission.SELECT_ALL_STORES):
         # Global admins can access all stores
         stores = Store.query.all()
     else:
         # Regular users and partner admins can only access their assigned stores
-        stores = current_user.stores
+        stores = Store.query.filter(Store.id.in_(access.store_ids)).all()
     
     # Choose template based on user role
-    template = 'main/admin_dashboard.html' if current_user.role in [UserRole.ADMIN_GLOBAL, UserRole.PARTNER_ADMIN] else 'main/dashboard.html'
-    
-    # Build dashboard data based on role
-    dashboard_data = {}
-    
-    # Query base for inventory in the active store
-    query = Inventory.query.filter_by(store_id=active_store_id)
-    
-    # Apply role-based filtering for inventory
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        query = query.filter_by(item_type=ItemType.ACCESSORIES)
-    
-    # Get inventory summary
-    inventory_count = query.count()
-    low_stock_count = query.filter(Inventory.quantity <= 5).count()
-    out_of_stock_count = query.filter(Inventory.quantity <= 0).count()
-    
-    dashboard_data.update({
-        'inventory_count': inventory_count,
-        'low_stock_count': low_stock_count,
-        'out_of_stock_count': out_of_stock_count
-    })
-    
-    # Get recent transactions for this store
-    transaction_query = Transaction.query.filter_by(store_id=active_store_id)
-    
-    # If user is regular user or partner admin, filter to only accessories transactions
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        # Join with inventory to filter by item type
-        transaction_query = transaction_query.join(
-            Inventory, Transaction.item_id == Inventory.id
-        ).filter(Inventory.item_type == ItemType.ACCESSORIES)
+    template = 'main/admin_dashboard.html' if access.can(Permission.MANAGE_ITEMS) else 'main/dashboard.html'
     
-    # Get recent transactions
-    recent_transactions = transaction_query.order_by(
-        Transaction.timestamp.desc()
-    ).limit(5).all()
+    # Regular users and partner admins only see accessories
+    item_type = access.item_type
     
-    # Get transaction count for the past 7 days
-    week_ago = datetime.utcnow() - timedelta(days=7)
-    transaction_count = transaction_query.filter(
-        Transaction.timestamp >= week_ago
-    ).count()
+    def build_dashboard_data():
+        # Build dashboard data based on role
+        dashboard_data = {}
+        
+        # Get inventory summary
+        inventory_stats = get_inventory_stats(active_store_id, item_type)
+        
+        dashboard_data.update({
+            'inventory_count': inventory_stats['total'],
+            # Low stock on the dashboard is every open alert, so it includes items that
+            # are already out of stock and follows each item's own threshold
+            'low_stock_count': get_alert_counts(active_store_id, item_type)['total'],
+            'out_of_stock_count': inventory_stats['out_of_stock']
+        })
+        
+        # Get recent transactions for this store, only accessories for regular users and partner admins
+        transaction_query = scope_query(
+            Transaction.query.options(joinedload(Transaction.item)), Transaction, active_store_id
+        )
+        
+        # Get recent transactions, as plain data so they can be cached
+        recent_transactions = [{
+            'timestamp': t.timestamp,
+            'item': {'part_number': t.item.part_number, 'name': t.item.name} if t.item else None,
+            'transaction_type': t.transaction_type,
+            'quantity_change': t.quantity_change,
+            'notes': t.notes or ''
+        } for t in transaction_query.order_by(Transaction.timestamp.desc()).limit(5)]
+        
+        dashboard_data.update({
+            'recent_transactions': recent_transactions,
+            'transaction_count_7d': get_stock_movement(active_store_id, item_type)['transaction_count']
+        })
+        
+        # Items at or below their forecast reorder point, most urgent first
+        reorder_count, reorder_items = get_reorder_items(active_store_id, item_type)
+        dashboard_data.update({
+            'reorder_count': reorder_count,
+            'reorder_items': reorder_items
+        })
+        
+        return dashboard_data
     
-    dashboard_data.update({
-        'recent_transactions': recent_transactions,
-        'transaction_count_7d': transaction_count
-    })
+    dashboard_data = response_cache.get_or_compute(active_store_id, build_dashboard_data)
     
     return render_template(
         template,
@@ -154,12 +166,13 @@ def dashboard():
 def select_store():
     """Store selection route."""
     # Get stores available to the user
-    if current_user.role == UserRole.ADMIN_GLOBAL:
+    access = get_access()
+    if access.can(Permission.SELECT_ALL_STORES):
         # Global admins can access all stores
         stores = Store.query.all()
     else:
         # Partner admins and regular users can only access their assigned stores
-        stores = current_user.stores
+        stores = Store.query.filter(Store.id.in_(access.store_ids)).all()
     
     return render_template(
         'main/select_store.html',
@@ -174,11 +187,9 @@ def set_active_store(store_id):
     store = Store.query.get_or_404(store_id)
     
     # For partner admin users and regular users, check if they have access to this store
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        user_store_ids = [s.id for s in current_user.stores]
-        if store_id not in user_store_ids:
-            flash('You do not have access to this store.', 'danger')
-            return redirect(url_for('main.select_store'))
+    if not get_access().has_store(store_id):
+        flash('You do not have access to this store.', 'danger')
+        return redirect(url_for('main.select_store'))
     
     # Set the active store in the session
     session['active_store_id'] = store_id
@@ -201,55 +212,85 @@ def dashboard_stats():
     if not active_store_id:
         return jsonify({'error': 'No active store selected'}), 400
         
-    # Build query based on role
-    query = Inventory.query.filter_by(store_id=active_store_id)
+    # Regular users and partner admins only see accessories
+    item_type = get_access().item_type
     
-    # Apply role-based filtering
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        query = query.filter_by(item_type=ItemType.ACCESSORIES)
-    
-    # Get total inventory count
-    total_count = query.count()
-    
-    # Get item counts by quantity ranges
-    out_of_stock = query.filter(Inventory.quantity <= 0).count()
-    low_stock = query.filter(Inventory.quantity.between(1, 5)).count()
-    healthy_stock = query.filter(Inventory.quantity > 5).count()
-    
-    # Get inventory breakdown by type (only for admin_global)
-    type_breakdown = {}
-    if current_user.role == UserRole.ADMIN_GLOBAL:
-        for item_type in ItemType:
-            count = query.filter_by(item_type=item_type).count()
-            type_breakdown[item_type.value] = count
+    def build_stats():
+        # Read the inventory buckets from the summary and count transactions in one grouped query
+        inventory_stats = get_inventory_stats(active_store_id, item_type)
+        transaction_stats = get_transaction_stats(active_store_id, item_type)
+        
+        # Inventory breakdown by type is only shown to admin_global
+        is_global_admin = item_type is None
+        
+        return {
+            'inventory': {
+                'total': inventory_stats['total'],
+                'out_of_stock': inventory_stats['out_of_stock'],
+                'low_stock': inventory_stats['low_stock'],
+                'healthy_stock': inventory_stats['healthy_stock'],
+                'by_type': inventory_stats['by_type'] if is_global_admin else None
+            },
+            'transactions': {
+                'by_type': transaction_stats['by_type']
+            },
+            'alerts': get_alert_counts(active_store_id, item_type)
+        }
     
-    # Get recent transaction counts by type
+    # The 7-day counts also change when transactions age out of the window
     week_ago = datetime.utcnow() - timedelta(days=7)
+    first_in_window = db.session.query(func.min(Transaction.id)).filter(
+        Transaction.store_id == active_store_id,
+        Transaction.timestamp >= week_ago
+    ).scalar()
     
-    transaction_query = Transaction.query.filter_by(store_id=active_store_id)
-    
-    # Apply role-based filtering for transactions
-    if current_user.role == UserRole.USER or current_user.role == UserRole.PARTNER_ADMIN:
-        transaction_query = transaction_query.join(
-            Inventory, Transaction.item_id == Inventory.id
-        ).filter(Inventory.item_type == ItemType.ACCESSORIES)
-    
-    transaction_query = transaction_query.filter(Transaction.timestamp >= week_ago)
-    
-    transactions_by_type = {}
-    for t_type in TransactionType:
-        count = transaction_query.filter_by(transaction_type=t_type).count()
-        transactions_by_type[t_type.value] = count
-    
-    return jsonify({
-        'inventory': {
-            'total': total_count,
-            'out_of_stock': out_of_stock,
-            'low_stock': low_stock,
-            'healthy_stock': healthy_stock,
-            'by_type': type_breakdown if current_user.role == UserRole.ADMIN_GLOBAL else None
-        },
-        'transactions': {
-            'by_type': transactions_by_type
-        }
-    })
\ No newline at end of file
+    validator, last_modified = store_validator(active_store_id)
+    return conditional_response(
+        validator + (first_in_window,),
+        last_modified,
+        lambda: jsonify(response_cache.get_or_compute(active_store_id, build_stats))
+    )
+
+@main_bp.route('/api/stream/store/<int:store_id>')
+@login_required
+def store_stream(store_id):
+    """
+    Server-Sent Events stream of stock changes for a store.
+    
+    Sends a "stock" event with the item id, new quantity, transaction type and
+    ticket number for every committed transaction, a "resync" event when the
+    client fell behind and missed events, and a comment line as a heartbeat.
+    """
+    # Check if user has permission for the store
+    access = get_access()
+    if not access.has_store(store_id):
+        return jsonify({'error': 'Not authorized for this store'}), 403
+    
+    # Regular users and partner admins only see accessories
+    item_type = access.item_type.value if access.item_type else None
+    
+    subscription = store_events.subscribe(store_id, item_type)
+    heartbeat_interval = store_events.heartbeat_interval
+    
+    # The stream never touches the database, so don't hold a connection open for its lifetime
+    db.session.remove()
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while not subscription.closed:
+                event = subscription.get(timeout=heartbeat_interval)
+                if event is RESYNC:
+                    yield 'event: resync\ndata: {}\n\n'
+                elif event is not None:
+                    yield f"event: stock\ndata: {json.dumps(event)}\n\n"
+                else:
+                    yield ': keepalive\n\n'
+        finally:
+            store_events.unsubscribe(subscription)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
\ No newline at end of file
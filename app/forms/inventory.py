@@ -17,6 +17,7 @@ class InventoryItemForm(FlaskForm):
         (ItemType.CLOTHING.value, 'Clothing')
     ], validators=[DataRequired()])
     quantity = IntegerField('Initial Quantity', validators=[NumberRange(min=0)], default=0)
+    low_stock_threshold = IntegerField('Low Stock Threshold', validators=[Optional(), NumberRange(min=0)])
     store_id = SelectField('Store', validators=[DataRequired()], coerce=int)
     submit = SubmitField('Save Item')
     
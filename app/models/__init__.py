@@ -2,7 +2,14 @@ from app.models.db import db
 from app.models.user import User, PasswordHistory
 from app.models.store import Store
 from app.models.inventory import Inventory
+from app.models.inventory_search import FTS_TABLE
 from app.models.transaction import Transaction
 from app.models.security_log import SecurityLog
+from app.models.ticket_sequence import TicketSequence
+from app.models.stock_summary import StoreStockSummary, StoreStockMovement
+from app.models.stock_snapshot import StockSnapshot, StockSnapshotTime
+from app.models.item_forecast import ItemForecast
+from app.models.stock_alert import StockAlert
+from app.models.api_key import ApiKey
 
 # This file ensures all models are imported when the models package is imported
\ No newline at end of file
@@ -0,0 +1,24 @@
+from datetime import datetime
+from app.models.db import db
+
+class ApiKey(db.Model):
+    __tablename__ = 'api_keys'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    # The key's public prefix, looked up through its unique index before the hash is compared
+    prefix = db.Column(db.String(16), unique=True, nullable=False, index=True)
+    key_hash = db.Column(db.String(64), nullable=False)  # SHA-256 hex of the whole key
+    # The user the key acts as; its role sets what the key may do
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    # The one store the key may work in, or None for the user's stores
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), nullable=True)
+    tier = db.Column(db.String(20), nullable=False)  # Rate limit tier, a key of API_KEY_TIERS
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+    
+    user = db.relationship('User', backref=db.backref('api_keys', lazy='dynamic'))
+    store = db.relationship('Store')
+    
+    def __repr__(self):
+        return f'<ApiKey {self.prefix} {self.name}>'
@@ -22,4 +22,9 @@ class TransactionType(enum.Enum):
 # Define item types as an enum for type safety
 class ItemType(enum.Enum):
     ACCESSORIES = 'accessories'
-    CLOTHING = 'clothing'
\ No newline at end of file
+    CLOTHING = 'clothing'
+
+# Define stock alert kinds as an enum for type safety
+class StockAlertKind(enum.Enum):
+    LOW_STOCK = 'low_stock'
+    OUT_OF_STOCK = 'out_of_stock'
\ No newline at end of file
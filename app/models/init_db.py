@@ -9,14 +9,64 @@ from app.models.store import Store
 from app.models.inventory import Inventory
 from app.models.transaction import Transaction
 from app.models.security_log import SecurityLog
+from app.models.stock_snapshot import StockSnapshot, StockSnapshotTime
+from app.models.item_forecast import ItemForecast
+from app.models.stock_alert import StockAlert
+from app.models.api_key import ApiKey
+from app.models.inventory_search import create_search_index, rebuild_search_index
 from datetime import datetime, timedelta
 import random
+import sqlalchemy as sa
 
 def init_database():
     """Initialize the database by creating all tables."""
     db.create_all()
     print("Initialized the database tables.")
 
+def upgrade_database():
+    """
+    Bring an existing database up to date with the models.
+    Creates missing tables, then adds missing columns and indexes to existing tables.
+    Columns added this way must be nullable or have a server default.
+    """
+    db.create_all()
+    inspector = sa.inspect(db.engine)
+    
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=db.engine.dialect)}'
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    ddl += f' DEFAULT {default.text if hasattr(default, "text") else repr(default)}'
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+                connection.execute(sa.text(ddl))
+                print(f"Added column {table.name}.{column.name}")
+            
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        
+        # Record the snapshots written before their times were kept
+        connection.execute(sa.insert(StockSnapshotTime).from_select(
+            ['taken_at', 'item_count'],
+            sa.select(StockSnapshot.taken_at, sa.func.count()).where(
+                StockSnapshot.taken_at.not_in(sa.select(StockSnapshotTime.taken_at))
+            ).group_by(StockSnapshot.taken_at)
+        ))
+        
+        # Index the existing items when the search index is new
+        if create_search_index(connection):
+            rebuild_search_index(connection)
+            print("Created and populated the inventory search index.")
+    
+    print("Upgraded the database schema.")
+
 def seed_database():
     """Seed the database with initial test data."""
     print("Seeding the database with test data...")
@@ -24,8 +74,13 @@ def seed_database():
     # Clear existing data
     SecurityLog.query.delete()
     Transaction.query.delete()
+    StockSnapshot.query.delete()
+    StockSnapshotTime.query.delete()
+    ItemForecast.query.delete()
+    StockAlert.query.delete()
     Inventory.query.delete()
     PasswordHistory.query.delete()
+    ApiKey.query.delete()
     User.query.delete()
     Store.query.delete()
     db.session.commit()
@@ -246,4 +301,11 @@ def seed_database():
     
     # Commit all changes
     db.session.commit()
+    
+    # The bulk deletes above bypass the incremental summary updates and alerts, so recompute them
+    from app.utils.stock_summary import rebuild_stock_summary
+    from app.utils.alerts import rebuild_stock_alerts
+    rebuild_stock_summary()
+    rebuild_stock_alerts()
+    db.session.commit()
     print("Database seeded with test data successfully!")
\ No newline at end of file
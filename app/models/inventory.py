@@ -4,6 +4,10 @@ import sqlalchemy as sa
 
 class Inventory(db.Model):
     __tablename__ = 'inventory'
+    __table_args__ = (
+        # Serves the per-store item list, which pages through a store by part number
+        db.Index('ix_inventory_store_part_number', 'store_id', 'part_number'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     part_number = db.Column(db.String(50), unique=True, nullable=False, index=True)
@@ -11,6 +15,10 @@ class Inventory(db.Model):
     description = db.Column(db.Text, nullable=True)
     item_type = db.Column(sa.Enum(ItemType), nullable=False)
     quantity = db.Column(db.Integer, default=0)
+    # Quantity at or below which the item raises a low stock alert; None uses its type's default
+    low_stock_threshold = db.Column(db.Integer, nullable=True)
+    # Bumped by every stock change; used for optimistic concurrency checks
+    version = db.Column(db.Integer, nullable=False, default=0, server_default=sa.text('0'))
     store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,78 @@
+"""
+SQLite FTS5 index over inventory part numbers, names and descriptions.
+
+inventory_fts is an external-content FTS5 table: it stores only the index and
+reads the text from the inventory table. Triggers keep it in step with every
+insert, delete and text change, including bulk statements that bypass the ORM.
+Quantity updates don't touch the index.
+"""
+import sqlalchemy as sa
+from app.models.inventory import Inventory
+
+FTS_TABLE = 'inventory_fts'
+
+_CREATE_STATEMENTS = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        part_number, name, description,
+        content='inventory', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS inventory_fts_insert AFTER INSERT ON inventory BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, part_number, name, description)
+        VALUES (new.id, new.part_number, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS inventory_fts_delete AFTER DELETE ON inventory BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, part_number, name, description)
+        VALUES ('delete', old.id, old.part_number, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS inventory_fts_update AFTER UPDATE OF part_number, name, description ON inventory BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, part_number, name, description)
+        VALUES ('delete', old.id, old.part_number, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, part_number, name, description)
+        VALUES (new.id, new.part_number, new.name, new.description);
+    END
+    """
+]
+
+def search_index_supported(connection):
+    """FTS5 is SQLite-only; other databases fall back to LIKE matching."""
+    return connection.dialect.name == 'sqlite'
+
+def create_search_index(connection):
+    """
+    Create the FTS table and its triggers if they don't exist yet.
+    
+    Returns:
+        bool: True if the index was created and needs a rebuild
+    """
+    if not search_index_supported(connection):
+        return False
+    exists = connection.execute(
+        sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).first()
+    for statement in _CREATE_STATEMENTS:
+        connection.execute(sa.text(statement))
+    return exists is None
+
+def rebuild_search_index(connection):
+    """Re-index every inventory row, e.g. after creating the index on an existing database."""
+    if search_index_supported(connection):
+        connection.execute(sa.text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+@sa.event.listens_for(Inventory.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    create_search_index(connection)
+
+@sa.event.listens_for(Inventory.__table__, 'before_drop')
+def _drop_search_index(target, connection, **kw):
+    # The triggers go with the inventory table, but the virtual table doesn't
+    if search_index_supported(connection):
+        connection.execute(sa.text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
@@ -0,0 +1,24 @@
+from datetime import datetime
+from app.models.db import db
+
+class ItemForecast(db.Model):
+    __tablename__ = 'item_forecasts'
+    
+    # Demand forecast and reorder point per item, recomputed in bulk by flask refresh-forecasts
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory.id'), primary_key=True)
+    daily_demand = db.Column(db.Float, nullable=False, default=0)
+    demand_std = db.Column(db.Float, nullable=False, default=0)
+    reorder_point = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    item = db.relationship('Inventory', backref=db.backref('forecast', uselist=False, cascade='all, delete-orphan'))
+    
+    def days_of_cover(self, quantity):
+        """Days the given quantity lasts at the forecast demand, or None if there is no demand."""
+        if self.daily_demand <= 0:
+            return None
+        return max(quantity or 0, 0) / self.daily_demand
+    
+    def __repr__(self):
+        return f'<ItemForecast item={self.item_id} demand={self.daily_demand:.2f} rop={self.reorder_point}>'
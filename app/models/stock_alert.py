@@ -0,0 +1,25 @@
+from datetime import datetime
+from app.models.db import db, StockAlertKind
+import sqlalchemy as sa
+
+class StockAlert(db.Model):
+    __tablename__ = 'stock_alerts'
+    __table_args__ = (
+        # At most one open alert per item; it also serves the "what's low right now" lookups,
+        # which only need to read the open alerts
+        db.Index('ix_stock_alerts_open', 'item_id', unique=True,
+                 sqlite_where=sa.text('resolved_at IS NULL'), postgresql_where=sa.text('resolved_at IS NULL')),
+        # An item's alert history, and deleting it with the item
+        db.Index('ix_stock_alerts_item_raised', 'item_id', 'raised_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory.id'), nullable=False)
+    kind = db.Column(sa.Enum(StockAlertKind), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    threshold = db.Column(db.Integer, nullable=False)
+    raised_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<StockAlert {self.kind.value} item={self.item_id} qty={self.quantity}>'
@@ -0,0 +1,27 @@
+from app.models.db import db
+
+class StockSnapshot(db.Model):
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        # Find an item's rows when it's deleted
+        db.Index('ix_stock_snapshots_item', 'item_id'),
+    )
+    
+    # Quantity of each item at a checkpoint; historical stock queries replay the ledger from the nearest one.
+    # Items at zero (or not created yet) are left out to keep the checkpoints compact.
+    taken_at = db.Column(db.DateTime, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('inventory.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<StockSnapshot item={self.item_id} at={self.taken_at} qty={self.quantity}>'
+
+class StockSnapshotTime(db.Model):
+    __tablename__ = 'stock_snapshot_times'
+    
+    # One row per finished snapshot, including those with no rows because nothing was in stock
+    taken_at = db.Column(db.DateTime, primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<StockSnapshotTime {self.taken_at} items={self.item_count}>'
@@ -0,0 +1,29 @@
+from app.models.db import db, ItemType
+import sqlalchemy as sa
+
+class StoreStockSummary(db.Model):
+    __tablename__ = 'store_stock_summary'
+    
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), primary_key=True)
+    item_type = db.Column(sa.Enum(ItemType), primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    out_of_stock_count = db.Column(db.Integer, nullable=False, default=0)
+    low_stock_count = db.Column(db.Integer, nullable=False, default=0)
+    total_units = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<StoreStockSummary store={self.store_id} type={self.item_type.value}>'
+
+
+class StoreStockMovement(db.Model):
+    __tablename__ = 'store_stock_movement'
+    
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), primary_key=True)
+    item_type = db.Column(sa.Enum(ItemType), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    units_in = db.Column(db.Integer, nullable=False, default=0)
+    units_out = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<StoreStockMovement store={self.store_id} type={self.item_type.value} day={self.day}>'
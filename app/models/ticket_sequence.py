@@ -0,0 +1,10 @@
+from app.models.db import db
+
+class TicketSequence(db.Model):
+    __tablename__ = 'ticket_sequences'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<TicketSequence {self.name} - {self.last_value}>'
@@ -4,6 +4,15 @@ import sqlalchemy as sa
 
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # Serve the transaction report, which pages by (timestamp, id) under each filter;
+        # the first one also covers the point-in-time stock sums over item_id and quantity_change
+        db.Index('ix_transactions_timestamp_changes', 'timestamp', 'item_id', 'quantity_change'),
+        db.Index('ix_transactions_store_timestamp', 'store_id', 'timestamp'),
+        db.Index('ix_transactions_type_timestamp', 'transaction_type', 'timestamp'),
+        # Sum an item's ledger from the index alone, for reconciliation and item deletes
+        db.Index('ix_transactions_item_changes', 'item_id', 'quantity_change'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     ticket_number = db.Column(db.String(50), unique=True, nullable=False, index=True)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_login import UserMixin
 from app.models.db import db, UserRole
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.utils.passwords import password_hasher
 import sqlalchemy as sa
 
 # Association table for User-Store many-to-many relationship
@@ -10,6 +10,9 @@ user_stores = db.Table('user_stores',
     db.Column('store_id', db.Integer, db.ForeignKey('stores.id'), primary_key=True)
 )
 
+# Roles by their stored value
+ROLES_BY_VALUE = {role.value: role for role in UserRole}
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -39,11 +42,7 @@ class User(UserMixin, db.Model):
     # Property getter for role - converts string to enum
     @property
     def role(self):
-        # Find the matching enum by value
-        for role_enum in UserRole:
-            if role_enum.value == self._role:
-                return role_enum
-        return None
+        return ROLES_BY_VALUE.get(self._role)
         
     # Property setter for role - converts enum to string
     @role.setter
@@ -60,9 +59,14 @@ class User(UserMixin, db.Model):
         else:
             raise TypeError(f"Expected UserRole enum or string, got {type(value)}")
     
+    @property
+    def store_ids(self):
+        """Ids of the stores the user is assigned to."""
+        return frozenset(store.id for store in self.stores)
+    
     def set_password(self, password):
         """Set the user's password hash and record it in the password history."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
         self.password_last_changed = datetime.utcnow()
         
         # Only add to password history if the user already exists in the database (has an ID)
@@ -73,7 +77,7 @@ class User(UserMixin, db.Model):
     
     def check_password(self, password):
         """Check if the provided password matches the stored hash."""
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -89,7 +93,7 @@ class PasswordHistory(db.Model):
     
     def is_same_password(self, password):
         """Check if the provided password matches this history entry."""
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
     
     def __repr__(self):
         return f'<PasswordHistory user_id={self.user_id} timestamp={self.timestamp}>'
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Low stock alerts, raised and resolved as stock changes are written.
+
+Each item is in one of three levels: in stock, low (at or below its threshold)
+or out of stock. create_transaction passes the quantities before and after each
+change, so a change that stays within a level costs nothing; only a crossing
+writes to stock_alerts, resolving the item's open alert and raising one for the
+new level. The open alerts are then what's low right now, read through the
+partial ix_stock_alerts_open index instead of scanning the inventory.
+"""
+from datetime import datetime
+import sqlalchemy as sa
+from app.models.db import db, StockAlertKind
+from app.models.inventory import Inventory
+from app.models.stock_alert import StockAlert
+from app.utils.stock_summary import low_stock_threshold
+
+def alert_level(quantity, threshold):
+    """Return the alert kind for a quantity, or None if the item is in stock."""
+    quantity = quantity or 0
+    if quantity <= 0:
+        return StockAlertKind.OUT_OF_STOCK
+    if quantity <= threshold:
+        return StockAlertKind.LOW_STOCK
+    return None
+
+def on_stock_change(item, before, after):
+    """
+    Raise or resolve the item's alert if a stock change crossed a level.
+    Runs in the caller's transaction; changes that stay within a level don't touch the database.
+    
+    Args:
+        item (Inventory): The item that changed
+        before (int): Quantity before the change
+        after (int): Quantity after the change
+    """
+    threshold = low_stock_threshold(item)
+    level = alert_level(after, threshold)
+    if alert_level(before, threshold) != level:
+        _set_alert(item.id, level, after, threshold)
+
+def sync_stock_alert(item):
+    """
+    Bring the item's open alert in line with its current quantity and threshold,
+    e.g. after its threshold or type was edited. Unlike on_stock_change this reads
+    the open alert, so it works without knowing the previous state.
+    """
+    threshold = low_stock_threshold(item)
+    level = alert_level(item.quantity, threshold)
+    open_kind = db.session.scalar(
+        sa.select(StockAlert.kind).where(StockAlert.item_id == item.id, StockAlert.resolved_at.is_(None))
+    )
+    if open_kind != level:
+        _set_alert(item.id, level, item.quantity or 0, threshold)
+
+def _set_alert(item_id, level, quantity, threshold):
+    """Resolve the item's open alert and raise one for the new level, if any."""
+    now = datetime.utcnow()
+    connection = db.session.connection()
+    connection.execute(
+        sa.update(StockAlert).where(
+            StockAlert.item_id == item_id,
+            StockAlert.resolved_at.is_(None)
+        ).values(resolved_at=now)
+    )
+    if level is not None:
+        connection.execute(sa.insert(StockAlert).values(
+            item_id=item_id,
+            kind=level,
+            quantity=quantity,
+            threshold=threshold,
+            raised_at=now
+        ))
+
+def open_alerts_query(store_id, item_type=None):
+    """Return a query over the store's open alerts, joined to their items."""
+    query = db.session.query(StockAlert, Inventory).join(
+        Inventory, StockAlert.item_id == Inventory.id
+    ).filter(
+        StockAlert.resolved_at.is_(None),
+        Inventory.store_id == store_id
+    )
+    if item_type is not None:
+        query = query.filter(Inventory.item_type == item_type)
+    return query
+
+def get_alert_counts(store_id, item_type=None):
+    """
+    Count a store's open alerts by kind.
+    
+    Returns:
+        dict: low_stock, out_of_stock and total counts
+    """
+    counts = {kind.value: 0 for kind in StockAlertKind}
+    rows = open_alerts_query(store_id, item_type).with_entities(
+        StockAlert.kind, sa.func.count(StockAlert.id)
+    ).group_by(StockAlert.kind)
+    for kind, count in rows:
+        counts[kind.value] = count
+    counts['total'] = sum(counts.values())
+    return counts
+
+def rebuild_stock_alerts():
+    """
+    Resolve every open alert and raise fresh ones from the current quantities, e.g.
+    after thresholds were changed in the config. The caller commits.
+    
+    Returns:
+        int: Number of alerts raised
+    """
+    now = datetime.utcnow()
+    db.session.execute(
+        sa.update(StockAlert).where(StockAlert.resolved_at.is_(None)).values(resolved_at=now)
+    )
+    
+    alerts = []
+    items = db.session.execute(
+        sa.select(Inventory.id, Inventory.item_type, Inventory.quantity, Inventory.low_stock_threshold)
+    ).all()
+    for item in items:
+        threshold = low_stock_threshold(item)
+        level = alert_level(item.quantity, threshold)
+        if level is not None:
+            alerts.append({
+                'item_id': item.id,
+                'kind': level,
+                'quantity': item.quantity or 0,
+                'threshold': threshold,
+                'raised_at': now
+            })
+    
+    if alerts:
+        db.session.execute(sa.insert(StockAlert), alerts)
+    return len(alerts)
@@ -0,0 +1,260 @@
+"""
+API key authentication for machine clients (POS terminals, integrations).
+
+Clients send their key as "Authorization: Bearer <key>" or "X-API-Key: <key>".
+A request with a valid key is signed in as the key's user for that request
+only: it doesn't use the session, skips the CSRF check (browsers can't send
+these headers cross-site) and is rate limited by key, on the key's tier,
+instead of by address on the default limits. Keys never carry the
+ADMINISTER permission, and a key with a store works in that store only.
+"""
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+import sqlalchemy as sa
+from flask import g, request, current_app, jsonify
+from flask.sessions import SecureCookieSessionInterface
+from flask_login import current_user
+from app.models.db import db
+from app.models.api_key import ApiKey
+from app.models.user import User
+from app.models.store import Store
+from app.utils.identity import UserIdentity, identity_cache
+from app.utils.permissions import resolve_access
+from app.utils.auth import log_security_event
+
+# Keys look like ims_<prefix>_<secret>; the prefix finds the row, the hash of the whole key proves it
+KEY_PREFIX = 'ims'
+
+# Rate limit tiers; API_KEY_TIERS overrides them
+DEFAULT_TIERS = {
+    'basic': '2000 per day; 500 per hour',
+    'standard': '20000 per day; 2000 per hour',
+    'high': '200000 per day; 20000 per hour',
+}
+
+def hash_api_key(key):
+    """
+    Return the SHA-256 hex digest of a key. Keys carry 256 random bits, so a
+    fast hash is enough; the slow password hash would only add cost per request.
+    """
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def generate_api_key():
+    """
+    Make a new key.
+    
+    Returns:
+        tuple: (key, prefix, key_hash); only the prefix and hash are stored
+    """
+    prefix = secrets.token_hex(6)
+    key = f'{KEY_PREFIX}_{prefix}_{secrets.token_urlsafe(32)}'
+    return key, prefix, hash_api_key(key)
+
+class ApiKeyIdentity(UserIdentity):
+    """The key's user, as seen by a request signed in with the key."""
+    is_api_key = True
+    
+    def __init__(self, user, key_id, tier, store_id):
+        store_ids = frozenset([store_id]) if store_id is not None else user.store_ids
+        super().__init__(user.id, user.username, user.role, store_ids)
+        self.api_key_id = key_id
+        self.api_key_tier = tier
+        self.api_key_store_id = store_id
+    
+    def __repr__(self):
+        return f'<ApiKeyIdentity {self.username} key={self.api_key_id}>'
+
+class ApiKeySessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions that are never saved for requests signed in with an API key."""
+    
+    def save_session(self, app, session, response):
+        # Machine clients don't keep cookies; anything a view flashes for them is dropped
+        if g.get('api_key') is not None:
+            return
+        super().save_session(app, session, response)
+
+class ApiKeyAuth:
+    """
+    Verify API keys, caching the verified ones.
+    
+    A key seen for the first time costs one lookup through the unique prefix
+    index and a hash comparison; after that it is served from memory for ttl
+    seconds. Revoking a key, or locking or editing its user, drops it from this
+    process's cache on commit (see invalidate_api_key_on_commit and
+    invalidate_user_api_keys_on_commit); other workers accept it until their
+    entry expires.
+    """
+    
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.tiers = dict(DEFAULT_TIERS)
+        self.default_tier = 'standard'
+        self.check_csrf = True
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'rejected': 0, 'invalidations': 0}
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read the key settings from the app config and take over the CSRF check."""
+        self.ttl = app.config.get('API_KEY_CACHE_TTL', 60)
+        self.tiers = app.config.get('API_KEY_TIERS', dict(DEFAULT_TIERS))
+        self.default_tier = app.config.get('API_KEY_DEFAULT_TIER', 'standard')
+        
+        # Flask-WTF checks every form post itself; check here instead, so API key requests can skip it.
+        # protect(apply_exemptions=True) needs Flask-WTF 1.3
+        self.check_csrf = app.config.get('WTF_CSRF_CHECK_DEFAULT', True)
+        app.config['WTF_CSRF_CHECK_DEFAULT'] = False
+        app.before_request(self._check_request)
+        app.session_interface = ApiKeySessionInterface()
+        app.extensions['api_keys'] = self
+    
+    def authenticate(self, key):
+        """Return the ApiKeyIdentity for a key, or None if it is unknown, revoked or its user is locked."""
+        digest = hash_api_key(key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+        if entry is not None and entry[0] > now:
+            self._count('hits')
+            record = entry[1]
+        else:
+            self._count('misses')
+            record = _load_key(key, digest)
+            if record is None:
+                self._count('rejected')
+                return None
+            with self._lock:
+                self._entries[digest] = (now + self.ttl, record)
+        
+        key_id, user_id, tier, store_id = record
+        user = identity_cache.load(user_id)
+        if user is None:
+            return None
+        return ApiKeyIdentity(user, key_id, tier, store_id)
+    
+    def tier_limits(self, tier):
+        """Return the rate limits of a tier, or of the default tier if it isn't configured."""
+        return self.tiers.get(tier) or self.tiers[self.default_tier]
+    
+    def invalidate(self, key_ids=None):
+        """Drop the given keys from the cache, or all of them if key_ids is None."""
+        with self._lock:
+            if key_ids is None:
+                self._entries.clear()
+            else:
+                for digest, (expires, record) in list(self._entries.items()):
+                    if record[0] in key_ids:
+                        del self._entries[digest]
+            self._counters['invalidations'] += 1
+    
+    def stats(self):
+        """Return the hit/miss counters and the current size."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        stats['ttl'] = self.ttl
+        stats['tiers'] = self.tiers
+        return stats
+    
+    def _check_request(self):
+        """Refuse requests with a bad key, and check CSRF tokens on the others unless they used a key."""
+        if _key_from_request() is not None and current_api_key() is None:
+            log_security_event('api_key_rejected', f'Invalid or revoked API key used on {request.path}')
+            return jsonify({'error': 'Invalid or revoked API key'}), 401
+        
+        if (self.check_csrf and current_app.config['WTF_CSRF_ENABLED']
+                and request.method in current_app.config['WTF_CSRF_METHODS']
+                and not getattr(current_user, 'is_api_key', False)):
+            current_app.extensions['csrf'].protect(apply_exemptions=True)
+    
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+def _load_key(key, digest):
+    """Look a key up by its prefix; return (key_id, user_id, tier, store_id) if it matches."""
+    parts = key.split('_', 2)
+    if len(parts) != 3 or parts[0] != KEY_PREFIX:
+        return None
+    
+    row = db.session.execute(
+        sa.select(ApiKey.id, ApiKey.key_hash, ApiKey.user_id, ApiKey.tier, ApiKey.store_id, User.is_locked)
+        .join(User, User.id == ApiKey.user_id)
+        .where(ApiKey.prefix == parts[1], ApiKey.revoked_at.is_(None))
+    ).first()
+    if row is None or row.is_locked or not hmac.compare_digest(row.key_hash, digest):
+        return None
+    return row.id, row.user_id, row.tier, row.store_id
+
+def _key_from_request():
+    authorization = request.headers.get('Authorization', '')
+    if authorization[:7].lower() == 'bearer ':
+        return authorization[7:].strip() or None
+    return request.headers.get('X-API-Key') or None
+
+api_key_auth = ApiKeyAuth()
+
+def current_api_key():
+    """Return the ApiKeyIdentity of the request's API key, verified once per request, or None."""
+    if 'api_key' not in g:
+        key = _key_from_request()
+        g.api_key = api_key_auth.authenticate(key) if key is not None else None
+    return g.api_key
+
+def create_api_key(user, name, tier=None, store_id=None):
+    """
+    Add an API key for a user. The caller commits.
+    
+    Args:
+        user (User): The user the key acts as
+        name (str): What the key is for, e.g. the terminal's name
+        tier (str, optional): Rate limit tier; defaults to API_KEY_DEFAULT_TIER
+        store_id (int, optional): The one store the key may work in
+    
+    Returns:
+        tuple: (ApiKey, key); the key is only available now
+    
+    Raises:
+        ValueError: If the tier is unknown or the user can't work in the store
+    """
+    tier = tier or api_key_auth.default_tier
+    if tier not in api_key_auth.tiers:
+        raise ValueError(f"Unknown tier {tier!r}; choose from {', '.join(api_key_auth.tiers)}")
+    if store_id is not None:
+        if db.session.get(Store, store_id) is None:
+            raise ValueError(f'No store with id {store_id}')
+        if not resolve_access(user.role, user.store_ids).has_store(store_id):
+            raise ValueError(f'{user.username} is not assigned to store {store_id}')
+    
+    key, prefix, key_hash = generate_api_key()
+    api_key = ApiKey(name=name, prefix=prefix, key_hash=key_hash, user_id=user.id, store_id=store_id, tier=tier)
+    db.session.add(api_key)
+    return api_key, key
+
+def invalidate_api_key_on_commit(key_id):
+    """Drop a key from the cache once the current transaction commits, e.g. after revoking it."""
+    db.session.info.setdefault('invalidate_api_key_ids', set()).add(key_id)
+
+def invalidate_user_api_keys_on_commit(user_id):
+    """
+    Drop all of a user's keys from the cache once the current transaction commits.
+    Cached keys skip the lock check, so call this when a user is locked or edited.
+    """
+    for key_id in db.session.scalars(sa.select(ApiKey.id).where(ApiKey.user_id == user_id)):
+        invalidate_api_key_on_commit(key_id)
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    key_ids = session.info.pop('invalidate_api_key_ids', None)
+    if key_ids:
+        api_key_auth.invalidate(key_ids)
+
+@sa.event.listens_for(db.session, 'after_soft_rollback')
+def _discard_invalidations(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('invalidate_api_key_ids', None)
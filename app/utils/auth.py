@@ -4,16 +4,18 @@ Authentication and authorization utilities for the inventory application.
 from functools import wraps
 from flask import abort, request, current_app, session
 from flask_login import current_user
-from app.models.db import UserRole
 from app.models.security_log import SecurityLog
 from app.models.db import db
+from app.utils.unit_of_work import in_unit_of_work
+from app.utils.security_log_writer import security_log_writer
+from app.utils.permissions import get_access, Permission
 import datetime
 
 def admin_required(f):
     """Decorator for routes that require admin_global role."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_authenticated or current_user.role != UserRole.ADMIN_GLOBAL:
+        if not get_access().can(Permission.ADMINISTER):
             log_security_event('unauthorized_access_attempt', 
                               f"User attempted to access admin-only resource: {request.path}")
             abort(403)  # Forbidden
@@ -24,9 +26,7 @@ def partner_admin_required(f):
     """Decorator for routes that require partner_admin or higher role."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_authenticated or (
-            current_user.role != UserRole.ADMIN_GLOBAL and 
-            current_user.role != UserRole.PARTNER_ADMIN):
+        if not get_access().can(Permission.MANAGE_ITEMS):
             log_security_event('unauthorized_access_attempt', 
                               f"User attempted to access partner admin resource: {request.path}")
             abort(403)  # Forbidden
@@ -43,7 +43,7 @@ def login_required_with_store(f):
             abort(401)  # Unauthorized
         
         # Check if user has an active store selected
-        active_store_id = session.get('active_store_id')
+        active_store_id = get_active_store_id()
         
         if not active_store_id:
             log_security_event('missing_store_context', 
@@ -51,12 +51,10 @@ def login_required_with_store(f):
             abort(400, description="No active store selected")
             
         # For regular users, verify they're assigned to this store
-        if current_user.role == UserRole.USER:
-            user_store_ids = [store.id for store in current_user.stores]
-            if active_store_id not in user_store_ids:
-                log_security_event('unauthorized_store_access', 
-                                  f"User attempted to access unassigned store: {active_store_id}")
-                abort(403, description="Not authorized for this store")
+        if not get_access().has_store(active_store_id, Permission.VIEW_ALL_STORES):
+            log_security_event('unauthorized_store_access', 
+                              f"User attempted to access unassigned store: {active_store_id}")
+            abort(403, description="Not authorized for this store")
                 
         return f(*args, **kwargs)
     return decorated_function
@@ -103,6 +101,8 @@ def log_security_event(event_type, description, user_id=None):
     """
     Log a security event to the security_logs table.
     If user_id is not provided but user is authenticated, use current_user.id.
+    Inside a unit of work the log row is committed together with the change it describes;
+    otherwise it is handed to the background writer, or committed directly if that is disabled.
     """
     if user_id is None and current_user.is_authenticated:
         user_id = current_user.id
@@ -111,11 +111,18 @@ def log_security_event(event_type, description, user_id=None):
         user_id=user_id,
         ip_address=request.remote_addr,
         event_type=event_type,
-        description=description
+        description=description,
+        timestamp=datetime.datetime.utcnow()
     )
     
-    db.session.add(log)
-    db.session.commit()
+    if in_unit_of_work():
+        db.session.add(log)
+    elif security_log_writer.enabled:
+        if not security_log_writer.submit(log):
+            current_app.logger.warning(f"Security log queue full, dropped event: {event_type}")
+    else:
+        db.session.add(log)
+        db.session.commit()
     
     # Also log to application logger for immediate visibility
     current_app.logger.info(f"SECURITY: {event_type} - {description} - User: {user_id} - IP: {request.remote_addr}")
@@ -130,16 +137,24 @@ def get_user_active_store_context():
     
     Returns tuple: (store_id, is_valid)
     """
-    active_store_id = session.get('active_store_id')
+    active_store_id = get_active_store_id()
     
     # If no active store is set
     if not active_store_id:
         return None, False
         
     # For regular users, verify they're assigned to this store
-    if current_user.role == UserRole.USER:
-        user_store_ids = [store.id for store in current_user.stores]
-        if active_store_id not in user_store_ids:
-            return None, False
+    if not get_access().has_store(active_store_id, Permission.VIEW_ALL_STORES):
+        return None, False
     
-    return active_store_id, True
\ No newline at end of file
+    return active_store_id, True
+
+def get_active_store_id():
+    """
+    Return the id of the store the request works in, unchecked. Requests signed in
+    with an API key use the key's store, or the store_id argument if the key has none;
+    others use the store selected in the session.
+    """
+    if getattr(current_user, 'is_api_key', False):
+        return current_user.api_key_store_id or request.args.get('store_id', type=int)
+    return session.get('active_store_id')
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+In-process cache for the data behind the dashboard and report views.
+"""
+import threading
+import time
+from collections import OrderedDict
+import sqlalchemy as sa
+from flask import request
+from flask_login import current_user
+from app.models.db import db
+from app.models.inventory import Inventory
+from app.models.store import Store
+from app.utils.permissions import get_access, Permission
+
+class ResponseCache:
+    """
+    LRU cache with a TTL for the data a view renders, keyed by
+    (endpoint, store_id, role scope, query args). The role scope includes the
+    user's stores when they can't see every store, e.g. a store-bound API key.
+    
+    Only plain data is cached, never rendered pages, because the pages also
+    contain per-user content like the navigation and flashed messages.
+    Entries are dropped when a transaction, item or store change for their
+    store is committed. Invalidation is per process, so other workers can
+    serve an entry for up to the TTL after a change.
+    """
+    
+    def __init__(self, app=None):
+        self.enabled = False
+        self.ttl = 30
+        self.max_entries = 1024
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read the cache settings from the app config."""
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', not app.testing)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', 30)
+        self.max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 1024)
+        app.extensions['response_cache'] = self
+    
+    def make_key(self, store_id, exclude_args=()):
+        """Build the cache key for the current request."""
+        role_scope = current_user.role.value if current_user.is_authenticated and current_user.role else None
+        access = get_access()
+        if role_scope is not None and not access.can(Permission.VIEW_ALL_STORES):
+            role_scope = (role_scope, tuple(sorted(access.store_ids)))
+        args = tuple(sorted(item for item in request.args.items(multi=True) if item[0] not in exclude_args))
+        return (request.endpoint, store_id, role_scope, args)
+    
+    def get_or_compute(self, store_id, compute, exclude_args=()):
+        """
+        Return the cached value for the current request, or compute and cache it.
+        
+        Args:
+            store_id (int): Store the data belongs to, or None for data spanning all stores
+            compute (callable): Builds the value; must return plain data, not ORM objects
+            exclude_args (tuple): Query arguments that don't affect the value, like page cursors
+        """
+        if not self.enabled:
+            return compute()
+        
+        key = self.make_key(store_id, exclude_args)
+        now = time.monotonic()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return entry[1]
+            self._counters['misses'] += 1
+            generation = self._generation
+        
+        value = compute()
+        
+        with self._lock:
+            # Don't store a value computed from data that was invalidated in the meantime
+            if generation != self._generation:
+                return value
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+        
+        return value
+    
+    def invalidate(self, store_ids=None):
+        """
+        Drop cached entries for the given stores, plus entries spanning all stores.
+        Drops everything if store_ids is None.
+        """
+        with self._lock:
+            self._generation += 1
+            if store_ids is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[1] is None or k[1] in store_ids]:
+                    del self._entries[key]
+            self._counters['invalidations'] += 1
+    
+    def stats(self):
+        """Return the hit/miss counters and the current size."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        return stats
+
+response_cache = ResponseCache()
+
+# Sentinel for "invalidate every store", e.g. when a store is renamed
+ALL_STORES = 'all'
+
+def invalidate_on_commit(store_id):
+    """
+    Invalidate the cached data for a store once the current transaction commits.
+    Deferring to the commit keeps a concurrent request from caching the old data again.
+    """
+    db.session.info.setdefault('invalidate_store_ids', set()).add(store_id)
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _collect_invalidations(session, flush_context):
+    """Queue invalidations for items and stores added, edited or deleted through the ORM."""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Inventory):
+            store_ids = session.info.setdefault('invalidate_store_ids', set())
+            store_ids.add(obj.store_id)
+            # An item moved between stores changes both of them
+            history = sa.inspect(obj).attrs.store_id.history
+            store_ids.update(history.deleted)
+        elif isinstance(obj, Store):
+            session.info.setdefault('invalidate_store_ids', set()).add(ALL_STORES)
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    store_ids = session.info.pop('invalidate_store_ids', None)
+    if store_ids:
+        response_cache.invalidate(None if ALL_STORES in store_ids else store_ids)
+
+@sa.event.listens_for(db.session, 'after_soft_rollback')
+def _discard_invalidations(session, previous_transaction):
+    # A rolled back savepoint doesn't undo the changes made outside it
+    if not previous_transaction.nested:
+        session.info.pop('invalidate_store_ids', None)
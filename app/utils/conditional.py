@@ -0,0 +1,84 @@
+"""
+Conditional GET support (ETag / Last-Modified) for polled endpoints.
+"""
+import hashlib
+import time
+from datetime import timezone
+from flask import request, make_response, current_app, session
+from flask_login import current_user
+from sqlalchemy import func
+from app.models.db import db
+from app.models.inventory import Inventory
+from app.models.transaction import Transaction
+
+def store_validator(store_id):
+    """
+    Return cheap validator parts for everything a store's inventory views show:
+    the newest item change, the item count (to catch deletions) and the newest transaction.
+    """
+    last_item_change, item_count = db.session.query(
+        func.max(Inventory.updated_at), func.count(Inventory.id)
+    ).filter(Inventory.store_id == store_id).one()
+    last_transaction_id, last_transaction_time = db.session.query(
+        func.max(Transaction.id), func.max(Transaction.timestamp)
+    ).filter(Transaction.store_id == store_id).one()
+    return (store_id, last_item_change, item_count, last_transaction_id), _latest(last_item_change, last_transaction_time)
+
+def item_validator(item):
+    """Return cheap validator parts for an item page: the item's version and its newest transaction."""
+    last_transaction_id, last_transaction_time = db.session.query(
+        func.max(Transaction.id), func.max(Transaction.timestamp)
+    ).filter(Transaction.item_id == item.id).one()
+    return (item.version, item.updated_at, last_transaction_id), _latest(item.updated_at, last_transaction_time)
+
+def _latest(*timestamps):
+    present = [t for t in timestamps if t is not None]
+    return max(present) if present else None
+
+def conditional_response(validator, last_modified, build, per_user=False):
+    """
+    Answer 304 Not Modified if the client's copy is current, otherwise build the response.
+    
+    Only an If-None-Match match counts: the validators include parts that aren't
+    times (the item count, rolling windows) and changes within the same second,
+    which a Last-Modified time can't show, so If-Modified-Since is ignored.
+    
+    Args:
+        validator (tuple): Values that change whenever the response body would change
+        last_modified (datetime): Naive UTC time of the newest change, or None; sent for information
+        build (callable): Builds the full response; only called when the client's copy is stale
+        per_user (bool): Set for rendered pages, which contain per-user navigation, CSRF tokens
+            and flashed messages; they are only answered 304 with no flashes pending
+    
+    Returns:
+        Response: The 304 or full response, with ETag and Last-Modified set
+    """
+    parts = [request.endpoint, request.view_args, current_user.role.value if current_user.role else None]
+    parts.extend(validator)
+    if per_user:
+        # Rendered CSRF tokens expire, so let cached pages go stale within half their lifetime
+        csrf_lifetime = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 3600
+        parts.extend([current_user.id, int(time.time() // max(csrf_lifetime // 2, 1))])
+    etag = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    
+    if last_modified is not None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+    
+    not_modified = request.if_none_match.contains(etag)
+    
+    # A page with pending flashed messages must be rendered, or the client shows its
+    # cached copy (with whatever was flashed back then) and the new messages stay queued
+    if per_user and session.get('_flashes'):
+        not_modified = False
+    
+    if not_modified:
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Clients may keep the response but must revalidate it on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,145 @@
+"""
+In-process publish/subscribe for live store updates (used by the SSE stream).
+"""
+import threading
+from collections import deque
+import sqlalchemy as sa
+from app.models.db import db
+
+# Returned by Subscription.get when events were dropped and the client should reload its data
+RESYNC = object()
+
+class Subscription:
+    """
+    Bounded buffer of events for one connected client.
+    
+    When the client falls behind and the buffer fills, the oldest events are
+    dropped and the next get() returns RESYNC instead, so a slow client costs
+    a fixed amount of memory and never blocks the publisher.
+    """
+    
+    def __init__(self, store_id, buffer_size, item_type=None):
+        self.store_id = store_id
+        self.item_type = item_type
+        self._events = deque()
+        self._buffer_size = buffer_size
+        self._overflowed = False
+        self._closed = False
+        self._condition = threading.Condition()
+    
+    def push(self, event):
+        """Add an event, dropping the oldest one if the buffer is full."""
+        # Users restricted to one item type only get events for that type
+        if self.item_type is not None and event.get('item_type') != self.item_type:
+            return
+        with self._condition:
+            if len(self._events) >= self._buffer_size:
+                self._events.popleft()
+                self._overflowed = True
+            self._events.append(event)
+            self._condition.notify()
+    
+    def get(self, timeout=None):
+        """
+        Wait for the next event.
+        
+        Returns:
+            The event dict, RESYNC if events were dropped, or None on timeout or close
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._events or self._closed, timeout)
+            if self._overflowed:
+                self._overflowed = False
+                self._events.clear()
+                return RESYNC
+            if self._events:
+                return self._events.popleft()
+            return None
+    
+    def close(self):
+        """Wake up a waiting get() so the stream can end."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+    
+    @property
+    def closed(self):
+        return self._closed
+
+class StoreEventBroker:
+    """
+    Fan out store events to the subscriptions for that store.
+    
+    Events only reach subscribers in the same process, so with several worker
+    processes each client sees the changes committed by the worker it is
+    connected to, plus a resync on reconnect.
+    """
+    
+    def __init__(self, app=None):
+        self.buffer_size = 100
+        self.heartbeat_interval = 15
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._counters = {'published': 0, 'delivered': 0}
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read the stream settings from the app config."""
+        self.buffer_size = app.config.get('EVENT_STREAM_BUFFER_SIZE', 100)
+        self.heartbeat_interval = app.config.get('EVENT_STREAM_HEARTBEAT', 15)
+        app.extensions['store_events'] = self
+    
+    def subscribe(self, store_id, item_type=None):
+        """Register a new subscription for a store's events."""
+        subscription = Subscription(store_id, self.buffer_size, item_type)
+        with self._lock:
+            self._subscribers.setdefault(store_id, set()).add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        """Remove a subscription and wake up its reader."""
+        subscription.close()
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.store_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.store_id]
+    
+    def publish(self, store_id, event):
+        """Deliver an event to every subscriber of a store."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(store_id, ()))
+            self._counters['published'] += 1
+            self._counters['delivered'] += len(subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+    
+    def stats(self):
+        """Return the publish counters and the number of open subscriptions."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['subscribers'] = sum(len(s) for s in self._subscribers.values())
+            stats['stores'] = len(self._subscribers)
+        return stats
+
+store_events = StoreEventBroker()
+
+def publish_on_commit(store_id, event):
+    """
+    Publish an event for a store once the current transaction commits,
+    so clients never see changes that are later rolled back.
+    """
+    db.session.info.setdefault('pending_store_events', []).append((store_id, event))
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _publish_after_commit(session):
+    for store_id, event in session.info.pop('pending_store_events', ()):
+        store_events.publish(store_id, event)
+
+@sa.event.listens_for(db.session, 'after_soft_rollback')
+def _discard_events(session, previous_transaction):
+    # A rolled back savepoint doesn't undo the changes made outside it
+    if not previous_transaction.nested:
+        session.info.pop('pending_store_events', None)
@@ -0,0 +1,232 @@
+"""
+Demand forecasting and reorder points for the whole catalog.
+
+Each item's daily outgoing units (REMOVE and TRANSFER_OUT) over a trailing
+window are loaded into an items x days matrix with one grouped query. Demand is
+then forecast for every item at once, as the window's moving average or by
+exponential smoothing, and the reorder point is the demand over the supplier
+lead time plus safety stock for the day-to-day variation:
+    
+    reorder_point = ceil(demand * lead_time + service_factor * std * sqrt(lead_time))
+
+NumPy is used when it is installed, with a pure-Python fallback. The results
+are stored in item_forecasts by flask refresh-forecasts, meant to run daily.
+"""
+import math
+from datetime import datetime, time, timedelta
+import sqlalchemy as sa
+from flask import current_app
+from app.models.db import db, TransactionType
+from app.models.inventory import Inventory
+from app.models.item_forecast import ItemForecast
+from app.models.transaction import Transaction
+from app.utils.stock_summary import low_stock_threshold
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+FORECAST_METHODS = ('ema', 'sma')
+
+# Defaults for the FORECAST_* config settings
+DEFAULT_WINDOW_DAYS = 28
+DEFAULT_SMOOTHING = 0.3
+DEFAULT_LEAD_TIME_DAYS = 7
+DEFAULT_SERVICE_FACTOR = 1.65  # About a 95% chance of not running out during the lead time
+
+OUTGOING_TYPES = (TransactionType.REMOVE, TransactionType.TRANSFER_OUT)
+
+def load_daily_outgoing(window_days, until=None):
+    """
+    Load every item's daily outgoing units over the window_days full days before until.
+    
+    Args:
+        window_days (int): Number of days to load
+        until (datetime, optional): End of the window, by default the last UTC midnight
+    
+    Returns:
+        tuple: (item_ids, daily) where daily[i][d] is the units item_ids[i] sent out on
+        day d of the window, oldest first; a NumPy array when NumPy is installed
+    """
+    until = until or datetime.combine(datetime.utcnow().date(), time.min)
+    since = until - timedelta(days=window_days)
+    
+    connection = db.session.connection()
+    item_ids = connection.scalars(sa.select(Inventory.id).order_by(Inventory.id)).all()
+    index_of = {item_id: i for i, item_id in enumerate(item_ids)}
+    day_index = {
+        (since + timedelta(days=d)).date().isoformat(): d for d in range(window_days)
+    }
+    
+    day = sa.func.date(Transaction.timestamp)
+    rows = connection.execute(
+        sa.select(Transaction.item_id, day, -sa.func.sum(Transaction.quantity_change)).where(
+            Transaction.transaction_type.in_(OUTGOING_TYPES),
+            Transaction.timestamp >= since,
+            Transaction.timestamp < until
+        ).group_by(Transaction.item_id, day)
+    ).all()
+    
+    if np is not None:
+        daily = np.zeros((len(item_ids), window_days))
+        rows = [(index_of[item_id], day_index[row_day], units) for item_id, row_day, units in rows
+                if item_id in index_of and row_day in day_index]
+        if rows:
+            items, days, units = zip(*rows)
+            daily[np.array(items), np.array(days)] = np.array(units, dtype=float)
+    else:
+        daily = [[0.0] * window_days for _ in item_ids]
+        for item_id, row_day, units in rows:
+            if item_id in index_of and row_day in day_index:
+                daily[index_of[item_id]][day_index[row_day]] = float(units)
+    
+    return item_ids, daily
+
+def forecast_demand(daily, method='ema', smoothing=DEFAULT_SMOOTHING,
+                    lead_time=DEFAULT_LEAD_TIME_DAYS, service_factor=DEFAULT_SERVICE_FACTOR):
+    """
+    Forecast daily demand and reorder points from daily outgoing units.
+    
+    Args:
+        daily: items x days outgoing units, as returned by load_daily_outgoing
+        method (str): 'sma' for the window's moving average, 'ema' for exponential smoothing
+        smoothing (float): Weight of each new day for 'ema', between 0 and 1
+        lead_time (float): Days between ordering and receiving stock
+        service_factor (float): Safety stock in standard deviations of lead time demand
+    
+    Returns:
+        tuple: (demand, std, reorder_points), one value per item
+    """
+    if method not in FORECAST_METHODS:
+        raise ValueError(f'Unknown forecast method: {method}')
+    if np is not None:
+        return _forecast_numpy(np.asarray(daily, dtype=float), method, smoothing, lead_time, service_factor)
+    return _forecast_python(daily, method, smoothing, lead_time, service_factor)
+
+def _forecast_numpy(daily, method, smoothing, lead_time, service_factor):
+    if daily.size == 0:
+        empty = np.zeros(daily.shape[0])
+        return empty, empty, empty.astype(np.int64)
+    
+    mean = daily.mean(axis=1)
+    std = daily.std(axis=1)
+    if method == 'sma':
+        demand = mean
+    else:
+        # Smooth every item at once, one day at a time, starting from the window mean
+        # so items that sell rarely don't start at zero
+        demand = mean.copy()
+        for day in range(daily.shape[1]):
+            demand = smoothing * daily[:, day] + (1 - smoothing) * demand
+    
+    reorder_points = np.ceil(demand * lead_time + service_factor * std * math.sqrt(lead_time))
+    return demand, std, reorder_points.astype(np.int64)
+
+def _forecast_python(daily, method, smoothing, lead_time, service_factor):
+    """Same as _forecast_numpy, without NumPy."""
+    demand, std, reorder_points = [], [], []
+    for units in daily:
+        if not units:
+            demand.append(0.0)
+            std.append(0.0)
+            reorder_points.append(0)
+            continue
+        
+        mean = sum(units) / len(units)
+        item_std = math.sqrt(sum((value - mean) ** 2 for value in units) / len(units))
+        item_demand = mean
+        if method == 'ema':
+            for value in units:
+                item_demand = smoothing * value + (1 - smoothing) * item_demand
+        
+        demand.append(item_demand)
+        std.append(item_std)
+        reorder_points.append(math.ceil(item_demand * lead_time + service_factor * item_std * math.sqrt(lead_time)))
+    return demand, std, reorder_points
+
+def refresh_forecasts(method=None):
+    """
+    Recompute the forecast of every item and replace the item_forecasts rows.
+    Settings come from FORECAST_METHOD, FORECAST_WINDOW_DAYS, FORECAST_SMOOTHING,
+    FORECAST_LEAD_TIME_DAYS and FORECAST_SERVICE_FACTOR. The caller commits.
+    
+    Returns:
+        int: Number of items forecast
+    """
+    config = current_app.config
+    item_ids, daily = load_daily_outgoing(config.get('FORECAST_WINDOW_DAYS', DEFAULT_WINDOW_DAYS))
+    demand, std, reorder_points = forecast_demand(
+        daily,
+        method or config.get('FORECAST_METHOD', 'ema'),
+        config.get('FORECAST_SMOOTHING', DEFAULT_SMOOTHING),
+        config.get('FORECAST_LEAD_TIME_DAYS', DEFAULT_LEAD_TIME_DAYS),
+        config.get('FORECAST_SERVICE_FACTOR', DEFAULT_SERVICE_FACTOR)
+    )
+    
+    computed_at = datetime.utcnow()
+    db.session.execute(sa.delete(ItemForecast))
+    if item_ids:
+        db.session.execute(sa.insert(ItemForecast), [
+            {
+                'item_id': item_id,
+                'daily_demand': float(item_demand),
+                'demand_std': float(item_std),
+                'reorder_point': int(reorder_point),
+                'computed_at': computed_at
+            }
+            for item_id, item_demand, item_std, reorder_point in zip(item_ids, demand, std, reorder_points)
+        ])
+    return len(item_ids)
+
+def needs_reorder(item):
+    """
+    Return True if an item is at or below its reorder point. A reorder point of
+    zero means no forecast demand, so nothing to reorder; get_reorder_items
+    applies the same rule. Items without a forecast yet fall back to their low
+    stock threshold.
+    """
+    quantity = item.quantity or 0
+    if item.forecast is None:
+        return quantity <= low_stock_threshold(item)
+    return item.forecast.reorder_point > 0 and quantity <= item.forecast.reorder_point
+
+def get_reorder_items(store_id, item_type=None, limit=10):
+    """
+    List a store's items that are at or below their reorder point, fewest days of cover first.
+    Items with a reorder point of zero have no forecast demand and are left out, as in needs_reorder.
+    
+    Returns:
+        tuple: (count, items) where items are plain dicts with part_number, name,
+        quantity, reorder_point, daily_demand and days_of_cover
+    """
+    quantity = sa.func.coalesce(Inventory.quantity, 0)
+    criteria = [
+        Inventory.store_id == store_id,
+        ItemForecast.reorder_point > 0,
+        quantity <= ItemForecast.reorder_point
+    ]
+    if item_type is not None:
+        criteria.append(Inventory.item_type == item_type)
+    
+    count = db.session.scalar(
+        sa.select(sa.func.count()).select_from(Inventory).join(ItemForecast).where(*criteria)
+    )
+    rows = db.session.execute(
+        sa.select(
+            Inventory.id, Inventory.part_number, Inventory.name, quantity.label('quantity'),
+            ItemForecast.reorder_point, ItemForecast.daily_demand
+        ).join(ItemForecast).where(*criteria).order_by(
+            quantity / ItemForecast.daily_demand, Inventory.part_number
+        ).limit(limit)
+    ).all()
+    
+    return count, [{
+        'id': row.id,
+        'part_number': row.part_number,
+        'name': row.name,
+        'quantity': row.quantity,
+        'reorder_point': row.reorder_point,
+        'daily_demand': row.daily_demand,
+        'days_of_cover': max(row.quantity, 0) / row.daily_demand if row.daily_demand > 0 else None
+    } for row in rows]
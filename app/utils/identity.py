@@ -0,0 +1,125 @@
+"""
+Per-process cache of the signed-in user's identity, used by the Flask-Login user_loader.
+"""
+import threading
+import time
+import sqlalchemy as sa
+from flask import g
+from flask_login import UserMixin
+from app.models.db import db
+from app.models.user import User, user_stores, ROLES_BY_VALUE
+
+class UserIdentity(UserMixin):
+    """
+    Compact, immutable stand-in for the signed-in User: its id, username, role
+    and the ids of its assigned stores, which is all most requests need.
+    
+    Any other User attribute (stores, check_password, ...) loads the full User
+    row on first use in the request and reads it from there.
+    """
+    is_api_key = False
+    
+    def __init__(self, id, username, role, store_ids):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.store_ids = store_ids
+    
+    def _load_user(self):
+        # Loaded per request: the identity itself is shared between requests and threads
+        users = g.setdefault('loaded_users', {})
+        if self.id not in users:
+            users[self.id] = db.session.get(User, self.id)
+        return users[self.id]
+    
+    def __getattr__(self, name):
+        # Only reached for attributes the identity doesn't hold itself
+        if name.startswith('_') or not hasattr(User, name):
+            raise AttributeError(name)
+        return getattr(self._load_user(), name)
+    
+    def __repr__(self):
+        return f'<UserIdentity {self.username}>'
+
+class IdentityCache:
+    """
+    TTL cache of UserIdentity records by user id.
+    
+    Entries are dropped when a user's role, lock or store assignments change
+    (see invalidate_identity_on_commit). Invalidation is per process, so other
+    workers can serve an identity for up to the TTL after a change.
+    """
+    
+    def __init__(self, app=None):
+        self.enabled = True
+        self.ttl = 60
+        self._entries = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read the cache settings from the app config."""
+        self.enabled = app.config.get('USER_IDENTITY_CACHE_ENABLED', True)
+        self.ttl = app.config.get('USER_IDENTITY_CACHE_TTL', 60)
+        app.extensions['identity_cache'] = self
+    
+    def load(self, user_id):
+        """Return the identity for a user id, or None if the user doesn't exist."""
+        now = time.monotonic()
+        if self.enabled:
+            with self._lock:
+                entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        
+        identity = _load_identity(user_id)
+        if self.enabled and identity is not None:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, identity)
+        return identity
+    
+    def invalidate(self, user_ids=None):
+        """Drop the given users' identities, or all of them if user_ids is None."""
+        with self._lock:
+            if user_ids is None:
+                self._entries.clear()
+            else:
+                for user_id in user_ids:
+                    self._entries.pop(user_id, None)
+
+def _load_identity(user_id):
+    row = db.session.execute(
+        sa.select(User.id, User.username, User._role).where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    
+    store_ids = frozenset(db.session.scalars(
+        sa.select(user_stores.c.store_id).where(user_stores.c.user_id == user_id)
+    ))
+    return UserIdentity(row.id, row.username, ROLES_BY_VALUE.get(row._role), store_ids)
+
+identity_cache = IdentityCache()
+
+# Sentinel for "invalidate every user", e.g. when a store is deleted
+ALL_USERS = 'all'
+
+def invalidate_identity_on_commit(user_id):
+    """
+    Drop a user's cached identity once the current transaction commits.
+    Deferring to the commit keeps a concurrent request from caching the old identity again.
+    """
+    db.session.info.setdefault('invalidate_user_ids', set()).add(user_id)
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    user_ids = session.info.pop('invalidate_user_ids', None)
+    if user_ids:
+        identity_cache.invalidate(None if ALL_USERS in user_ids else user_ids)
+
+@sa.event.listens_for(db.session, 'after_soft_rollback')
+def _discard_invalidations(session, previous_transaction):
+    # A rolled back savepoint doesn't undo the changes made outside it
+    if not previous_transaction.nested:
+        session.info.pop('invalidate_user_ids', None)
@@ -0,0 +1,145 @@
+"""
+Rate limit counters in a SQLite database in WAL mode, shared by every worker process.
+
+Importing this module registers the sqlite:// scheme with the limits package,
+so RATELIMIT_STORAGE_URI = 'sqlite:///path/to/ratelimit.db' selects it. Paths
+follow SQLAlchemy's convention: three slashes for a relative path, four for an
+absolute one.
+"""
+import os
+import sqlite3
+import threading
+import time
+from limits import parse_many
+from limits.storage import Storage, storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+class SQLiteStorage(Storage):
+    """
+    Fixed window rate limit counters in a SQLite table.
+    
+    Each hit is a single upsert that either starts a new window or adds to the
+    current one and returns the new count, so concurrent increments from
+    different processes can't lose updates. WAL mode lets readers and the
+    writer work at the same time, and synchronous=NORMAL skips the fsync on
+    every commit: a power loss can lose the last few hits, which is acceptable
+    for rate limits. Each thread keeps its own connection, reopened in forked
+    worker processes. Expired windows are deleted every purge_interval seconds.
+    
+    Only the fixed-window strategy (Flask-Limiter's default) is supported.
+    """
+    
+    STORAGE_SCHEME = ['sqlite']
+    
+    def __init__(self, uri, wrap_exceptions=False, busy_timeout=5.0, purge_interval=60, **options):
+        self.path = uri.split('://', 1)[1][1:] or ':memory:'
+        self.busy_timeout = float(busy_timeout)
+        self.purge_interval = float(purge_interval)
+        self._local = threading.local()
+        self._next_purge = 0.0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+    
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+    
+    def incr(self, key, expiry, amount=1):
+        """Add amount to the key's count, starting a window of expiry seconds if none is open."""
+        now = time.time()
+        connection = self._connection()
+        if now >= self._next_purge:
+            self._next_purge = now + self.purge_interval
+            connection.execute('DELETE FROM rate_limits WHERE expires_at <= ?', (now,))
+        
+        # Both CASEs read the row's old values, so an expired window restarts atomically
+        return connection.execute(
+            'INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            'count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END, '
+            'expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END '
+            'RETURNING count',
+            (key, amount, now + expiry, now, now)
+        ).fetchone()[0]
+    
+    def get(self, key):
+        """Return the key's count in its current window."""
+        row = self._connection().execute(
+            'SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+    
+    def get_expiry(self, key):
+        """Return when the key's current window ends, as a timestamp."""
+        now = time.time()
+        row = self._connection().execute(
+            'SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        return row[0] if row else now
+    
+    def check(self):
+        """Return True if the database can be read."""
+        try:
+            self._connection().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def reset(self):
+        """Delete every counter and return how many there were."""
+        return self._connection().execute('DELETE FROM rate_limits').rowcount
+    
+    def clear(self, key):
+        """Delete the key's counter."""
+        self._connection().execute('DELETE FROM rate_limits WHERE key = ?', (key,))
+    
+    def _connection(self):
+        """Return this thread's connection, opening it on first use in the process."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # Autocommit: every statement is its own transaction
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                         isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limits ('
+                'key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL'
+                ') WITHOUT ROWID'
+            )
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+def benchmark(storage_uri, limits, checks=10000, clients=100):
+    """
+    Time the rate limit check Flask-Limiter makes on each request: one hit per
+    limit, spread over the given number of client addresses. The counters it
+    creates are cleared afterwards and other keys are untouched, so it can run
+    against the production storage.
+    
+    Args:
+        storage_uri (str): Storage to benchmark, e.g. 'memory://'
+        limits (str): Limits to hit, e.g. '200 per day; 50 per hour'
+        checks (int): Number of checks to time
+        clients (int): Number of distinct client keys
+    
+    Returns:
+        float: Average seconds per check
+    """
+    storage = storage_from_string(storage_uri)
+    limiter = FixedWindowRateLimiter(storage)
+    items = parse_many(limits)
+    keys = [f'10.0.{client // 256}.{client % 256}' for client in range(clients)]
+    try:
+        # Warm up, so connection setup isn't timed
+        limiter.hit(items[0], 'benchmark', 'warmup')
+        start = time.perf_counter()
+        for check in range(checks):
+            key = keys[check % clients]
+            for item in items:
+                limiter.hit(item, 'benchmark', key)
+        return (time.perf_counter() - start) / checks
+    finally:
+        for item in items:
+            for key in keys + ['warmup']:
+                limiter.clear(item, 'benchmark', key)
@@ -0,0 +1,123 @@
+"""
+Failed login counts by user and by IP address, shared by every worker process.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+class LoginFailureTracker:
+    """
+    Count failed logins per user and per IP address in a SQLite database in WAL mode.
+    
+    The counts live outside the users table so a burst of bad passwords doesn't
+    write to it; auth.login only persists the transitions, locking the account
+    when a user's count reaches MAX_LOGIN_ATTEMPTS. As before, a user's failures
+    add up until a successful login (or the lock, or an unlock) resets them.
+    An address that reaches max_per_ip failures within window seconds of its
+    first one is refused before its password is even checked, until that
+    window ends.
+    
+    Each failure is a single upsert returning the new count, so workers counting
+    the same user or address at once can't lose updates, and the counts survive
+    restarts. Each thread keeps its own connection, reopened in forked worker
+    processes. Expired address windows are deleted every purge_interval seconds.
+    """
+    
+    def __init__(self, app=None):
+        self.path = None
+        self.window = 15 * 60
+        self.max_per_ip = 20
+        self.busy_timeout = 5.0
+        self.purge_interval = 60
+        self._local = threading.local()
+        self._next_purge = 0.0
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read the tracker settings from the app config."""
+        # Testing gets a private in-memory database per app, shared by its threads
+        default_path = (
+            f'file:login-failures-{uuid.uuid4().hex}?mode=memory&cache=shared' if app.testing
+            else os.path.join(app.instance_path, 'login_failures.db')
+        )
+        self.path = app.config.get('LOGIN_FAILURE_DATABASE', default_path)
+        window_minutes = app.config.get('LOGIN_FAILURE_WINDOW_MINUTES', app.config.get('ACCOUNT_LOCKOUT_MINUTES', 15))
+        self.window = window_minutes * 60
+        self.max_per_ip = app.config.get('MAX_LOGIN_FAILURES_PER_IP', 20)
+        self.busy_timeout = app.config.get('LOGIN_FAILURE_BUSY_TIMEOUT', 5.0)
+        self._local = threading.local()
+        app.extensions['login_failures'] = self
+    
+    def record_failure(self, user_id, ip_address):
+        """
+        Count a failed login for the user (None for an unknown username) and the address.
+        
+        Returns:
+            tuple: (user_failures, ip_failures), including this one
+        """
+        now = time.time()
+        connection = self._connection()
+        if now >= self._next_purge:
+            self._next_purge = now + self.purge_interval
+            connection.execute('DELETE FROM login_failures WHERE expires_at <= ?', (now,))
+        
+        user_failures = self._add(connection, f'user:{user_id}', None, now) if user_id is not None else 0
+        ip_failures = self._add(connection, f'ip:{ip_address}', now + self.window, now)
+        return user_failures, ip_failures
+    
+    def user_failures(self, user_id):
+        """Return the user's failed logins since the last reset."""
+        return self._count(f'user:{user_id}')
+    
+    def ip_blocked(self, ip_address):
+        """Return True if the address has max_per_ip failed logins in its current window."""
+        return self._count(f'ip:{ip_address}') >= self.max_per_ip
+    
+    def reset_user(self, user_id):
+        """Forget the user's failures, e.g. after a successful login or an unlock."""
+        self._connection().execute('DELETE FROM login_failures WHERE key = ?', (f'user:{user_id}',))
+    
+    def clear(self):
+        """Forget every failure."""
+        self._connection().execute('DELETE FROM login_failures')
+    
+    def _add(self, connection, key, expires_at, now):
+        # A NULL expires_at never expires; an expired window restarts at one
+        return connection.execute(
+            'INSERT INTO login_failures (key, count, expires_at) VALUES (?, 1, ?) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            'count = CASE WHEN expires_at <= ? THEN 1 ELSE count + 1 END, '
+            'expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END '
+            'RETURNING count',
+            (key, expires_at, now, now)
+        ).fetchone()[0]
+    
+    def _count(self, key):
+        row = self._connection().execute(
+            'SELECT count FROM login_failures WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+    
+    def _connection(self):
+        """Return this thread's connection, opening it on first use in the process."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # Autocommit: every statement is its own transaction
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                         check_same_thread=False, uri=self.path.startswith('file:'))
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS login_failures ('
+                'key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL'
+                ') WITHOUT ROWID'
+            )
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+login_failures = LoginFailureTracker()
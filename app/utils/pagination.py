@@ -0,0 +1,106 @@
+"""
+Keyset (cursor) pagination helpers for long lists.
+"""
+from datetime import datetime
+import sqlalchemy as sa
+from flask import request
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def get_page_size(default=DEFAULT_PAGE_SIZE):
+    """Read the per_page query argument, clamped to 1..MAX_PAGE_SIZE."""
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, MAX_PAGE_SIZE))
+
+def keyset_page(query, key_column, after=None, per_page=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of a query ordered by a unique column, starting after a cursor.
+    
+    Unlike OFFSET paging this reads only the rows it returns, so later pages
+    are as cheap as the first one as long as key_column is indexed.
+    
+    Args:
+        query: Query to page through; must not be ordered yet
+        key_column: Unique column to order and page by
+        after: Key of the last row on the previous page, or None for the first page
+        per_page (int): Maximum number of rows to return
+    
+    Returns:
+        tuple: (rows, next_cursor) where next_cursor is None on the last page
+    """
+    if after is not None:
+        query = query.filter(key_column > after)
+    
+    # Fetch one extra row to find out whether there is a next page
+    rows = query.order_by(key_column).limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        return rows, None
+    
+    rows = rows[:per_page]
+    return rows, getattr(rows[-1], key_column.key)
+
+def seek_page(query, key_columns, after=None, before=None, per_page=DEFAULT_PAGE_SIZE, descending=True):
+    """
+    Fetch one page of a query ordered by a composite key, in either direction.
+    
+    The key must be unique across rows, e.g. (timestamp, id). Pages are found
+    with a row-value comparison on the key, so with an index on the key columns
+    every page costs the same however deep it is.
+    
+    Args:
+        query: Query to page through; must not be ordered yet
+        key_columns (list): Columns of the key, most significant first
+        after (tuple, optional): Key of the last row on the previous page, to fetch the next page
+        before (tuple, optional): Key of the first row on the next page, to fetch the previous page
+        per_page (int): Maximum number of rows to return
+        descending (bool): Order newest (largest key) first
+    
+    Returns:
+        tuple: (rows, prev_key, next_key); the keys are None at either end of the list
+    """
+    key = sa.tuple_(*key_columns)
+    backwards = before is not None
+    
+    if backwards:
+        query = query.filter(key > sa.tuple_(*before) if descending else key < sa.tuple_(*before))
+    elif after is not None:
+        query = query.filter(key < sa.tuple_(*after) if descending else key > sa.tuple_(*after))
+    
+    # Walk away from the cursor, reversing the order when paging backwards
+    walk_descending = descending != backwards
+    order = [column.desc() if walk_descending else column.asc() for column in key_columns]
+    
+    # Fetch one extra row to find out whether there are more rows past this page
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    
+    if backwards:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+    
+    if not rows:
+        return rows, None, None
+    
+    def row_key(row):
+        return tuple(getattr(row, column.key) for column in key_columns)
+    
+    return rows, row_key(rows[0]) if has_prev else None, row_key(rows[-1]) if has_next else None
+
+def encode_time_cursor(key):
+    """Encode a (timestamp, id) key as a URL-safe cursor string."""
+    timestamp, row_id = key
+    return f'{timestamp.isoformat()}_{row_id}'
+
+def decode_time_cursor(cursor):
+    """Decode a cursor from encode_time_cursor, returning None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        timestamp, row_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError:
+        return None
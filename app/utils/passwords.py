@@ -0,0 +1,244 @@
+"""
+Password hashing and verification on a bounded pool of worker processes.
+
+Hashes are argon2id with the ARGON2_* parameters; flask calibrate-password-hash
+suggests parameters for a target time on the current machine. Hashes in
+werkzeug's older format still verify and are upgraded on the next login.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from argon2 import PasswordHasher as Argon2Hasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from werkzeug.security import check_password_hash
+
+# RFC 9106's low memory profile, argon2-cffi's defaults
+DEFAULT_TIME_COST = 3
+DEFAULT_MEMORY_COST = 65536  # KiB
+DEFAULT_PARALLELISM = 4
+
+class PasswordHasherBusy(Exception):
+    """Raised when the pool has no free slot within the queue timeout."""
+
+# Hashers by (time_cost, memory_cost, parallelism), per process
+_argon2_hashers = {}
+
+def _argon2(params):
+    if params not in _argon2_hashers:
+        time_cost, memory_cost, parallelism = params
+        _argon2_hashers[params] = Argon2Hasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    return _argon2_hashers[params]
+
+def _hash_password(password, params):
+    return _argon2(params).hash(password)
+
+def _verify_password(password_hash, password, params):
+    if not password_hash.startswith('$argon2'):
+        return check_password_hash(password_hash, password)
+    try:
+        return _argon2(params).verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def _timed(function, *args):
+    # Runs in the worker, so the caller can tell time spent waiting from time spent hashing
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+class PasswordHasher:
+    """
+    Hash and verify passwords in a pool of worker processes.
+    
+    At most max_pending jobs are queued or running at once. Callers wait up to
+    queue_timeout seconds for a slot, then get PasswordHasherBusy, so a burst of
+    logins queues for the pool's CPUs instead of every request thread hashing
+    at the same time. With workers set to 0 the work runs on the calling thread;
+    the counters are kept either way, so the two can be compared.
+    """
+    
+    def __init__(self, app=None):
+        self.workers = 0
+        self.params = (DEFAULT_TIME_COST, DEFAULT_MEMORY_COST, DEFAULT_PARALLELISM)
+        self.max_pending = 1
+        self.queue_timeout = 5.0
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {'jobs': 0, 'rejected': 0, 'failed': 0, 'cancelled': 0, 'in_flight': 0, 'max_in_flight': 0,
+                          'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'run_seconds': 0.0}
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read the hashing settings from the app config and register the pool shutdown."""
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 0 if app.testing else (os.cpu_count() or 1))
+        self.params = (
+            app.config.get('ARGON2_TIME_COST', DEFAULT_TIME_COST),
+            app.config.get('ARGON2_MEMORY_COST', DEFAULT_MEMORY_COST),
+            app.config.get('ARGON2_PARALLELISM', DEFAULT_PARALLELISM)
+        )
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', max(self.workers, 1) * 4)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5.0)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        app.extensions['password_hasher'] = self
+        atexit.register(self.stop)
+    
+    def hash(self, password):
+        """Return an argon2 hash of the password."""
+        return self._run(_hash_password, password, self.params)
+    
+    def verify(self, password_hash, password):
+        """Return True if the password matches the hash."""
+        return self._run(_verify_password, password_hash, password, self.params)
+    
+    def verify_any(self, password, password_hashes):
+        """Return True if the password matches any of the hashes, checking them in parallel."""
+        password_hashes = list(password_hashes)
+        if not self.workers:
+            return any(self.verify(password_hash, password) for password_hash in password_hashes)
+        
+        futures = []
+        try:
+            for password_hash in password_hashes:
+                futures.append(self._submit(_verify_password, password_hash, password, self.params))
+            return any(future.result()[0] for future in as_completed(futures))
+        finally:
+            # Don't hash the rest once one matched
+            for future in futures:
+                future.cancel()
+    
+    def needs_rehash(self, password_hash):
+        """Return True if the hash isn't argon2 or was made with other parameters."""
+        if not password_hash.startswith('$argon2'):
+            return True
+        try:
+            return _argon2(self.params).check_needs_rehash(password_hash)
+        except InvalidHashError:
+            return True
+    
+    def stats(self):
+        """Return the pool settings and the job counters, with average wait and run times."""
+        with self._stats_lock:
+            stats = dict(self._counters)
+        finished = stats['jobs'] - stats['in_flight'] - stats['failed'] - stats['cancelled']
+        stats.update({
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'avg_wait_ms': round(stats['wait_seconds'] / finished * 1000, 2) if finished else None,
+            'avg_run_ms': round(stats['run_seconds'] / finished * 1000, 2) if finished else None,
+            'max_wait_ms': round(stats.pop('max_wait_seconds') * 1000, 2)
+        })
+        return stats
+    
+    def stop(self):
+        """Shut the pool down, dropping queued jobs."""
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+    
+    def _run(self, function, *args):
+        """Run one job and return its result."""
+        if not self.workers:
+            submitted = time.perf_counter()
+            self._acquire()
+            try:
+                result, run_seconds = _timed(function, *args)
+            except Exception:
+                self._finish(submitted, None)
+                raise
+            self._finish(submitted, run_seconds)
+            return result
+        return self._submit(function, *args).result()[0]
+    
+    def _submit(self, function, *args):
+        """Queue a job on the pool; the future's result is (result, run_seconds)."""
+        submitted = time.perf_counter()
+        self._acquire()
+        try:
+            future = self._ensure_pool().submit(_timed, function, *args)
+        except Exception:
+            self._finish(submitted, None)
+            raise
+        
+        def done(future):
+            if future.cancelled():
+                self._finish(submitted, None, 'cancelled')
+            elif future.exception() is not None:
+                self._finish(submitted, None)
+            else:
+                self._finish(submitted, future.result()[1])
+        future.add_done_callback(done)
+        return future
+    
+    def _acquire(self):
+        """Take a pending slot, waiting up to queue_timeout."""
+        if self._slots is None:
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count('rejected')
+            raise PasswordHasherBusy(f'No password hashing slot free within {self.queue_timeout}s')
+        with self._stats_lock:
+            self._counters['jobs'] += 1
+            self._counters['in_flight'] += 1
+            self._counters['max_in_flight'] = max(self._counters['max_in_flight'], self._counters['in_flight'])
+    
+    def _finish(self, submitted, run_seconds, outcome='failed'):
+        """Release a job's slot and record its timings, or count it under outcome if it didn't run."""
+        elapsed = time.perf_counter() - submitted
+        with self._stats_lock:
+            self._counters['in_flight'] -= 1
+            if run_seconds is None:
+                self._counters[outcome] += 1
+            else:
+                wait_seconds = max(elapsed - run_seconds, 0.0)
+                self._counters['run_seconds'] += run_seconds
+                self._counters['wait_seconds'] += wait_seconds
+                self._counters['max_wait_seconds'] = max(self._counters['max_wait_seconds'], wait_seconds)
+        self._slots.release()
+    
+    def _ensure_pool(self):
+        """Start the pool in this process if it isn't running yet."""
+        # The pid check starts a new pool in processes forked after it was started
+        if self._pool is not None and self._pid == os.getpid():
+            return self._pool
+        with self._start_lock:
+            if self._pool is None or self._pid != os.getpid():
+                # Spawn rather than fork, so workers don't inherit the app's open connections and threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pid = os.getpid()
+        return self._pool
+    
+    def _count(self, counter, amount=1):
+        with self._stats_lock:
+            self._counters[counter] += amount
+
+password_hasher = PasswordHasher()
+
+def calibrate(target_seconds, memory_cost=DEFAULT_MEMORY_COST, parallelism=DEFAULT_PARALLELISM, max_time_cost=20):
+    """
+    Find the smallest argon2 time cost whose hashes take at least target_seconds
+    on this machine, for the given memory cost (KiB) and parallelism.
+    
+    Returns:
+        tuple: ((time_cost, memory_cost, parallelism), seconds per hash)
+    """
+    for time_cost in range(1, max_time_cost + 1):
+        hasher = Argon2Hasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            hasher.hash('calibration password')
+            timings.append(time.perf_counter() - start)
+        seconds = sorted(timings)[1]
+        if seconds >= target_seconds:
+            break
+    return (time_cost, memory_cost, parallelism), seconds
@@ -0,0 +1,156 @@
+"""
+Role permissions, resolved once per request.
+
+Each role maps to a Permission bitmask and an item type scope (the one item
+type its users may see, or None for all). get_access() resolves the signed-in
+user's role and store assignments into an Access once per request, so the
+checks in views and decorators are bit tests and set lookups instead of
+repeated role comparisons. scope_query() applies the store and item type
+scope to Inventory and Transaction queries; users who can't see every store
+(regular users and store-bound API keys) are kept to their own stores.
+"""
+import enum
+from collections import namedtuple
+import sqlalchemy as sa
+from flask import g, abort
+from flask_login import current_user
+from app.models.db import UserRole, ItemType
+from app.models.inventory import Inventory
+from app.models.transaction import Transaction
+
+class Permission(enum.IntFlag):
+    MANAGE_ITEMS = 1        # Add, edit, adjust and transfer items; admin dashboard and reports
+    VIEW_ALL_STORES = 2     # Look up items of stores the user isn't assigned to
+    SELECT_ALL_STORES = 4   # Work in any store: select it, search it, follow its dashboard
+    NEGATIVE_STOCK = 8      # Adjust stock below zero
+    ADMINISTER = 16         # Manage stores and users, read the security logs
+
+NO_PERMISSIONS = Permission(0)
+
+ROLE_PERMISSIONS = {
+    UserRole.USER: NO_PERMISSIONS,
+    UserRole.PARTNER_ADMIN: Permission.MANAGE_ITEMS | Permission.VIEW_ALL_STORES,
+    UserRole.ADMIN_GLOBAL: (Permission.MANAGE_ITEMS | Permission.VIEW_ALL_STORES |
+                            Permission.SELECT_ALL_STORES | Permission.NEGATIVE_STOCK |
+                            Permission.ADMINISTER)
+}
+
+# The item type each role is limited to; None sees every type
+ROLE_ITEM_TYPES = {
+    UserRole.USER: ItemType.ACCESSORIES,
+    UserRole.PARTNER_ADMIN: ItemType.ACCESSORIES,
+    UserRole.ADMIN_GLOBAL: None
+}
+
+class Access(namedtuple('Access', 'permissions item_type store_ids')):
+    """What a user may do: a Permission bitmask, an item type scope and the assigned store ids."""
+    __slots__ = ()
+    
+    def can(self, permission):
+        """Return True if the user has the permission."""
+        return bool(self.permissions & permission)
+    
+    def has_store(self, store_id, permission=Permission.SELECT_ALL_STORES):
+        """Return True if the user is assigned to the store or the permission covers every store."""
+        return store_id in self.store_ids or self.can(permission)
+    
+    def can_see_type(self, item_type):
+        """Return True if items of this type are within the user's scope."""
+        return self.item_type is None or item_type == self.item_type
+    
+    def effective_item_type(self, requested=None):
+        """Return the item type to filter on: the user's scope, else the requested type."""
+        return self.item_type if self.item_type is not None else requested
+    
+    def for_api_key(self, store_id=None):
+        """Narrow the access for an API key: never ADMINISTER, and only the key's store if it has one."""
+        permissions = self.permissions & ~Permission.ADMINISTER
+        store_ids = self.store_ids
+        if store_id is not None:
+            permissions &= ~(Permission.VIEW_ALL_STORES | Permission.SELECT_ALL_STORES)
+            store_ids = frozenset([store_id])
+        return self._replace(permissions=permissions, store_ids=store_ids)
+
+# Access of anonymous users and unknown roles
+NO_ACCESS = Access(NO_PERMISSIONS, ItemType.ACCESSORIES, frozenset())
+
+def resolve_access(role, store_ids):
+    """Build the Access for a role and set of assigned store ids."""
+    if role not in ROLE_PERMISSIONS:
+        return NO_ACCESS._replace(store_ids=frozenset(store_ids))
+    return Access(ROLE_PERMISSIONS[role], ROLE_ITEM_TYPES[role], frozenset(store_ids))
+
+def get_access():
+    """Return the current user's Access, resolved once per request."""
+    if not current_user.is_authenticated:
+        return NO_ACCESS
+    
+    # Keyed by user id, since login_user can change the user during a request
+    cached = g.get('access')
+    if cached is None or cached[0] != current_user.id:
+        access = resolve_access(current_user.role, current_user.store_ids)
+        if getattr(current_user, 'is_api_key', False):
+            access = access.for_api_key(current_user.api_key_store_id)
+        cached = g.access = (current_user.id, access)
+    return cached[1]
+
+def scoped_store_id(store_id):
+    """
+    Check a requested store against the current user's store scope.
+    
+    Users who can see every store get store_id back as it is. Others get a 403
+    for a store outside their scope and, when they ask for no store, their
+    store if they only have one, so reports and summaries don't span all stores.
+    """
+    access = get_access()
+    if access.can(Permission.VIEW_ALL_STORES):
+        return store_id
+    if store_id is None:
+        return next(iter(access.store_ids)) if len(access.store_ids) == 1 else None
+    if store_id not in access.store_ids:
+        abort(403)
+    return store_id
+
+def scope_criteria(model, store_id=None, item_type=None, store_column=None):
+    """
+    Return the conditions that restrict an Inventory or Transaction query to a
+    store and to the stores and item types the current user may see.
+    
+    Args:
+        model: Inventory or Transaction
+        store_id (int, optional): Only rows of this store; a 403 if it is outside the user's stores
+        item_type (ItemType, optional): Only this item type; ignored when the user is limited to another
+        store_column (optional): Column to match the store on, for queries that join
+            Inventory but are about another table's store; defaults to model.store_id
+    
+    Returns:
+        list: SQL conditions
+    """
+    access = get_access()
+    if store_column is None:
+        store_column = model.store_id
+    
+    criteria = []
+    if store_id is not None:
+        if not access.has_store(store_id, Permission.VIEW_ALL_STORES):
+            abort(403)
+        criteria.append(store_column == store_id)
+    elif not access.can(Permission.VIEW_ALL_STORES):
+        criteria.append(store_column.in_(access.store_ids))
+    
+    item_type = access.effective_item_type(item_type)
+    if item_type is not None:
+        if model is Inventory:
+            criteria.append(Inventory.item_type == item_type)
+        elif model is Transaction:
+            # A subquery rather than a join, so it also applies to queries that already join Inventory
+            criteria.append(Transaction.item_id.in_(
+                sa.select(Inventory.id).where(Inventory.item_type == item_type)
+            ))
+        else:
+            raise ValueError(f'Cannot scope queries on {model.__name__}')
+    return criteria
+
+def scope_query(query, model, store_id=None, item_type=None):
+    """Filter an Inventory or Transaction query with scope_criteria."""
+    return query.filter(*scope_criteria(model, store_id, item_type))
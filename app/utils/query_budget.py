@@ -0,0 +1,73 @@
+"""
+Per-request query budget, used in tests to catch N+1 query regressions.
+"""
+import functools
+import sqlalchemy as sa
+from flask import g, request, has_request_context, current_app
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a request runs more queries than its budget allows."""
+    pass
+
+def query_budget(limit):
+    """
+    Decorator declaring how many queries a view may run per request.
+    Overrides the app-wide QUERY_BUDGET for that view.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            return f(*args, **kwargs)
+        decorated_function.query_budget = limit
+        return decorated_function
+    return decorator
+
+class QueryBudget:
+    """
+    Count the SQL statements each request runs and fail requests that go over budget.
+    
+    Enabled by QUERY_BUDGET_ENABLED, which defaults to on in testing. Views declare
+    their budget with @query_budget; others get QUERY_BUDGET (default 50). Only
+    queries run during the request itself count, not those run while a streamed
+    response body is generated.
+    """
+    
+    def __init__(self, app=None):
+        self.enabled = False
+        self.default_budget = 50
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read the budget settings from the app config and hook into requests."""
+        self.enabled = app.config.get('QUERY_BUDGET_ENABLED', app.testing)
+        self.default_budget = app.config.get('QUERY_BUDGET', 50)
+        app.extensions['query_budget'] = self
+        
+        if not self.enabled:
+            return
+        
+        if not sa.event.contains(sa.engine.Engine, 'before_cursor_execute', _count_query):
+            sa.event.listen(sa.engine.Engine, 'before_cursor_execute', _count_query)
+        app.before_request(self._start)
+        app.after_request(self._check)
+    
+    def _start(self):
+        view = current_app.view_functions.get(request.endpoint)
+        g.query_budget = getattr(view, 'query_budget', self.default_budget)
+        g.query_count = 0
+    
+    def _check(self, response):
+        budget = g.pop('query_budget', None)
+        count = g.pop('query_count', 0)
+        if budget is not None and count > budget:
+            raise QueryBudgetExceeded(
+                f"{request.method} {request.path} ran {count} queries, over its budget of {budget}"
+            )
+        return response
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+query_budget_guard = QueryBudget()
@@ -0,0 +1,133 @@
+"""
+Reconciliation of item quantities against the transaction ledger.
+
+An item's quantity should equal the sum of its ledger changes, but edits and
+manual fixes outside create_transaction can make the two drift apart. Each
+store's items are checked with one grouped query, which sums the ledger from
+the ix_transactions_item_changes index without reading the transaction rows;
+stores are spread over a pool of worker processes, each with its own
+database connection.
+"""
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import sqlalchemy as sa
+from app.models.db import db, TransactionType
+from app.models.inventory import Inventory
+from app.models.transaction import Transaction
+from app.utils.stock_summary import record_movements
+from app.utils.transactions import reserve_ticket_numbers
+
+class Drift(namedtuple('Drift', 'item_id store_id part_number item_type quantity ledger_total')):
+    """An item whose quantity doesn't match its ledger."""
+    __slots__ = ()
+    
+    @property
+    def difference(self):
+        """Units the ledger is missing (negative if it has too many)."""
+        return self.quantity - self.ledger_total
+
+# Engine of a worker process, created by _init_worker
+_worker_engine = None
+
+def find_drift(connection, store_id):
+    """
+    Find the items of a store whose quantity differs from the sum of their ledger changes.
+    
+    Returns:
+        list: Drift tuples
+    """
+    quantity = sa.func.coalesce(Inventory.quantity, 0)
+    ledger_total = sa.func.coalesce(sa.func.sum(Transaction.quantity_change), 0)
+    statement = sa.select(
+        Inventory.id, Inventory.store_id, Inventory.part_number, Inventory.item_type, quantity, ledger_total
+    ).outerjoin(
+        Transaction, Transaction.item_id == Inventory.id
+    ).where(
+        Inventory.store_id == store_id
+    ).group_by(Inventory.id).having(quantity != ledger_total)
+    
+    return [Drift(*row) for row in connection.execute(statement)]
+
+def _init_worker(database_uri):
+    global _worker_engine
+    _worker_engine = sa.create_engine(database_uri)
+
+def _find_store_drift(store_id):
+    with _worker_engine.connect() as connection:
+        return find_drift(connection, store_id)
+
+def reconcile(store_ids=None, workers=None):
+    """
+    Check every item of the given stores (all stores by default) against the ledger.
+    
+    Args:
+        store_ids (list, optional): Stores to check
+        workers (int, optional): Worker processes to use, by default one per CPU;
+            1 checks the stores in this process
+    
+    Returns:
+        list: Drift tuples, largest difference first
+    """
+    if store_ids is None:
+        store_ids = db.session.scalars(sa.select(Inventory.store_id).distinct()).all()
+    store_ids = list(store_ids)
+    workers = min(workers or os.cpu_count() or 1, len(store_ids))
+    
+    database_uri = db.engine.url.render_as_string(hide_password=False)
+    if workers <= 1 or db.engine.url.database in (None, '', ':memory:'):
+        connection = db.session.connection()
+        drifts = [drift for store_id in store_ids for drift in find_drift(connection, store_id)]
+    else:
+        # Spawn rather than fork, so workers don't inherit the app's open connections and threads
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(database_uri,)
+        ) as pool:
+            drifts = [drift for store_drifts in pool.map(_find_store_drift, store_ids) for drift in store_drifts]
+    
+    return sorted(drifts, key=lambda drift: (-abs(drift.difference), drift.store_id, drift.part_number))
+
+def write_adjustments(drifts, user_id, notes='Ledger reconciliation'):
+    """
+    Write a STOCK_ADJUSTMENT transaction for each drift, bringing the ledger in line
+    with the item's quantity. The quantities themselves are left as they are.
+    All rows are inserted in one statement; the caller commits.
+    
+    Args:
+        drifts (list): Drift tuples from reconcile
+        user_id (int): User recorded as making the adjustments
+        notes (str): Notes for the adjustment transactions
+    
+    Returns:
+        int: Number of adjustments written
+    """
+    if not drifts:
+        return 0
+    
+    timestamp = datetime.utcnow()
+    ticket_numbers = reserve_ticket_numbers(len(drifts))
+    db.session.execute(sa.insert(Transaction), [
+        {
+            'ticket_number': ticket_number,
+            'item_id': drift.item_id,
+            'user_id': user_id,
+            'store_id': drift.store_id,
+            'transaction_type': TransactionType.STOCK_ADJUSTMENT,
+            'quantity_change': drift.difference,
+            'timestamp': timestamp,
+            'notes': notes
+        }
+        for ticket_number, drift in zip(ticket_numbers, drifts)
+    ])
+    record_movements(
+        db.session.connection(),
+        ((drift.store_id, drift.item_type, drift.difference) for drift in drifts),
+        timestamp
+    )
+    
+    return len(drifts)
@@ -0,0 +1,81 @@
+"""
+Item search over the inventory_fts full-text index.
+"""
+import sqlalchemy as sa
+from app.models.db import db
+from app.models.inventory import Inventory
+from app.models.inventory_search import FTS_TABLE, search_index_supported
+
+# Column weights for ranking: a part number hit counts most, a description hit least
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+_fts = sa.table(FTS_TABLE, sa.column('rowid'))
+
+def build_match_query(text):
+    """
+    Turn user input into an FTS5 query that prefix-matches every word.
+    Each word is quoted, so FTS5 operators and punctuation in the input are treated as text.
+    """
+    terms = [term.replace('"', '') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+def search_condition(text):
+    """
+    Return a filter matching items whose part number, name or description contain
+    every word of the text as a prefix, for use in Inventory queries.
+    Text without any words (e.g. only quotes) matches nothing, as in search_items.
+    """
+    match_query = build_match_query(text)
+    if not match_query:
+        return sa.false()
+    
+    if search_index_supported(db.session.connection()):
+        matching_ids = sa.select(_fts.c.rowid).where(
+            sa.text(f'{FTS_TABLE} MATCH :match').bindparams(match=match_query)
+        )
+        return Inventory.id.in_(matching_ids)
+    
+    # Without FTS5, fall back to substring matching
+    return sa.and_(*[
+        sa.or_(
+            Inventory.part_number.icontains(term, autoescape=True),
+            Inventory.name.icontains(term, autoescape=True),
+            Inventory.description.icontains(term, autoescape=True)
+        )
+        for term in text.split()
+    ])
+
+def search_items(text, store_id=None, item_type=None, in_stock_only=False, limit=20):
+    """
+    Find items matching the text, best matches first.
+    
+    Args:
+        text (str): Words to look for; each one is matched as a prefix
+        store_id (int, optional): Only return items from this store
+        item_type (ItemType, optional): Only return items of this type
+        in_stock_only (bool): Only return items with a positive quantity
+        limit (int): Maximum number of items to return
+    
+    Returns:
+        list: Matching Inventory items
+    """
+    match_query = build_match_query(text)
+    if not match_query:
+        return []
+    
+    if search_index_supported(db.session.connection()):
+        rank = sa.text(f'bm25({FTS_TABLE}, {", ".join(str(w) for w in RANK_WEIGHTS)})')
+        query = Inventory.query.join(_fts, _fts.c.rowid == Inventory.id).filter(
+            sa.text(f'{FTS_TABLE} MATCH :match').bindparams(match=match_query)
+        ).order_by(rank)
+    else:
+        query = Inventory.query.filter(search_condition(text)).order_by(Inventory.part_number)
+    
+    if store_id is not None:
+        query = query.filter(Inventory.store_id == store_id)
+    if item_type is not None:
+        query = query.filter(Inventory.item_type == item_type)
+    if in_stock_only:
+        query = query.filter(Inventory.quantity > 0)
+    
+    return query.limit(limit).all()
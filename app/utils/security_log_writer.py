@@ -0,0 +1,150 @@
+"""
+Background writer that batches security log rows off the request thread.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from app.models.db import db
+from app.models.security_log import SecurityLog
+
+class SecurityLogWriter:
+    """
+    Buffer SecurityLog rows in a bounded queue and insert them from a worker thread.
+    
+    Rows are written in one transaction, as an executemany of a single INSERT, when
+    batch_size rows are waiting or flush_interval seconds have passed since the
+    first row of the batch arrived.
+    When the queue is full new rows are dropped and counted rather than blocking
+    the request; the event is still written to the application log by the caller.
+    """
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Read the writer settings from the app config and register the shutdown flush."""
+        self.app = app
+        self.enabled = app.config.get('SECURITY_LOG_ASYNC', not app.testing)
+        self.batch_size = app.config.get('SECURITY_LOG_BATCH_SIZE', 100)
+        self.flush_interval = app.config.get('SECURITY_LOG_FLUSH_INTERVAL', 1.0)
+        self._queue = queue.Queue(maxsize=app.config.get('SECURITY_LOG_QUEUE_SIZE', 10000))
+        app.extensions['security_log_writer'] = self
+        atexit.register(self.stop)
+    
+    def submit(self, log):
+        """
+        Queue a SecurityLog instance for writing.
+        Returns True if the row was queued, False if it was dropped.
+        """
+        self._ensure_worker()
+        row = {column.key: getattr(log, column.key) for column in SecurityLog.__table__.columns
+               if column.key != 'id'}
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+    
+    def stats(self):
+        """Return the queue depth and the writer counters."""
+        with self._stats_lock:
+            stats = dict(self._counters)
+        stats.update({
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'queue_capacity': self._queue.maxsize if self._queue is not None else 0,
+            'worker_alive': bool(self._thread and self._thread.is_alive()),
+        })
+        return stats
+    
+    def stop(self, timeout=5.0):
+        """Stop the worker and write out any rows still in the queue."""
+        if self._queue is None:
+            return
+        self._stop_event.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        
+        # Write whatever the worker didn't get to from the calling thread
+        batch = self._drain(self.batch_size)
+        while batch:
+            self._write(batch)
+            batch = self._drain(self.batch_size)
+    
+    def _ensure_worker(self):
+        """Start the worker thread in this process if it isn't running yet."""
+        # The pid check restarts the worker in processes forked after it was started
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='security-log-writer', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        """Worker loop: collect rows until the size or time trigger fires, then write them."""
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    return
+                continue
+            
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop_event.is_set():
+                    batch.extend(self._drain(self.batch_size - len(batch)))
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            self._write(batch)
+    
+    def _drain(self, limit):
+        """Take up to limit rows from the queue without waiting."""
+        rows = []
+        while len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+    
+    def _write(self, batch):
+        """Insert a batch of rows in one transaction, executing one INSERT for all of them."""
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(SecurityLog.__table__.insert(), batch)
+        except Exception as e:
+            self._count('failed', len(batch))
+            self.app.logger.error(f"Failed to write {len(batch)} security log rows: {str(e)}")
+            return
+        self._count('written', len(batch))
+        self._count('batches')
+    
+    def _count(self, counter, amount=1):
+        with self._stats_lock:
+            self._counters[counter] += amount
+
+security_log_writer = SecurityLogWriter()
@@ -0,0 +1,58 @@
+"""
+Aggregate statistics shared by the dashboard views and the stats API.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app.models.db import db, TransactionType
+from app.models.inventory import Inventory
+from app.models.transaction import Transaction
+from app.utils.stock_summary import get_stock_summary
+
+def get_inventory_stats(store_id, item_type=None):
+    """
+    Read all inventory buckets for a store from the maintained store_stock_summary rows.
+    
+    Args:
+        store_id (int): ID of the store
+        item_type (ItemType, optional): Restrict the stats to one item type
+    
+    Returns:
+        dict: total, out_of_stock, low_stock, healthy_stock, total_units and by_type counts
+    """
+    return get_stock_summary(store_id, item_type)
+
+def get_transaction_stats(store_id, item_type=None, days=7):
+    """
+    Count a store's recent transactions by type with one grouped query.
+    
+    Args:
+        store_id (int): ID of the store
+        item_type (ItemType, optional): Only count transactions for items of this type
+        days (int): How many days back to count
+    
+    Returns:
+        dict: total and by_type counts
+    """
+    since = datetime.utcnow() - timedelta(days=days)
+    
+    query = db.session.query(
+        Transaction.transaction_type,
+        func.count(Transaction.id)
+    ).filter(
+        Transaction.store_id == store_id,
+        Transaction.timestamp >= since
+    )
+    
+    if item_type is not None:
+        query = query.join(
+            Inventory, Transaction.item_id == Inventory.id
+        ).filter(Inventory.item_type == item_type)
+    
+    by_type = {t.value: 0 for t in TransactionType}
+    for t_type, count in query.group_by(Transaction.transaction_type):
+        by_type[t_type.value] = count
+    
+    return {
+        'total': sum(by_type.values()),
+        'by_type': by_type
+    }
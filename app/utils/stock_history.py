@@ -0,0 +1,355 @@
+"""
+Point-in-time stock reconstruction from the transaction ledger.
+
+An item's quantity at time t is its quantity at a checkpoint, adjusted by the
+changes booked between the checkpoint and t. The checkpoint is whichever is
+nearest to t: a daily snapshot in the stock_snapshots table, before or after t,
+or the current quantities. So only the changes between t and that checkpoint are
+read, however long the ledger is. The database sums them per item and per
+interval between the requested timestamps in one grouped query, and a cumulative
+sum over the intervals gives each quantity. NumPy is used for that step when it
+is installed, with a pure-Python fallback.
+
+Quantities follow the item id, wherever the item is; snapshots hold them per
+item only. The store an item was in at time t is read from the ledger instead:
+moving an item to another store (edit_item) books a TRANSFER_OUT in the old
+store and a TRANSFER_IN in the new one under the same item id, so the earliest
+transaction after t carries the store the item was in at t. An item moved
+while it had no stock leaves no such rows, and counts in its current store.
+"""
+from datetime import datetime, time, timedelta
+import sqlalchemy as sa
+from app.models.db import db
+from app.models.inventory import Inventory
+from app.models.stock_snapshot import StockSnapshot, StockSnapshotTime
+from app.models.transaction import Transaction
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+# Daily snapshots written per transaction when backfilling
+SNAPSHOT_BATCH_DAYS = 30
+
+def reconstruct_stock(timestamps, store_id=None, item_type=None):
+    """
+    Reconstruct item quantities at one or more points in time.
+    
+    Items are included at a timestamp only if they existed by then, and with
+    a store_id only if they were in that store then. Items that have since
+    been deleted can't be reconstructed, since their ledger rows are deleted
+    with them.
+    
+    Args:
+        timestamps (list): Naive UTC datetimes to reconstruct the stock at
+        store_id (int, optional): Only include items that were in this store
+        item_type (ItemType, optional): Only include items of this type
+    
+    Returns:
+        tuple: (items, quantities) where items is a list of dicts with id, part_number,
+        name, item_type and (current) store_id, and quantities[i][j] is the quantity of
+        items[i] at timestamps[j], or None if the item didn't exist yet or was elsewhere
+    """
+    timestamps = list(timestamps)
+    
+    criteria = []
+    if store_id is not None:
+        # Items there now, or with ledger rows there: the others were never in the store
+        criteria.append(sa.or_(
+            Inventory.store_id == store_id,
+            Inventory.id.in_(sa.select(Transaction.item_id).where(Transaction.store_id == store_id))
+        ))
+    if item_type is not None:
+        criteria.append(Inventory.item_type == item_type)
+    
+    # Plain Core queries: these can return a row per catalog item, and ORM row handling would dominate
+    connection = db.session.connection()
+    item_rows = connection.execute(
+        sa.select(
+            Inventory.id, Inventory.part_number, Inventory.name, Inventory.item_type,
+            Inventory.store_id, Inventory.quantity, Inventory.created_at
+        ).where(*criteria).order_by(Inventory.id)
+    ).all()
+    
+    items = [{
+        'id': row.id,
+        'part_number': row.part_number,
+        'name': row.name,
+        'item_type': row.item_type,
+        'store_id': row.store_id
+    } for row in item_rows]
+    if not items or not timestamps:
+        return items, [[] for _ in items]
+    
+    index_of = {row.id: i for i, row in enumerate(item_rows)}
+    
+    # Replay each timestamp from its nearest checkpoint; None stands for the current quantities
+    groups = {}
+    now = datetime.utcnow()
+    for j, timestamp in enumerate(timestamps):
+        groups.setdefault(_nearest_checkpoint(connection, timestamp, now), []).append(j)
+    
+    quantities = [[None] * len(timestamps) for _ in item_rows]
+    for checkpoint, positions in groups.items():
+        if checkpoint is None:
+            base = [row.quantity or 0 for row in item_rows]
+        else:
+            base = _snapshot_quantities(connection, checkpoint, index_of, criteria)
+        values = _replay(connection, checkpoint, base, [timestamps[j] for j in positions], index_of, criteria)
+        
+        for i, row in enumerate(item_rows):
+            for k, j in enumerate(positions):
+                if row.created_at is None or row.created_at <= timestamps[j]:
+                    quantities[i][j] = int(values[i][k])
+    
+    if store_id is not None:
+        for j, timestamp in enumerate(timestamps):
+            moved = moved_item_stores(timestamp)
+            for i, row in enumerate(item_rows):
+                if moved.get(row.id, row.store_id) != store_id:
+                    quantities[i][j] = None
+    
+    return items, quantities
+
+def moved_item_stores(timestamp):
+    """
+    Return {item_id: store_id} for the items that were in another store at the
+    timestamp than they are in now.
+    
+    Only items with a ledger row after the timestamp outside their current store
+    can have moved since; for those, the earliest row after the timestamp gives
+    the store they were in.
+    """
+    after = Transaction.timestamp > timestamp
+    moved = sa.select(Transaction.item_id).join(Inventory, Transaction.item_id == Inventory.id).where(
+        after, Transaction.store_id != Inventory.store_id
+    )
+    ranked = sa.select(
+        Transaction.item_id, Transaction.store_id,
+        sa.func.row_number().over(
+            partition_by=Transaction.item_id, order_by=(Transaction.timestamp, Transaction.id)
+        ).label('position')
+    ).where(after, Transaction.item_id.in_(moved)).subquery()
+    return dict(db.session.execute(
+        sa.select(ranked.c.item_id, ranked.c.store_id).where(ranked.c.position == 1)
+    ).all())
+
+def _nearest_checkpoint(connection, timestamp, now):
+    """
+    Return the snapshot time closest to the timestamp, or None if the current
+    quantities are closer than any snapshot.
+    """
+    if timestamp >= now:
+        return None
+    
+    candidates = [(now - timestamp, None)]
+    before = connection.scalar(
+        sa.select(sa.func.max(StockSnapshotTime.taken_at)).where(StockSnapshotTime.taken_at <= timestamp)
+    )
+    if before is not None:
+        candidates.append((timestamp - before, before))
+    after = connection.scalar(
+        sa.select(sa.func.min(StockSnapshotTime.taken_at)).where(StockSnapshotTime.taken_at >= timestamp)
+    )
+    if after is not None:
+        candidates.append((after - timestamp, after))
+    
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+def _snapshot_quantities(connection, taken_at, index_of, criteria):
+    """Read the quantities of a snapshot, in item order; items it leaves out are at zero."""
+    statement = sa.select(StockSnapshot.item_id, StockSnapshot.quantity).where(StockSnapshot.taken_at == taken_at)
+    if criteria:
+        statement = statement.join(Inventory, StockSnapshot.item_id == Inventory.id).where(*criteria)
+    
+    quantities = [0] * len(index_of)
+    for item_id, quantity in connection.execute(statement):
+        i = index_of.get(item_id)
+        if i is not None:
+            quantities[i] = quantity
+    return quantities
+
+def _replay(connection, checkpoint, base, timestamps, index_of, criteria):
+    """
+    Compute quantities at the timestamps from the quantities at a checkpoint.
+    
+    The timestamps and the checkpoint split the ledger into intervals; the changes
+    are summed per item and interval in SQL. With C the running total of those sums,
+    the quantity at boundary b is base + C[b] - C[checkpoint].
+    
+    Returns:
+        list: values[i][k], the quantity of item i at timestamps[k]
+    """
+    boundaries = sorted(set(timestamps) | ({checkpoint} if checkpoint is not None else set()))
+    position = {boundary: k for k, boundary in enumerate(boundaries)}
+    columns = [position[timestamp] for timestamp in timestamps]
+    # The current quantities sit after every change, in the interval past the last boundary
+    base_column = position[checkpoint] if checkpoint is not None else len(boundaries)
+    
+    # Interval k holds the changes after boundaries[k - 1] up to boundaries[k],
+    # and interval len(boundaries) everything after the last one
+    interval = sa.case(
+        *[(Transaction.timestamp <= boundary, k) for k, boundary in enumerate(boundaries)],
+        else_=len(boundaries)
+    )
+    # Changes up to the first boundary cancel out, and so do those after the last one
+    # unless replaying from the current quantities
+    window = [Transaction.timestamp > boundaries[0]]
+    if checkpoint is not None:
+        window.append(Transaction.timestamp <= boundaries[-1])
+    statement = sa.select(
+        Transaction.item_id, interval, sa.func.sum(Transaction.quantity_change)
+    ).where(*window).group_by(Transaction.item_id, interval)
+    if criteria:
+        statement = statement.join(Inventory, Transaction.item_id == Inventory.id).where(*criteria)
+    # Changes of items that no longer exist have nothing to attach to
+    interval_sums = [row for row in connection.execute(statement) if row[0] in index_of]
+    
+    replay = _replay_numpy if np is not None else _replay_python
+    return replay(interval_sums, index_of, base, columns, base_column, len(boundaries) + 1)
+
+def _replay_numpy(interval_sums, index_of, base, columns, base_column, width):
+    """Apply the per-interval change sums to the checkpoint quantities with NumPy."""
+    sums = np.zeros((len(base), width), dtype=np.int64)
+    if interval_sums:
+        item_ids, intervals, totals = zip(*interval_sums)
+        rows = np.fromiter((index_of[item_id] for item_id in item_ids), dtype=np.int64, count=len(item_ids))
+        sums[rows, np.array(intervals, dtype=np.int64)] = np.array(totals, dtype=np.int64)
+    
+    cumulative = np.cumsum(sums, axis=1)
+    offset = np.array(base, dtype=np.int64) - cumulative[:, base_column]
+    return cumulative[:, columns] + offset[:, None]
+
+def _replay_python(interval_sums, index_of, base, columns, base_column, width):
+    """Same as _replay_numpy, without NumPy."""
+    sums = [[0] * width for _ in base]
+    for item_id, interval, total in interval_sums:
+        sums[index_of[item_id]][interval] = total
+    
+    values = []
+    for item_base, item_sums in zip(base, sums):
+        cumulative = []
+        running = 0
+        for total in item_sums:
+            running += total
+            cumulative.append(running)
+        offset = item_base - cumulative[base_column]
+        values.append([offset + cumulative[column] for column in columns])
+    return values
+
+def write_snapshots(times):
+    """
+    Write stock snapshots at the given times, skipping times that already have one.
+    Snapshots hold quantities per item only; stores are attributed when they are
+    read (see moved_item_stores). Each finished time is recorded in
+    stock_snapshot_times, so a time with nothing in stock isn't reconstructed
+    again. The caller commits.
+    
+    Args:
+        times (list): Naive UTC datetimes, normally midnights
+    
+    Returns:
+        int: Number of snapshots written with at least one item row
+    """
+    connection = db.session.connection()
+    taken = snapshot_times(times)
+    missing = sorted({taken_at for taken_at in times if taken_at not in taken})
+    if not missing:
+        return 0
+    
+    items, quantities = reconstruct_stock(missing)
+    written = 0
+    for j, taken_at in enumerate(missing):
+        rows = [
+            {'taken_at': taken_at, 'item_id': item['id'], 'quantity': item_quantities[j]}
+            for item, item_quantities in zip(items, quantities)
+            if item_quantities[j]  # None (not created yet) and zero are both left out
+        ]
+        if rows:
+            connection.execute(sa.insert(StockSnapshot), rows)
+            written += 1
+        connection.execute(sa.insert(StockSnapshotTime).values(taken_at=taken_at, item_count=len(rows)))
+    return written
+
+def snapshot_times(times):
+    """Return the set of the given times that already have a finished snapshot."""
+    return set(db.session.scalars(
+        sa.select(StockSnapshotTime.taken_at).where(StockSnapshotTime.taken_at.in_(list(times)))
+    ))
+
+def last_midnight(now=None):
+    """Return the most recent UTC midnight, the time daily snapshots are taken at."""
+    now = now or datetime.utcnow()
+    return datetime.combine(now.date(), time.min)
+
+def backfill_snapshots(since, until=None):
+    """
+    Write a daily snapshot for every midnight from since to until that lacks one.
+    
+    Works from the newest day back, committing every SNAPSHOT_BATCH_DAYS days, so
+    each batch is replayed from the snapshots the batch before it just wrote.
+    
+    Args:
+        since (date): First day to snapshot
+        until (date, optional): Last day to snapshot, by default today
+    
+    Returns:
+        int: Number of snapshots written
+    """
+    day = until or last_midnight().date()
+    midnights = []
+    while day >= since:
+        midnights.append(datetime.combine(day, time.min))
+        day -= timedelta(days=1)
+    
+    written = 0
+    for start in range(0, len(midnights), SNAPSHOT_BATCH_DAYS):
+        written += write_snapshots(midnights[start:start + SNAPSHOT_BATCH_DAYS])
+        db.session.commit()
+    return written
+
+def stock_as_of(as_of, store_id=None, item_type=None):
+    """
+    Reconstruct every item's quantity at one point in time, with per-store totals.
+    Items are counted in the store they were in at that time.
+    
+    Args:
+        as_of (datetime): Naive UTC time to reconstruct the stock at
+        store_id (int, optional): Only include items that were in this store
+        item_type (ItemType, optional): Only include items of this type
+    
+    Returns:
+        dict: items (each with its quantity and store_id at that time) and stores
+        (item_count and total_units per store id)
+    """
+    items, quantities = reconstruct_stock([as_of], store_id, item_type)
+    moved = moved_item_stores(as_of)
+    
+    result_items = []
+    stores = {}
+    for item, (quantity,) in zip(items, quantities):
+        if quantity is None:
+            continue
+        item_store_id = moved.get(item['id'], item['store_id'])
+        result_items.append({**item, 'store_id': item_store_id, 'quantity': quantity})
+        store = stores.setdefault(item_store_id, {'item_count': 0, 'total_units': 0})
+        store['item_count'] += 1
+        store['total_units'] += quantity
+    
+    return {'items': result_items, 'stores': stores}
+
+def parse_as_of(value):
+    """
+    Parse an as-of time given as an ISO date or datetime (UTC).
+    A bare date means the end of that day, as for a month-end count.
+    
+    Raises:
+        ValueError: If the value isn't an ISO date or datetime
+    """
+    if len(value) == 10:
+        return datetime.combine(datetime.strptime(value, '%Y-%m-%d').date(), time.max)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        raise ValueError('Give the time in UTC without an offset')
+    return parsed
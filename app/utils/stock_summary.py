@@ -0,0 +1,318 @@
+"""
+Incremental maintenance of the per-store stock summary tables.
+
+store_stock_summary holds one row per (store, item type) with item counts by
+stock band and total units; store_stock_movement holds one row per (store,
+item type, day) with transaction counts and units moved. Both are updated in
+the same transaction as the stock change that affects them, so reading them
+is always consistent with the inventory table.
+"""
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app.models.db import db, ItemType
+from app.models.inventory import Inventory
+from app.models.transaction import Transaction
+from app.models.stock_summary import StoreStockSummary, StoreStockMovement
+
+# Items at or below their low stock threshold (but above zero) count as low stock;
+# this is the threshold of items without their own or a LOW_STOCK_THRESHOLDS entry
+LOW_STOCK_THRESHOLD = 5
+
+def threshold_for(item_type, own_threshold=None):
+    """
+    Return the low stock threshold of an item with the given type and own threshold:
+    the own threshold if set, else the type's from LOW_STOCK_THRESHOLDS, else LOW_STOCK_THRESHOLD.
+    """
+    if own_threshold is not None:
+        return own_threshold
+    return current_app.config.get('LOW_STOCK_THRESHOLDS', {}).get(item_type.value, LOW_STOCK_THRESHOLD)
+
+def low_stock_threshold(item):
+    """Return the quantity at or below which an item (or a row with its columns) counts as low stock."""
+    return threshold_for(item.item_type, item.low_stock_threshold)
+
+def low_stock_threshold_column():
+    """Return low_stock_threshold as an SQL expression over the inventory table."""
+    thresholds = current_app.config.get('LOW_STOCK_THRESHOLDS', {})
+    by_type = sa.case(
+        *[(Inventory.item_type == item_type, thresholds[item_type.value]) for item_type in ItemType
+          if item_type.value in thresholds],
+        else_=LOW_STOCK_THRESHOLD
+    ) if any(item_type.value in thresholds for item_type in ItemType) else sa.literal(LOW_STOCK_THRESHOLD)
+    return sa.func.coalesce(Inventory.low_stock_threshold, by_type)
+
+def _contribution(quantity, threshold):
+    """Return what a single item with the given quantity and low stock threshold adds to its summary row."""
+    quantity = quantity or 0
+    return {
+        'item_count': 1,
+        'out_of_stock_count': 1 if quantity <= 0 else 0,
+        'low_stock_count': 1 if 0 < quantity <= threshold else 0,
+        'total_units': quantity
+    }
+
+def _add_to_row(connection, table, key, deltas):
+    """Add deltas to the row identified by key, creating the row if it doesn't exist yet."""
+    increment = sa.update(table).where(
+        *[table.c[name] == value for name, value in key.items()]
+    ).values({name: table.c[name] + delta for name, delta in deltas.items()})
+    
+    if connection.execute(increment).rowcount == 0:
+        try:
+            # Use a savepoint so a concurrent insert of the same row doesn't abort the transaction
+            with connection.begin_nested():
+                connection.execute(sa.insert(table).values(**key, **deltas))
+        except IntegrityError:
+            connection.execute(increment)
+
+def apply_item_change(connection, old, new):
+    """
+    Move an item's contribution in store_stock_summary from its old state to its new one.
+    
+    Args:
+        connection: Connection to run the updates on (the session's, so they share its transaction)
+        old (tuple): (store_id, item_type, quantity, low_stock_threshold) before the change,
+            or None for a new item
+        new (tuple): (store_id, item_type, quantity, low_stock_threshold) after the change,
+            or None for a deleted item
+    """
+    deltas = {}
+    if old is not None:
+        key = (old[0], old[1])
+        for name, value in _contribution(old[2], old[3]).items():
+            deltas.setdefault(key, {}).setdefault(name, 0)
+            deltas[key][name] -= value
+    if new is not None:
+        key = (new[0], new[1])
+        for name, value in _contribution(new[2], new[3]).items():
+            deltas.setdefault(key, {}).setdefault(name, 0)
+            deltas[key][name] += value
+    
+    table = StoreStockSummary.__table__
+    for (store_id, item_type), row_deltas in deltas.items():
+        if any(row_deltas.values()):
+            _add_to_row(connection, table, {'store_id': store_id, 'item_type': item_type}, row_deltas)
+
+def record_movement(connection, store_id, item_type, quantity_change, timestamp):
+    """Count a transaction in store_stock_movement for the day it happened."""
+    _add_to_row(
+        connection,
+        StoreStockMovement.__table__,
+        {'store_id': store_id, 'item_type': item_type, 'day': timestamp.date()},
+        {
+            'transaction_count': 1,
+            'units_in': max(quantity_change, 0),
+            'units_out': max(-quantity_change, 0)
+        }
+    )
+
+def record_movements(connection, changes, timestamp):
+    """
+    Count a batch of transactions made at the same time in store_stock_movement,
+    with one update per (store, item type) instead of one per transaction.
+    
+    Args:
+        connection: Connection to run the updates on
+        changes (iterable): (store_id, item_type, quantity_change) tuples
+        timestamp (datetime): Time of the transactions
+    """
+    deltas = {}
+    for store_id, item_type, quantity_change in changes:
+        row_deltas = deltas.setdefault((store_id, item_type), {'transaction_count': 0, 'units_in': 0, 'units_out': 0})
+        row_deltas['transaction_count'] += 1
+        row_deltas['units_in'] += max(quantity_change, 0)
+        row_deltas['units_out'] += max(-quantity_change, 0)
+    
+    table = StoreStockMovement.__table__
+    for (store_id, item_type), row_deltas in deltas.items():
+        _add_to_row(connection, table, {'store_id': store_id, 'item_type': item_type, 'day': timestamp.date()}, row_deltas)
+
+def remove_item_movement(connection, item_id):
+    """Take an item's transactions out of store_stock_movement before they are deleted."""
+    day = sa.func.date(Transaction.timestamp)
+    rows = connection.execute(
+        sa.select(
+            Transaction.store_id,
+            Inventory.item_type,
+            day,
+            sa.func.count(Transaction.id),
+            sa.func.sum(sa.case((Transaction.quantity_change > 0, Transaction.quantity_change), else_=0)),
+            sa.func.sum(sa.case((Transaction.quantity_change < 0, -Transaction.quantity_change), else_=0))
+        ).join(
+            Inventory, Transaction.item_id == Inventory.id
+        ).where(Transaction.item_id == item_id).group_by(Transaction.store_id, Inventory.item_type, day)
+    )
+    
+    table = StoreStockMovement.__table__
+    for store_id, item_type, row_day, count, units_in, units_out in rows.all():
+        connection.execute(sa.update(table).where(
+            table.c.store_id == store_id,
+            table.c.item_type == item_type,
+            table.c.day == row_day
+        ).values(
+            transaction_count=table.c.transaction_count - count,
+            units_in=table.c.units_in - units_in,
+            units_out=table.c.units_out - units_out
+        ))
+
+def _item_state(item, previous=False):
+    """
+    Return an item's (store_id, item_type, quantity, low_stock_threshold),
+    optionally as it was before the flush.
+    """
+    state = sa.inspect(item)
+    values = []
+    for name in ('store_id', 'item_type', 'quantity', 'low_stock_threshold'):
+        history = state.attrs[name].history
+        if previous and history.deleted:
+            values.append(history.deleted[0])
+        else:
+            values.append(state.attrs[name].value)
+    store_id, item_type, quantity, own_threshold = values
+    return store_id, item_type, quantity, threshold_for(item_type, own_threshold)
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _update_summary_after_flush(session, flush_context):
+    """Keep store_stock_summary in step with inventory rows added, edited or deleted through the ORM."""
+    connection = session.connection()
+    
+    for obj in session.new:
+        if isinstance(obj, Inventory):
+            apply_item_change(connection, None, _item_state(obj))
+    
+    for obj in session.deleted:
+        if isinstance(obj, Inventory):
+            apply_item_change(connection, _item_state(obj, previous=True), None)
+    
+    for obj in session.dirty:
+        if isinstance(obj, Inventory) and obj not in session.deleted:
+            old, new = _item_state(obj, previous=True), _item_state(obj)
+            if old != new:
+                apply_item_change(connection, old, new)
+
+def rebuild_stock_summary():
+    """Recompute both summary tables from scratch from the inventory and transactions tables."""
+    summary = StoreStockSummary.__table__
+    movement = StoreStockMovement.__table__
+    
+    db.session.execute(sa.delete(summary))
+    db.session.execute(sa.delete(movement))
+    
+    db.session.execute(sa.insert(summary).from_select(
+        ['store_id', 'item_type', 'item_count', 'out_of_stock_count', 'low_stock_count', 'total_units'],
+        sa.select(
+            Inventory.store_id,
+            Inventory.item_type,
+            sa.func.count(Inventory.id),
+            sa.func.sum(sa.case((sa.func.coalesce(Inventory.quantity, 0) <= 0, 1), else_=0)),
+            sa.func.sum(sa.case((Inventory.quantity.between(1, low_stock_threshold_column()), 1), else_=0)),
+            sa.func.sum(sa.func.coalesce(Inventory.quantity, 0))
+        ).group_by(Inventory.store_id, Inventory.item_type)
+    ))
+    
+    day = sa.func.date(Transaction.timestamp)
+    db.session.execute(sa.insert(movement).from_select(
+        ['store_id', 'item_type', 'day', 'transaction_count', 'units_in', 'units_out'],
+        sa.select(
+            Transaction.store_id,
+            Inventory.item_type,
+            day,
+            sa.func.count(Transaction.id),
+            sa.func.sum(sa.case((Transaction.quantity_change > 0, Transaction.quantity_change), else_=0)),
+            sa.func.sum(sa.case((Transaction.quantity_change < 0, -Transaction.quantity_change), else_=0))
+        ).join(
+            Inventory, Transaction.item_id == Inventory.id
+        ).group_by(Transaction.store_id, Inventory.item_type, day)
+    ))
+    
+    db.session.commit()
+
+def get_stock_summary(store_id=None, item_type=None):
+    """
+    Read the stock bands for a store (or all stores) from store_stock_summary.
+    
+    Args:
+        store_id (int, optional): ID of the store; all stores if omitted
+        item_type (ItemType, optional): Restrict the summary to one item type
+    
+    Returns:
+        dict: total, out_of_stock, low_stock, healthy_stock, total_units and by_type counts
+    """
+    query = StoreStockSummary.query
+    if store_id is not None:
+        query = query.filter_by(store_id=store_id)
+    if item_type is not None:
+        query = query.filter_by(item_type=item_type)
+    
+    summary = {
+        'total': 0,
+        'out_of_stock': 0,
+        'low_stock': 0,
+        'healthy_stock': 0,
+        'total_units': 0,
+        'by_type': {t.value: 0 for t in ItemType}
+    }
+    
+    for row in query:
+        summary['total'] += row.item_count
+        summary['out_of_stock'] += row.out_of_stock_count
+        summary['low_stock'] += row.low_stock_count
+        summary['healthy_stock'] += row.item_count - row.out_of_stock_count - row.low_stock_count
+        summary['total_units'] += row.total_units
+        summary['by_type'][row.item_type.value] += row.item_count
+    
+    return summary
+
+def get_stock_movement(store_id=None, item_type=None, days=7):
+    """
+    Read a store's (or all stores') movement over the last few calendar days from store_stock_movement.
+    
+    Returns:
+        dict: transaction_count, units_in and units_out
+    """
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    query = db.session.query(
+        sa.func.coalesce(sa.func.sum(StoreStockMovement.transaction_count), 0),
+        sa.func.coalesce(sa.func.sum(StoreStockMovement.units_in), 0),
+        sa.func.coalesce(sa.func.sum(StoreStockMovement.units_out), 0)
+    ).filter(StoreStockMovement.day >= since)
+    
+    if store_id is not None:
+        query = query.filter(StoreStockMovement.store_id == store_id)
+    if item_type is not None:
+        query = query.filter(StoreStockMovement.item_type == item_type)
+    
+    transaction_count, units_in, units_out = query.one()
+    return {
+        'transaction_count': transaction_count,
+        'units_in': units_in,
+        'units_out': units_out
+    }
+
+def count_transactions(store_id=None, item_type=None, date_from=None, date_to=None):
+    """
+    Count transactions from store_stock_movement instead of scanning the ledger.
+    
+    Args:
+        store_id (int, optional): ID of the store; all stores if omitted
+        item_type (ItemType, optional): Only count transactions for items of this type
+        date_from (date, optional): First day to count
+        date_to (date, optional): Last day to count
+    
+    Returns:
+        int: Number of transactions
+    """
+    query = db.session.query(sa.func.coalesce(sa.func.sum(StoreStockMovement.transaction_count), 0))
+    
+    if store_id is not None:
+        query = query.filter(StoreStockMovement.store_id == store_id)
+    if item_type is not None:
+        query = query.filter(StoreStockMovement.item_type == item_type)
+    if date_from is not None:
+        query = query.filter(StoreStockMovement.day >= date_from)
+    if date_to is not None:
+        query = query.filter(StoreStockMovement.day <= date_to)
+    
+    return query.scalar()
\ No newline at end of file
@@ -1,45 +1,173 @@
 """
 Utility functions for managing inventory transactions.
 """
+import sqlalchemy as sa
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 from flask import current_app
 from app.models.db import db, TransactionType
 from app.models.transaction import Transaction
+from app.models.ticket_sequence import TicketSequence
 from app.models.inventory import Inventory
 from app.utils.auth import log_security_event
+from app.utils.unit_of_work import unit_of_work
+from app.utils.stock_summary import apply_item_change, record_movement, low_stock_threshold
+from app.utils.cache import invalidate_on_commit
+from app.utils.events import publish_on_commit
+from app.utils.alerts import on_stock_change
 from datetime import datetime
 
-def generate_ticket_number():
+# Name of the ticket_sequences row that numbers transaction tickets
+TICKET_SEQUENCE_NAME = 'transaction_ticket'
+
+# How many times a stock update is retried when another request changed the item first
+STOCK_UPDATE_RETRIES = 5
+
+class StockUpdateError(Exception):
+    """Base class for stock changes that could not be applied."""
+
+class InsufficientStockError(StockUpdateError):
+    """Raised when a guarded stock change would take the quantity below zero."""
+
+class StockConflictError(StockUpdateError):
+    """Raised when the item kept changing underneath a stock update."""
+
+def _seed_ticket_sequence():
     """
-    Generate a unique 10-digit ticket number starting with '33'.
-    Format: 33XXXXXXXX where X is a digit
+    Create the ticket sequence row, starting after the highest existing '33' ticket.
+    This is the only place the transactions table is scanned, and it runs once per database.
     """
-    # Find the maximum existing ticket number that starts with '33'
-    max_query = db.session.query(
+    max_number = db.session.query(
         func.max(
             func.cast(
                 func.substr(Transaction.ticket_number, 3),
                 db.Integer
             )
         )
-    ).filter(Transaction.ticket_number.like('33%'))
+    ).filter(Transaction.ticket_number.like('33%')).scalar()
+    
+    try:
+        # Use a savepoint so a concurrent worker seeding the same row doesn't abort our transaction
+        with db.session.begin_nested():
+            db.session.add(TicketSequence(name=TICKET_SEQUENCE_NAME, last_value=max_number or 0))
+    except IntegrityError:
+        # Another worker created the row first; its value is just as good
+        pass
+
+def generate_ticket_number():
+    """
+    Generate a unique 10-digit ticket number starting with '33'.
+    Format: 33XXXXXXXX where X is a digit
     
-    max_number = max_query.scalar()
+    The number is taken from the ticket_sequences counter row, which is incremented in
+    the caller's transaction. The row stays locked until that transaction ends, so
+    concurrent workers can never hand out the same number, and a rolled back
+    transaction gives its number back instead of leaving a gap.
+    """
+    return reserve_ticket_numbers(1)[0]
+
+def reserve_ticket_numbers(count):
+    """
+    Take count consecutive ticket numbers from the sequence with a single increment,
+    for writing a batch of transactions. Works like generate_ticket_number.
+    
+    Returns:
+        list: The ticket numbers, in order
+    """
+    sequence = TicketSequence.__table__
+    increment = sa.update(sequence).where(
+        sequence.c.name == TICKET_SEQUENCE_NAME
+    ).values(last_value=sequence.c.last_value + count)
+    
+    # If the sequence row doesn't exist yet, seed it from the existing tickets and retry
+    if db.session.execute(increment).rowcount == 0:
+        _seed_ticket_sequence()
+        db.session.execute(increment)
+    
+    last_number = db.session.execute(
+        sa.select(sequence.c.last_value).where(sequence.c.name == TICKET_SEQUENCE_NAME)
+    ).scalar()
+    
+    return [f'33{number:08d}' for number in range(last_number - count + 1, last_number + 1)]
+
+def update_stock_quantity(item_id, quantity_change, allow_negative=True, expected_version=None):
+    """
+    Atomically apply a quantity change to an inventory item in SQL.
     
-    # If no tickets exist yet, start with 1
-    if max_number is None:
-        max_number = 0
+    The change is issued as UPDATE ... SET quantity = quantity + :change, version = version + 1
+    WHERE id = :id AND version = :version, so concurrent changes to the same item are never lost.
+    If another request changed the item first the update is retried with the new version,
+    unless expected_version is given, in which case the caller's view of the item is stale
+    and StockConflictError is raised straight away.
+    
+    Args:
+        item_id (int): ID of the inventory item
+        quantity_change (int): Change in quantity (positive for additions, negative for removals)
+        allow_negative (bool): If False, raise InsufficientStockError instead of going below zero
+        expected_version (int, optional): Version the caller computed the change against
         
-    # Generate the new ticket number
-    new_number = max_number + 1
-    ticket_number = f'33{new_number:08d}'
+    Returns:
+        int: The new quantity, or None if the item doesn't exist
+    """
+    inventory = Inventory.__table__
+    attempts = 1 if expected_version is not None else STOCK_UPDATE_RETRIES
+    
+    for _ in range(attempts):
+        current = db.session.execute(
+            sa.select(
+                inventory.c.quantity, inventory.c.version, inventory.c.store_id, inventory.c.item_type,
+                inventory.c.low_stock_threshold
+            ).where(inventory.c.id == item_id)
+        ).first()
+        if current is None:
+            return None
+        
+        version = current.version if expected_version is None else expected_version
+        conditions = [inventory.c.id == item_id, inventory.c.version == version]
+        if not allow_negative:
+            # Guard in the statement itself so the check and the write can't be separated
+            if (current.quantity or 0) + quantity_change < 0:
+                raise InsufficientStockError(f"Not enough stock: {current.quantity} available")
+            conditions.append(inventory.c.quantity + quantity_change >= 0)
+        
+        result = db.session.execute(
+            sa.update(inventory).where(*conditions).values(
+                quantity=inventory.c.quantity + quantity_change,
+                version=inventory.c.version + 1,
+                updated_at=datetime.utcnow()
+            )
+        )
+        
+        if result.rowcount == 1:
+            new_quantity = (current.quantity or 0) + quantity_change
+            
+            # Move the item between stock bands in the same transaction
+            threshold = low_stock_threshold(current)
+            apply_item_change(
+                db.session.connection(),
+                (current.store_id, current.item_type, current.quantity, threshold),
+                (current.store_id, current.item_type, new_quantity, threshold)
+            )
+            
+            # Keep an already loaded item in sync without marking it dirty
+            item = db.session.identity_map.get(sa.inspect(Inventory).identity_key_from_primary_key((item_id,)))
+            if item is not None:
+                set_committed_value(item, 'quantity', new_quantity)
+                set_committed_value(item, 'version', version + 1)
+            
+            return new_quantity
     
-    return ticket_number
+    raise StockConflictError(f"Inventory item {item_id} was changed by another request")
 
-def create_transaction(item_id, user_id, store_id, transaction_type, quantity_change, notes=None):
+def create_transaction(item_id, user_id, store_id, transaction_type, quantity_change, notes=None,
+                       allow_negative=True, expected_version=None):
     """
     Create a new transaction record.
     
+    Commits on its own unless called inside an open unit of work, in which case
+    the writes are committed by the outermost unit of work.
+    
     Args:
         item_id (int): ID of the inventory item
         user_id (int): ID of the user creating the transaction
@@ -47,39 +175,60 @@ def create_transaction(item_id, user_id, store_id, transaction_type, quantity_ch
         transaction_type (TransactionType): Type of transaction
         quantity_change (int): Change in quantity (positive for additions, negative for removals)
         notes (str, optional): Additional notes about the transaction
+        allow_negative (bool): If False, refuse changes that would take the quantity below zero
+        expected_version (int, optional): Item version the change was computed against
         
     Returns:
         Transaction: The created transaction record
+        
+    Raises:
+        InsufficientStockError: If allow_negative is False and there isn't enough stock
+        StockConflictError: If the item changed since expected_version or kept changing
     """
-    # Generate a unique ticket number
-    ticket_number = generate_ticket_number()
-    
-    # Create the transaction record
-    transaction = Transaction(
-        ticket_number=ticket_number,
-        item_id=item_id,
-        user_id=user_id,
-        store_id=store_id,
-        transaction_type=transaction_type,
-        quantity_change=quantity_change,
-        timestamp=datetime.utcnow(),
-        notes=notes
-    )
-    
-    db.session.add(transaction)
-    
-    # Update the inventory item quantity
-    item = Inventory.query.get(item_id)
-    if item:
-        item.quantity += quantity_change
+    # The ledger row, quantity update and audit row are committed together
+    with unit_of_work():
+        # Generate a unique ticket number
+        ticket_number = generate_ticket_number()
         
-        # Log the transaction
-        log_security_event(
-            'inventory_transaction', 
-            f"{transaction_type.value} transaction: {ticket_number} - Item: {item.part_number} - Qty: {quantity_change}"
+        # Create the transaction record
+        transaction = Transaction(
+            ticket_number=ticket_number,
+            item_id=item_id,
+            user_id=user_id,
+            store_id=store_id,
+            transaction_type=transaction_type,
+            quantity_change=quantity_change,
+            timestamp=datetime.utcnow(),
+            notes=notes
         )
-    
-    db.session.commit()
+        
+        db.session.add(transaction)
+        
+        # Update the inventory item quantity in a single guarded UPDATE
+        new_quantity = update_stock_quantity(item_id, quantity_change, allow_negative, expected_version)
+        if new_quantity is not None:
+            item = Inventory.query.get(item_id)
+            record_movement(db.session.connection(), store_id, item.item_type, quantity_change, transaction.timestamp)
+            on_stock_change(item, new_quantity - quantity_change, new_quantity)
+            invalidate_on_commit(store_id)
+            invalidate_on_commit(item.store_id)
+            
+            # Push the change to open dashboards once it is committed
+            event = {
+                'item_id': item.id,
+                'item_type': item.item_type.value,
+                'quantity': new_quantity,
+                'transaction_type': transaction_type.value,
+                'ticket_number': ticket_number
+            }
+            for event_store_id in {store_id, item.store_id}:
+                publish_on_commit(event_store_id, event)
+            
+            # Log the transaction
+            log_security_event(
+                'inventory_transaction', 
+                f"{transaction_type.value} transaction: {ticket_number} - Item: {item.part_number} - Qty: {quantity_change}"
+            )
     
     return transaction
 
@@ -123,7 +272,8 @@ def register_outgoing_accessory(item_id, user_id, store_id, notes=None):
             store_id=store_id,
             transaction_type=TransactionType.REMOVE,
             quantity_change=-1,
-            notes=notes if notes else "User-registered outgoing accessory"
+            notes=notes if notes else "User-registered outgoing accessory",
+            allow_negative=False
         )
         
         # Return the transaction details
@@ -136,6 +286,10 @@ def register_outgoing_accessory(item_id, user_id, store_id, notes=None):
         
         return True, "Item registered successfully", transaction_data
         
+    except InsufficientStockError:
+        # Another request took the last unit after the check above
+        return False, "Item is out of stock", None
+        
     except Exception as e:
         current_app.logger.error(f"Error registering outgoing accessory: {str(e)}")
         db.session.rollback()
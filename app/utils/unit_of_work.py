@@ -0,0 +1,33 @@
+"""
+Request-scoped unit of work for grouping database writes into a single commit.
+"""
+from contextlib import contextmanager
+from flask import g
+from app.models.db import db
+
+def in_unit_of_work():
+    """Return True if the caller is running inside an open unit of work."""
+    return g.get('unit_of_work_depth', 0) > 0
+
+@contextmanager
+def unit_of_work():
+    """
+    Group the writes of one business operation into a single atomic commit.
+    
+    Units of work nest: only the outermost one commits, and an exception raised
+    anywhere inside rolls back every write made since it was opened. Helpers like
+    create_transaction and log_security_event skip their own commit while a unit
+    of work is open, so a transfer is flushed and committed exactly once.
+    """
+    depth = g.get('unit_of_work_depth', 0)
+    g.unit_of_work_depth = depth + 1
+    try:
+        yield db.session
+        if depth == 0:
+            db.session.commit()
+    except Exception:
+        if depth == 0:
+            db.session.rollback()
+        raise
+    finally:
+        g.unit_of_work_depth = depth
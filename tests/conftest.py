@@ -0,0 +1,23 @@
+import pytest
+from app import create_app
+from app.models.db import db
+from app.models.init_db import seed_database
+
+@pytest.fixture
+def app(tmp_path):
+    """A seeded app on its own database, with the query budget guard on as in any test run."""
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+        'WTF_CSRF_ENABLED': False,
+        'RATELIMIT_ENABLED': False,
+        'PASSWORD_HASH_WORKERS': 0,
+        'ARGON2_TIME_COST': 1,
+        'ARGON2_MEMORY_COST': 1024,
+        'ARGON2_PARALLELISM': 1,
+    })
+    with app.app_context():
+        db.create_all()
+        seed_database()
+    return app
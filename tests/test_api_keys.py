@@ -0,0 +1,96 @@
+"""
+A store-bound API key must stay in its store, on every route that takes a store or an item.
+"""
+import pytest
+from app.models.db import db
+from app.models.inventory import Inventory
+from app.models.store import Store
+from app.models.user import User
+from app.utils.api_keys import create_api_key
+
+@pytest.fixture
+def scoped_key(app):
+    """A key of the global admin, bound to the main store; returns (headers, main store id, other store id)."""
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        main = Store.query.filter_by(name='Main Warehouse').first()
+        other = Store.query.filter_by(name='Downtown Store').first()
+        api_key, key = create_api_key(admin, 'pos-main', store_id=main.id)
+        db.session.commit()
+        return {'Authorization': f'Bearer {key}'}, main.id, other.id
+
+def item_in(app, store_id):
+    with app.app_context():
+        item = Inventory.query.filter_by(store_id=store_id).filter(Inventory.quantity > 0).first()
+        return item.id, item.quantity
+
+def test_reports_refuse_other_stores(app, scoped_key):
+    headers, main_id, other_id = scoped_key
+    client = app.test_client()
+    
+    for url in ('/admin/reports/inventory/export', '/admin/reports/transactions/export',
+                '/admin/api/stock-as-of?at=2100-01-01&format=json'):
+        separator = '&' if '?' in url else '?'
+        response = client.get(f'{url}{separator}store_id={other_id}', headers=headers)
+        assert response.status_code == 403, url
+    
+    # Without a store, the export only has the key's store
+    response = client.get('/admin/reports/inventory/export?format=jsonl', headers=headers)
+    assert response.status_code == 200
+    with app.app_context():
+        main_name = db.session.get(Store, main_id).name
+    rows = [line for line in response.get_data(as_text=True).splitlines() if line]
+    assert rows and all(f'"store": "{main_name}"' in row for row in rows)
+    
+    response = client.get('/admin/api/stock-as-of?at=2100-01-01', headers=headers)
+    assert set(response.get_json()['stores']) == {str(main_id)}
+
+def test_item_changes_refuse_other_stores(app, scoped_key):
+    headers, main_id, other_id = scoped_key
+    client = app.test_client()
+    other_item_id, other_quantity = item_in(app, other_id)
+    main_item_id, main_quantity = item_in(app, main_id)
+    
+    client.post(f'/inventory/items/{other_item_id}/adjust', headers=headers,
+                data={'adjustment_type': 'add', 'quantity': 3})
+    client.post('/inventory/transfer', headers=headers, data={
+        'source_store_id': main_id, 'destination_store_id': other_id,
+        'item_id': main_item_id, 'quantity': 1
+    })
+    with app.app_context():
+        assert db.session.get(Inventory, other_item_id).quantity == other_quantity
+        assert db.session.get(Inventory, main_item_id).quantity == main_quantity
+    
+    # Its own store's items can still be adjusted
+    client.post(f'/inventory/items/{main_item_id}/adjust', headers=headers,
+                data={'adjustment_type': 'add', 'quantity': 3})
+    with app.app_context():
+        assert db.session.get(Inventory, main_item_id).quantity == main_quantity + 3
+
+def user_key(app, username):
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        api_key, key = create_api_key(user, 'erp')
+        db.session.commit()
+        return user.id, {'Authorization': f'Bearer {key}'}, f'/inventory/api/items/by-store/{user.stores[0].id}'
+
+def test_locking_a_user_stops_cached_keys(app):
+    user_id, headers, url = user_key(app, 'user1')
+    client = app.test_client()
+    assert client.get(url, headers=headers).status_code == 200
+    
+    admin = app.test_client()
+    admin.post('/auth/login', data={'username': 'admin', 'password': 'admin123'})
+    admin.post(f'/auth/users/{user_id}/edit', data={'username': 'user1', 'role': 'user', 'is_locked': 'y'})
+    assert client.get(url, headers=headers).status_code == 401
+
+def test_failed_login_lock_stops_cached_keys(app):
+    user_id, headers, url = user_key(app, 'user1')
+    client = app.test_client()
+    assert client.get(url, headers=headers).status_code == 200
+    
+    for _ in range(app.config.get('MAX_LOGIN_ATTEMPTS', 5)):
+        app.test_client().post('/auth/login', data={'username': 'user1', 'password': 'wrong'})
+    with app.app_context():
+        assert db.session.get(User, user_id).is_locked
+    assert client.get(url, headers=headers).status_code == 401
@@ -0,0 +1,32 @@
+"""
+Views declare a query budget with @query_budget; in testing, going over it fails the request.
+"""
+import pytest
+import sqlalchemy as sa
+from app.models.db import db
+from app.utils.query_budget import query_budget, QueryBudgetExceeded
+
+def add_view(app, budget, queries):
+    @query_budget(budget)
+    def run_queries():
+        for _ in range(queries):
+            db.session.execute(sa.text('SELECT 1'))
+        return 'ok'
+    app.add_url_rule('/test/queries', 'run_queries', run_queries)
+
+def test_guard_is_on_in_testing(app):
+    assert app.extensions['query_budget'].enabled
+
+def test_view_within_budget(app):
+    add_view(app, budget=3, queries=3)
+    assert app.test_client().get('/test/queries').status_code == 200
+
+def test_view_over_budget(app):
+    add_view(app, budget=2, queries=3)
+    with pytest.raises(QueryBudgetExceeded, match='ran 3 queries, over its budget of 2'):
+        app.test_client().get('/test/queries')
+
+def test_inventory_report_within_budget(app):
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'admin', 'password': 'admin123'})
+    assert client.get('/admin/reports/inventory').status_code == 200